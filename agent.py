@@ -1,8 +1,14 @@
-from logger_config import logger
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from logger_config import logger, query_context
 from utils import extract_json_manually
+from streaming import JSONFieldStream
+from history import History, Episode, Action, count_tokens
+from tracing import tracer
 import json
 from llama_index.core.llms import ChatMessage
-from prompts import react_prompt
+from prompts import react_prompt, plan_prompt
 from termcolor import colored
 
 class ReAct:
@@ -11,47 +17,102 @@ class ReAct:
 
     Attributes:
         tools (list): A list of tools available for the agent.
-        history (list): A list to maintain the history of interactions.
+        history (History): The history of interactions, rendered within a token budget for the prompt.
         llm (object): The language model used for generating responses.
         max_steps (int): Maximum number of steps the agent will take in a single query.
+        verbose (bool): Whether to print the steps to the terminal.
+        stream (bool): Whether to stream the LLM response and start the tool before the response is complete.
+        listener (callable): Called with a dict for every thought, action, observation and the final answer as they
+            happen, e.g. to stream the steps to a client. May be None.
 
     Methods:
-        __init__(tools, history, llm, max_steps=10): Initializes the ReAct agent with tools, history, LLM, and max steps.
+        __init__(tools, history, llm, max_steps=10, verbose=True, stream=False, listener=None): Initializes the ReAct agent with tools, history, LLM, and max steps.
+        spawn(listener=None): Returns an agent with its own history and tool state for running one more query.
         update_history(episode): Updates the interaction history.
         _run(query, max_retries=3): Runs a single step of the agent's loop with retries for JSON decoding.
+        _run_stream(query, iteration, max_retries=3): Streaming counterpart of _run that dispatches the tool early.
         agentloop(query): Main loop for the agent to process the query and produce results.
     """
 
-    def __init__(self, tools, history, llm, max_steps=10):
+    prompt_template = react_prompt.DEFAULT_PROMPT
+
+    def __init__(self, tools, history, llm, max_steps=10, verbose=True, stream=False, listener=None):
         """
         Initializes the ReAct agent with tools, history, LLM, and max steps.
 
         Args:
             tools (list): A list of tools available for the agent.
-            history (list): A list to maintain the history of interactions.
+            history (History or list): The history of interactions. A list of strings is wrapped in a History with
+                the default token budget.
             llm (object): The language model used for generating responses.
             max_steps (int, optional): Maximum number of steps the agent will take in a single query. Defaults to 10.
+            verbose (bool, optional): Whether to print the steps to the terminal. Defaults to True.
+            stream (bool, optional): Whether to stream LLM responses with early tool dispatch. Defaults to False.
+            listener (callable, optional): Receives every step as an event dict. Defaults to None.
         """
         self.tools = tools
-        self.history = history
+        self.history = history if isinstance(history, History) else History(history)
         self.llm = llm
         self.max_steps = max_steps
+        self.verbose = verbose
+        self.stream = stream
+        self.listener = listener
         tool_descriptions = "\n".join([f"{tool.__class__.__name__.lower()}: {tool.run.__doc__}" for tool in tools])
         self.tool_descriptions = tool_descriptions
         logger.info("ReAct agent initialized with tools: %s", [tool.__class__.__name__ for tool in tools])
 
+    def spawn(self, listener=None):
+        """
+        Returns an agent for one more query that shares this agent's LLM and loaded tools but has an empty history
+        and its own tool sessions, so several queries can run in parallel without seeing each other's state.
+
+        Args:
+            listener (callable, optional): Receives the steps of the new agent, see the listener attribute.
+
+        Returns:
+            ReAct: The new agent.
+        """
+        return self.__class__([tool.session() for tool in self.tools], self.history.fresh(), self.llm,
+                              max_steps=self.max_steps,
+                              verbose=self.verbose, stream=self.stream, listener=listener)
+
+    def _emit(self, event, **fields):
+        if self.listener is not None:
+            try:
+                self.listener({"event": event, **fields})
+            except Exception as e:
+                logger.error(f"Step listener failed on {event}: {e}")
+
+    def _print(self, text):
+        if self.verbose:
+            print(text)
+
     def update_history(self, episode):
         """
         Updates the interaction history.
 
         Args:
-            episode (str): The latest episode to be added to the history.
+            episode (Episode or str): The latest episode to be added to the history.
         """
-        if len(self.history) > 3:
-            self.history = self.history[1:]
         self.history.append(episode)
         logger.debug("History updated")
 
+    def _messages(self, query):
+        history_string = self.history.render(query)
+        prompt = self.prompt_template.format(query=query, history=history_string,
+                                             tool_descriptions=self.tool_descriptions)
+        return [ChatMessage(role="system", content=react_prompt.system_prompt),
+                ChatMessage(role="user", content=prompt)]
+
+    @staticmethod
+    def _decode(response):
+        try:
+            result = json.loads(response)
+        except json.decoder.JSONDecodeError:
+            logger.warning("JSON decode error. Trying manual extraction.")
+            result = extract_json_manually(response)
+        return result if isinstance(result, dict) else None
+
     def _run(self, query, max_retries=3):
         """
         Runs a single step of the agent's loop with retries for JSON decoding.
@@ -63,26 +124,18 @@ class ReAct:
         Returns:
             tuple: A tuple containing thought, action, and action input.
         """
-        for i in range(max_retries):
-            history_string = "\n\n".join(self.history)
-            prompt = react_prompt.DEFAULT_PROMPT.format(query=query, history=history_string,
-                                                        tool_descriptions=self.tool_descriptions)
-
-            response = self.llm.chat([ChatMessage(role="system", content=react_prompt.system_prompt),
-                                      ChatMessage(role="user", content=prompt)]
-                                     ).message.content
-
-            try:
-                result = json.loads(response)
-                break
-            except json.decoder.JSONDecodeError:
-                logger.warning("JSON decode error. Trying manual extraction.")
-                result = extract_json_manually(response)
+        with tracer.span("llm", stream=False) as span:
+            for i in range(max_retries):
+                messages = self._messages(query)
+                response = self.llm.chat(messages).message.content
+                self._record_call(span, messages, response)
+                result = self._decode(response)
                 if result:
                     break
-        else:
-            logger.error("Failed to decode JSON after %d retries.", max_retries)
-            result = {}
+                span.add("json_retries")
+            else:
+                logger.error("Failed to decode JSON after %d retries.", max_retries)
+                result = {}
 
         thought = result.get("thought", "Empty")
         action = result.get("action", "Empty")
@@ -90,51 +143,432 @@ class ReAct:
 
         return thought, action, action_input
 
+    @staticmethod
+    def _record_call(span, messages, response):
+        """Adds the size of one LLM call to its span, only counting tokens while tracing."""
+        span.add("calls")
+        if span.recording:
+            span.add("prompt_tokens", count_tokens("\n".join(str(message.content) for message in messages)))
+            span.add("completion_tokens", count_tokens(response or ""))
+
+    def _run_stream(self, query, iteration, max_retries=3):
+        """
+        Runs a single step of the agent's loop on a streamed LLM response. The thought is printed as it streams, and
+        the tool is started in the background as soon as the action and its input are complete, so it runs while
+        the rest of the response is still being generated.
+
+        Args:
+            query (str): The query to be processed.
+            iteration (int): The current iteration, used when printing the thought.
+            max_retries (int, optional): Maximum number of retries for JSON decoding. Defaults to 3.
+
+        Returns:
+            tuple: The thought, action and action input, and a future with the tool's observation or None when the
+            tool was not started early.
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = None
+        try:
+            with tracer.span("llm", stream=True) as span:
+                for i in range(max_retries):
+                    parser = JSONFieldStream()
+                    fields = {}
+                    self._print_stream(f"\n{colored(f'THOUGHT {iteration}', 'red', attrs=['bold'])} :")
+                    messages = self._messages(query)
+                    for chunk in self.llm.stream_chat(messages):
+                        for event, key, value in parser.feed(chunk.delta or ""):
+                            if event == "partial" and key == "thought":
+                                self._print_stream(value)
+                            elif event == "complete":
+                                fields[key] = value
+                        if (pending is None and "action" in fields and "input" in fields
+                                and fields["action"] != "finish"):
+                            tool = self._find_tool(fields["action"])
+                            if tool is not None and tool.dispatch_early:
+                                logger.info("Dispatching tool %s before the response finished", tool.__class__.__name__)
+                                span.set(dispatched_early=tool.__class__.__name__)
+                                # Copy the context so the tool's spans belong to this trace
+                                pending = executor.submit(contextvars.copy_context().run, tool.run, fields["input"])
+                    self._print_stream("\n")
+                    self._record_call(span, messages, parser.text)
+                    result = fields if "action" in fields else self._decode(parser.text)
+                    if result:
+                        break
+                    span.add("json_retries")
+                else:
+                    logger.error("Failed to decode JSON after %d retries.", max_retries)
+                    result = {}
+        finally:
+            executor.shutdown(wait=False)
+
+        thought = result.get("thought", "Empty")
+        action = result.get("action", "Empty")
+        action_input = result.get("input", "Empty")
+
+        return thought, action, action_input, pending
+
+    def _print_stream(self, text):
+        if self.verbose:
+            print(text, end="", flush=True)
+
+    def _find_tool(self, action):
+        return next((tool for tool in self.tools if action == tool.__class__.__name__.lower()), None)
+
     def agentloop(self, query):
         """
         Main loop for the agent to process the query and produce results.
 
         Args:
             query (str): The query to be processed.
+
+        Returns:
+            dict: The final answer (None when the agent never finished) and the list of steps taken.
         """
-        logger.info("Running query: %s", query)
-        print(f"{colored('QUERY', 'cyan', attrs=['bold'])}: {colored(f'{query}', 'green')}")
+        with query_context() as query_id, tracer.span("agentloop", agent=self.__class__.__name__,
+                                                       query_id=query_id) as span:
+            result = self._agentloop(query)
+            span.set(steps=len(result["steps"]), finished=result["final_answer"] is not None)
+        return result
 
-        iteration = 1
+    def _agentloop(self, query, iteration=1, steps=None):
+        # Subclasses may hand over a query they already took the first steps of
+        if steps is None:
+            logger.info("Running query: %s", query)
+            self._print(f"{colored('QUERY', 'cyan', attrs=['bold'])}: {colored(f'{query}', 'green')}")
+
+        final_answer = None
+        steps = [] if steps is None else steps
         while iteration <= self.max_steps:
             logger.info("Iteration %d", iteration)
-            current_thought, current_action, current_action_input = self._run(query)
+            if self.stream:
+                current_thought, current_action, current_action_input, pending = self._run_stream(query, iteration)
+            else:
+                current_thought, current_action, current_action_input = self._run(query)
+                pending = None
+                # Print essential information to the terminal
+                self._print(f"\n{colored(f'THOUGHT {iteration}', 'red', attrs=['bold'])} :{current_thought}")
+            step = {"thought": current_thought, "action": current_action, "input": current_action_input}
+            steps.append(step)
+            self._emit("thought", iteration=iteration, thought=current_thought)
+            self._emit("action", iteration=iteration, action=current_action, input=current_action_input)
 
-            # Print essential information to the terminal
-            print(f"\n{colored(f'THOUGHT {iteration}', 'red', attrs=['bold'])} :{current_thought}")
-            print(f"{colored(f'ACTION {iteration}', 'red', attrs=['bold'])} :{current_action}")
-            print(f"{colored(f'ACTION INPUT {iteration}', 'red', attrs=['bold'])} :{current_action_input}")
+            self._print(f"{colored(f'ACTION {iteration}', 'red', attrs=['bold'])} :{current_action}")
+            self._print(f"{colored(f'ACTION INPUT {iteration}', 'red', attrs=['bold'])} :{current_action_input}")
 
             if current_action == "finish":
                 logger.info("Finish action received. Exiting loop.")
-                self.update_history(current_action_input)
+                final_answer = current_action_input
                 break
             else:
-                current_tool = next((tool for tool in self.tools if current_action == tool.__class__.__name__.lower()),
-                                    None)
+                current_tool = self._find_tool(current_action)
                 if current_tool is None:
                     logger.error("No matching tool found for action: %s", current_action)
                     break
                 logger.info("Using tool: %s", current_tool.__class__.__name__)
-                observation = current_tool.run(current_action_input)
+                # An early dispatched tool already runs, its span then only covers waiting for the result
+                with tracer.span("tool", tool=current_action, iteration=iteration,
+                                 dispatched_early=pending is not None):
+                    observation = pending.result() if pending is not None else current_tool.run(current_action_input)
+                step["observation"] = observation
+                self._emit("observation", iteration=iteration, action=current_action, observation=observation)
 
                 # Print observation to the terminal
-                print(f"\n{colored(f'OBSERVATION {iteration}', 'red', attrs=['bold'])}: \n{observation}\n")
-
-            episode = "\n".join([
-                f"{colored(f'THOUGHT {iteration}', 'red', attrs=['bold'])} :{current_thought}",
-                f"{colored(f'ACTION {iteration}', 'red', attrs=['bold'])} :{current_action}",
-                f"{colored(f'ACTION INPUT {iteration}', 'red', attrs=['bold'])} :{current_action_input}",
-                f"{colored(f'OBSERVATION {iteration}', 'red', attrs=['bold'])} :{observation}"
-            ])
-            self.update_history(episode)
+                self._print(f"\n{colored(f'OBSERVATION {iteration}', 'red', attrs=['bold'])}: \n{observation}\n")
+
+            self.update_history(Episode(iteration, current_thought,
+                                        [Action(current_action, current_action_input, observation)]))
             iteration += 1
 
-        if self.history:
-            print(colored(f"\n\nFINAL ANSWER: {self.history.pop()}", 'light_blue', attrs=['bold']))
+        if final_answer is not None:
+            self._print(colored(f"\n\nFINAL ANSWER: {final_answer}", 'light_blue', attrs=['bold']))
+        self._emit("final", final_answer=final_answer, num_steps=len(steps))
+        logger.info("Agent loop finished.")
+        return {"final_answer": final_answer, "steps": steps}
+
+
+class AsyncReAct(ReAct):
+    """
+    An asyncio variant of the ReAct agent that can take several actions in one step.
+
+    The model may return a list of actions per step, and all of them are run concurrently through Tool.arun with
+    their observations merged into a single history episode. Independent lookups therefore share one LLM round
+    trip, and the number of steps follows the number of dependent hops in the question.
+
+    Methods:
+        _arun(query, max_retries=3): Runs a single step of the agent's loop and returns the thought and the actions.
+        aagentloop(query): Main loop for the agent to process the query and produce results.
+        agentloop(query): Runs aagentloop to completion from synchronous code.
+    """
+
+    prompt_template = react_prompt.PARALLEL_PROMPT
+
+    async def _arun(self, query, max_retries=3):
+        """
+        Runs a single step of the agent's loop with retries for JSON decoding.
+
+        Args:
+            query (str): The query to be processed.
+            max_retries (int, optional): Maximum number of retries for JSON decoding. Defaults to 3.
+
+        Returns:
+            tuple: The thought and a list of (action, action input) pairs.
+        """
+        with tracer.span("llm", stream=False) as span:
+            for i in range(max_retries):
+                messages = self._messages(query)
+                response = (await self.llm.achat(messages)).message.content
+                self._record_call(span, messages, response)
+                result = self._decode(response)
+                if result:
+                    break
+                span.add("json_retries")
+            else:
+                logger.error("Failed to decode JSON after %d retries.", max_retries)
+                result = {}
+
+        thought = result.get("thought", "Empty")
+        actions = []
+        if isinstance(result.get("actions"), list):
+            actions = [(action.get("action", "Empty"), action.get("input", "Empty"))
+                       for action in result["actions"] if isinstance(action, dict)]
+            if result["actions"] and not actions:
+                logger.warning(f"No action in the list of actions {result['actions']}, using the action fields")
+        if not actions:
+            # Models sometimes fall back to the single action format
+            actions = [(result.get("action", "Empty"), result.get("input", "Empty"))]
+
+        return thought, actions
+
+    async def _arun_action(self, action, action_input):
+        tool = self._find_tool(action)
+        if tool is None:
+            logger.error("No matching tool found for action: %s", action)
+            return f"There is no tool called {action}, choose one of the listed tools."
+        logger.info("Using tool: %s", tool.__class__.__name__)
+        with tracer.span("tool", tool=action):
+            return await tool.arun(action_input)
+
+    async def aagentloop(self, query):
+        """
+        Main loop for the agent to process the query and produce results.
+
+        Args:
+            query (str): The query to be processed.
+
+        Returns:
+            dict: The final answer (None when the agent never finished) and the list of steps taken.
+        """
+        with query_context() as query_id, tracer.span("agentloop", agent=self.__class__.__name__,
+                                                       query_id=query_id) as span:
+            result = await self._aagentloop(query)
+            span.set(steps=len(result["steps"]), finished=result["final_answer"] is not None)
+        return result
+
+    async def _aagentloop(self, query):
+        logger.info("Running query: %s", query)
+        self._print(f"{colored('QUERY', 'cyan', attrs=['bold'])}: {colored(f'{query}', 'green')}")
+
+        final_answer = None
+        steps = []
+        iteration = 1
+        while iteration <= self.max_steps:
+            logger.info("Iteration %d", iteration)
+            current_thought, current_actions = await self._arun(query)
+            self._print(f"\n{colored(f'THOUGHT {iteration}', 'red', attrs=['bold'])} :{current_thought}")
+            self._emit("thought", iteration=iteration, thought=current_thought)
+            for j, (action, action_input) in enumerate(current_actions, start=1):
+                self._emit("action", iteration=iteration, index=j, action=action, input=action_input)
+
+            finish = next((action_input for action, action_input in current_actions if action == "finish"), None)
+            actions = [(action, action_input) for action, action_input in current_actions if action != "finish"]
+            if finish is None and all(self._find_tool(action) is None for action, _ in actions):
+                logger.error("No matching tool found for actions: %s", [action for action, _ in actions])
+                steps.append({"thought": current_thought, "action": actions[0][0], "input": actions[0][1],
+                              "observation": "No matching tool found"})
+                break
+
+            if actions:
+                if finish is not None:
+                    # The answer may rest on lookups made in the same step, so they still run and are recorded
+                    logger.info(f"Running {len(actions)} actions listed alongside finish before finishing")
+                observations = await asyncio.gather(*(self._arun_action(action, action_input)
+                                                      for action, action_input in actions))
+
+                episode = Episode(iteration, current_thought)
+                for j, ((action, action_input), observation) in enumerate(zip(actions, observations), start=1):
+                    steps.append({"thought": current_thought, "action": action, "input": action_input,
+                                  "observation": observation})
+                    self._print("\n".join([
+                        f"{colored(f'ACTION {iteration}.{j}', 'red', attrs=['bold'])} :{action}",
+                        f"{colored(f'ACTION INPUT {iteration}.{j}', 'red', attrs=['bold'])} :{action_input}",
+                        f"{colored(f'OBSERVATION {iteration}.{j}', 'red', attrs=['bold'])} :{observation}",
+                    ]) + "\n")
+                    episode.actions.append(Action(action, action_input, observation))
+                    self._emit("observation", iteration=iteration, index=j, action=action, observation=observation)
+                self.update_history(episode)
+
+            if finish is not None:
+                logger.info("Finish action received. Exiting loop.")
+                steps.append({"thought": current_thought, "action": "finish", "input": finish})
+                final_answer = finish
+                break
+            iteration += 1
+
+        if final_answer is not None:
+            self._print(colored(f"\n\nFINAL ANSWER: {final_answer}", 'light_blue', attrs=['bold']))
+        self._emit("final", final_answer=final_answer, num_steps=len(steps))
+        logger.info("Agent loop finished.")
+        return {"final_answer": final_answer, "steps": steps}
+
+    def agentloop(self, query):
+        """
+        Runs aagentloop to completion, for callers that are not running an event loop themselves.
+
+        Args:
+            query (str): The query to be processed.
+
+        Returns:
+            dict: The final answer (None when the agent never finished) and the list of steps taken.
+        """
+        return asyncio.run(self.aagentloop(query))
+
+
+class PlanAndExecute(ReAct):
+    """
+    A ReAct agent that plans every retrieval of a question in one LLM call, runs them all at once through the
+    Retrieve tool and answers from the combined evidence in a second call.
+
+    Multi-hop questions mostly describe each of their hops themselves, so the retrievals rarely have to wait for
+    each other and a question takes two LLM calls instead of one per hop. When no usable plan comes back, or the
+    evidence does not suffice for an answer, the agent falls back to the step-by-step ReAct loop, which then starts
+    with the planned retrievals in its history and the remaining max_steps.
+
+    Attributes:
+        max_sub_queries (int): Most retrievals taken from a plan.
+
+    Methods:
+        _plan(query, retrieve, max_retries=3): Asks the LLM for the thought and the sub-queries of the question.
+        _execute(retrieve, sub_queries): Runs the sub-queries in parallel and returns their observations.
+        _answer(query, sub_queries, observations, max_retries=3): Asks the LLM for the answer, None when the
+            evidence does not suffice.
+        agentloop(query): Plans, retrieves and answers the query, falling back to the ReAct loop when needed.
+    """
+
+    max_sub_queries = 6
+
+    def _ask(self, prompt, phase, max_retries=3):
+        messages = [ChatMessage(role="user", content=prompt)]
+        with tracer.span("llm", stream=False, phase=phase) as span:
+            for i in range(max_retries):
+                response = self.llm.chat(messages).message.content
+                self._record_call(span, messages, response)
+                result = self._decode(response)
+                if result:
+                    return result
+                span.add("json_retries")
+        logger.error("Failed to decode the %s JSON after %d retries.", phase, max_retries)
+        return {}
+
+    def _plan(self, query, retrieve, max_retries=3):
+        """
+        Asks the LLM to break the query down into retrievals that do not depend on each other.
+
+        Args:
+            query (str): The query to be processed.
+            retrieve (Retrieve): The tool the sub-queries are written for.
+            max_retries (int, optional): Maximum number of retries for JSON decoding. Defaults to 3.
+
+        Returns:
+            tuple: The thought and the list of sub-queries, empty when the plan is unusable.
+        """
+        prompt = plan_prompt.PLAN_PROMPT.format(query=query, tool_descriptions=f"retrieve: {retrieve.run.__doc__}",
+                                                max_sub_queries=self.max_sub_queries)
+        result = self._ask(prompt, "plan", max_retries)
+        sub_queries = result.get("sub_queries")
+        if not isinstance(sub_queries, list):
+            return result.get("thought", "Empty"), []
+        sub_queries = [sub_query for sub_query in sub_queries
+                       if (isinstance(sub_query, str) and sub_query.strip())
+                       or (isinstance(sub_query, dict) and sub_query.get("query"))]
+        if len(sub_queries) > self.max_sub_queries:
+            logger.warning(f"The plan has {len(sub_queries)} retrievals, keeping the first {self.max_sub_queries}")
+        return result.get("thought", "Empty"), sub_queries[:self.max_sub_queries]
+
+    def _execute(self, retrieve, sub_queries):
+        def run(sub_query):
+            with tracer.span("tool", tool="retrieve"):
+                return retrieve.run(sub_query)
+
+        with ThreadPoolExecutor(max_workers=len(sub_queries)) as executor:
+            # Copy the context so the retrievals belong to this query's trace and log records
+            futures = [executor.submit(contextvars.copy_context().run, run, sub_query) for sub_query in sub_queries]
+            return [future.result() for future in futures]
+
+    def _answer(self, query, sub_queries, observations, max_retries=3):
+        """
+        Asks the LLM to answer the query from the observations of the planned retrievals.
+
+        Args:
+            query (str): The query to be processed.
+            sub_queries (list): The planned retrievals.
+            observations (list): The observation of every retrieval.
+            max_retries (int, optional): Maximum number of retries for JSON decoding. Defaults to 3.
+
+        Returns:
+            tuple: The thought and the answer, None when the evidence does not suffice.
+        """
+        evidence = "\n\n".join(f"Retrieval {j}: {sub_query}\n{observation}"
+                                 for j, (sub_query, observation) in enumerate(zip(sub_queries, observations), start=1))
+        result = self._ask(plan_prompt.ANSWER_PROMPT.format(query=query, evidence=evidence), "answer", max_retries)
+        answer = result.get("answer")
+        if answer is not None and not isinstance(answer, str):
+            answer = str(answer)
+        if answer is None or answer.strip().lower().replace("'", "").strip(".") in ("", "null", "i dont know"):
+            answer = None
+        return result.get("thought", "Empty"), answer
+
+    def _agentloop(self, query):
+        logger.info("Running query: %s", query)
+        self._print(f"{colored('QUERY', 'cyan', attrs=['bold'])}: {colored(f'{query}', 'green')}")
+
+        retrieve = self._find_tool("retrieve")
+        if retrieve is None:
+            logger.warning("Plan-and-execute needs the retrieve tool, running the ReAct loop instead")
+            return super()._agentloop(query, steps=[])
+        thought, sub_queries = self._plan(query, retrieve)
+        if not sub_queries:
+            logger.warning("The plan has no usable retrievals, running the ReAct loop instead")
+            return super()._agentloop(query, steps=[])
+
+        self._print(f"\n{colored('PLAN', 'red', attrs=['bold'])} :{thought}")
+        self._emit("thought", iteration=1, thought=thought)
+        for j, sub_query in enumerate(sub_queries, start=1):
+            self._emit("action", iteration=1, index=j, action="retrieve", input=sub_query)
+        observations = self._execute(retrieve, sub_queries)
+
+        steps = []
+        episode = Episode(1, thought)
+        for j, (sub_query, observation) in enumerate(zip(sub_queries, observations), start=1):
+            steps.append({"thought": thought, "action": "retrieve", "input": sub_query, "observation": observation})
+            self._print("\n".join([
+                f"{colored(f'ACTION 1.{j}', 'red', attrs=['bold'])} :retrieve",
+                f"{colored(f'ACTION INPUT 1.{j}', 'red', attrs=['bold'])} :{sub_query}",
+                f"{colored(f'OBSERVATION 1.{j}', 'red', attrs=['bold'])} :{observation}",
+            ]) + "\n")
+            episode.actions.append(Action("retrieve", sub_query, observation))
+            self._emit("observation", iteration=1, index=j, action="retrieve", observation=observation)
+        self.update_history(episode)
+
+        answer_thought, final_answer = self._answer(query, sub_queries, observations)
+        if final_answer is None:
+            logger.info("The planned retrievals do not answer the query, continuing with the ReAct loop")
+            return super()._agentloop(query, iteration=2, steps=steps)
+
+        steps.append({"thought": answer_thought, "action": "finish", "input": final_answer})
+        self._print(f"\n{colored('THOUGHT 2', 'red', attrs=['bold'])} :{answer_thought}")
+        self._emit("thought", iteration=2, thought=answer_thought)
+        self._emit("action", iteration=2, action="finish", input=final_answer)
+        self._print(colored(f"\n\nFINAL ANSWER: {final_answer}", 'light_blue', attrs=['bold']))
+        self._emit("final", final_answer=final_answer, num_steps=len(steps))
         logger.info("Agent loop finished.")
+        return {"final_answer": final_answer, "steps": steps}
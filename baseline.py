@@ -1,44 +1,26 @@
-import os.path
-import pprint
-from typing import List, Dict
-from llama_index.core import VectorStoreIndex
-from llama_index.core.node_parser import LangchainNodeParser
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from llama_index.core.retrievers import VectorIndexRetriever
-from utils import load_data
-from utils import loadllm, loadEmbeddingModel, nodeExtractor, getContextString
-from vectorstore import VectorStore
+import argparse
+import os
+from utils import loadllm, nodeExtractor, getContextString
+from vectorstore import get_shared_index, STORE_BACKENDS
+from rerank import get_shared_reranker
+from llm_cache import CachedLLM
+from batching import load_queries, run_batch, QUERY_DATA_PATH
 import json
-from tqdm import tqdm
 from prompts import baseline_prompt
+from tracing import tracer
 
 
-embed_model = loadEmbeddingModel("huggingface")
-store = VectorStore()
-vector_store_path = "data/vector/default"
-data = load_data('data/corpus.json')
-text_splitter = LangchainNodeParser(RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200))
-nodes = text_splitter.get_nodes_from_documents(data)
-
-if os.path.exists(vector_store_path):
-    index = store.create_index_from_stored(embed_model=embed_model)
-else:
-    index = store.create_index(llama_index_nodes=nodes, embed_model=embed_model)
-
-
-with open('data/MultiHopRAG.json', 'r') as file:
-    query_data = json.load(file)[:50]
-
-retriever = VectorIndexRetriever(index=index, similarity_top_k=3, embedding_model=embed_model, verbose=True)
-llm = loadllm("Groq")
-metalist = []
-
-for stuff in tqdm(query_data):
+def answer_query(stuff, retriever, llm, context_tokens=None):
     query = stuff['query']
-    retrieved_nodes = retriever.retrieve(query)
-    nodes = nodeExtractor(retrieved_nodes)
-    context = getContextString(retrieved_nodes)
-    response = str(llm.complete(baseline_prompt.DEFAULT_PROMPT.format(query=query, context=context)))
+    with tracer.span("baseline"):
+        with tracer.span("retrieve") as span:
+            retrieved_nodes = retriever.retrieve(query)
+            span.add("chunks", len(retrieved_nodes))
+        nodes = nodeExtractor(retrieved_nodes)
+        context = getContextString(retrieved_nodes, query=query, max_tokens=context_tokens)
+        with tracer.span("llm") as span:
+            response = str(llm.complete(baseline_prompt.DEFAULT_PROMPT.format(query=query, context=context)))
+            span.add("calls")
     save = {}
     save['query'] = stuff['query']
     save['answer'] = stuff['answer']
@@ -46,13 +28,47 @@ for stuff in tqdm(query_data):
     save['question_type'] = stuff['question_type']
     save['retrieval_list'] = nodes
     save['gold_list'] = stuff['evidence_list']
-    metalist.append(save)
+    return save
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run vanilla RAG over the MultiHopRAG queries.")
+    parser.add_argument("--queries", default=QUERY_DATA_PATH)
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--end", type=int, default=50, help="end of the query range, -1 runs to the end of the dataset")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests-per-minute", type=float, default=30)
+    parser.add_argument("--backend", choices=sorted(STORE_BACKENDS), default="chroma")
+    parser.add_argument("--retrieval", choices=["dense", "hybrid"], default="dense")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--rerank", action="store_true",
+                        help="over-fetch candidates and keep the top-k by cross-encoder score")
+    parser.add_argument("--context-tokens", type=int, default=None,
+                        help="token budget of each retrieved context, trimming the least relevant sentences")
+    parser.add_argument("--llm", default="Groq")
+    parser.add_argument("--output", default="output/vanilla_rag.jsonl",
+                        help="results are appended here per query, finished queries are skipped on restart")
+    parser.add_argument("--trace", default=None,
+                        help="append a JSONL span per agent step, LLM call and tool run to this file, and write "
+                             "Prometheus metrics next to it")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.configure(args.trace)
 
+    handle = get_shared_index(backend=args.backend)
+    reranker = get_shared_reranker() if args.rerank else None
+    retriever = handle.retriever(args.top_k, mode=args.retrieval, reranker=reranker)
+    llm = loadllm(args.llm, requests_per_minute=args.requests_per_minute)
 
-if not os.path.exists("output/"):
-    os.makedirs("output/")
+    query_data = load_queries(args.queries, args.start, None if args.end < 0 else args.end)
+    metalist = run_batch(query_data, lambda stuff: answer_query(stuff, retriever, llm, args.context_tokens), args.output,
+                         workers=args.workers)
 
-save_file = "output/vanilla_rag.json"
-with open(save_file, 'w') as json_file:
-    json.dump(metalist, json_file)
+    save_file = os.path.splitext(args.output)[0] + ".json"
+    with open(save_file, 'w') as json_file:
+        json.dump(metalist, json_file)
+    if args.trace:
+        tracer.write_metrics(args.trace + ".prom")
 
+    if isinstance(llm, CachedLLM):
+        llm.log_stats()
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from logger_config import logger
+
+QUERY_DATA_PATH = "data/MultiHopRAG.json"
+
+
+def load_queries(input_file=QUERY_DATA_PATH, start=0, end=None):
+    """
+    Returns (query_id, item) pairs for the requested slice of the dataset. The query id is the item's position
+    in the full dataset, so outputs of different slices can be merged.
+    """
+    with open(input_file, 'r') as file:
+        query_data = json.load(file)
+    end = len(query_data) if end is None else min(end, len(query_data))
+    return [(query_id, query_data[query_id]) for query_id in range(start, end)]
+
+
+def load_results(output_file):
+    """Returns the records already written to a JSONL output file, keyed by query id."""
+    results = {}
+    if not os.path.exists(output_file):
+        return results
+    with open(output_file, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partially written last line, that query simply runs again
+                continue
+            results[record["query_id"]] = record
+    return results
+
+
+class JsonlWriter:
+    """
+    Appends one JSON record per line, flushing each one to disk so a crash loses at most the query in flight.
+    Safe to share between threads.
+    """
+
+    def __init__(self, output_file):
+        if os.path.dirname(output_file):
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        self._file = open(output_file, 'a')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def run_batch(queries, process, output_file, workers=4):
+    """
+    Runs process(item) over the queries on a thread pool and appends each result to output_file as soon as it is
+    ready. Queries already present in output_file are skipped, so an interrupted run resumes where it stopped.
+    A query that raises is logged and left out of the output, so it runs again on the next attempt. When the run
+    is interrupted, queries not yet started are cancelled.
+
+    Args:
+        queries (list): (query_id, item) pairs as returned by load_queries.
+        process (callable): Turns an item into a JSON serialisable dict.
+        output_file (str): JSONL file the results are appended to.
+        workers (int): Number of queries processed concurrently.
+
+    Returns:
+        list: Every result for the given queries, including those from earlier runs, in query order.
+    """
+    done = load_results(output_file)
+    pending = [(query_id, item) for query_id, item in queries if query_id not in done]
+    logger.info(f"Running {len(pending)} queries with {workers} workers, {len(queries) - len(pending)} already done")
+
+    writer = JsonlWriter(output_file)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(process, item): query_id for query_id, item in pending}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            query_id = futures[future]
+            try:
+                record = {"query_id": query_id, **future.result()}
+            except Exception as e:
+                logger.error(f"Query {query_id} failed: {e}")
+                continue
+            writer.write(record)
+            done[query_id] = record
+    except BaseException:
+        # On Ctrl-C or an error, drop the queued queries instead of running them only to discard the results;
+        # the ones in flight finish on their own and run again on resume
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        pool.shutdown()
+    finally:
+        writer.close()
+    return [done[query_id] for query_id, _ in queries if query_id in done]
@@ -0,0 +1,326 @@
+"""
+End-to-end evaluation of the vanilla RAG baseline, the ReAct agent and the plan-and-execute agent on the MultiHopRAG
+queries.
+
+Every system answers the same queries and we report, per system:
+    retrieval: recall@k of the gold evidence articles (matched by title) and the MRR of the first one found,
+    answers: accuracy overall and by question_type, a gold answer counting as found when the generated answer
+             contains it, as in the MultiHopRAG evaluation,
+    cost: LLM calls, agent steps and prompt/completion tokens per query,
+    latency: p50/p95/p99 of every stage (query, llm, retrieve) in milliseconds.
+
+By default the LLM is the offline stand-in (standin_llm.StandInLLM) and the embedding model is the real one, so a
+run needs no provider and its retrieval numbers are real; answer accuracy is then only comparable between runs with
+the stand-in. The report is JSON, so reports of two commits can be diffed, and --compare does that and lists the
+regressions.
+
+    python benchmarks/evaluate.py --queries 100 --output reports/main.json
+    python benchmarks/evaluate.py --queries 100 --output reports/branch.json --compare reports/main.json
+"""
+import argparse
+import contextvars
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import baseline
+import react_batch
+from agent import ReAct, AsyncReAct, PlanAndExecute
+from batching import load_queries, QUERY_DATA_PATH
+from history import count_tokens
+from rerank import get_shared_reranker
+from standin_llm import StandInLLM
+import tools
+from tools import Finish
+from utils import loadllm
+from vectorstore import get_shared_index, STORE_BACKENDS
+
+SYSTEMS = ("baseline", "react", "plan")
+RECALL_KS = (1, 3, 5, 10)
+QUALITY_METRICS = ("recall@", "mrr", "accuracy")
+
+_usage = contextvars.ContextVar("usage", default=None)
+
+
+class Timings:
+    """Latencies per stage, in seconds, collected from every thread."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def report(self):
+        report = {}
+        for stage, values in sorted(self.stages.items()):
+            values = np.asarray(values) * 1000
+            report[stage] = {"count": len(values), "mean_ms": float(values.mean()),
+                             **{f"p{q}_ms": float(np.percentile(values, q)) for q in (50, 95, 99)}}
+        return report
+
+
+def _charge(prompt, completion):
+    usage = _usage.get()
+    if usage is not None:
+        usage["llm_calls"] += 1
+        usage["prompt_tokens"] += count_tokens(prompt)
+        usage["completion_tokens"] += count_tokens(completion)
+
+
+class MeteredLLM:
+    """Wraps an LLM to time every call and charge its tokens to the query running in the calling context."""
+
+    def __init__(self, llm, timings):
+        self.llm = llm
+        self.timings = timings
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    @staticmethod
+    def _text(messages):
+        return "\n".join(str(message.content) for message in messages)
+
+    def chat(self, messages, **kwargs):
+        start = time.perf_counter()
+        response = self.llm.chat(messages, **kwargs)
+        self.timings.add("llm", time.perf_counter() - start)
+        _charge(self._text(messages), response.message.content)
+        return response
+
+    def stream_chat(self, messages, **kwargs):
+        start = time.perf_counter()
+        chunk = None
+        for chunk in self.llm.stream_chat(messages, **kwargs):
+            yield chunk
+        self.timings.add("llm", time.perf_counter() - start)
+        _charge(self._text(messages), chunk.message.content if chunk is not None else "")
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        start = time.perf_counter()
+        response = self.llm.complete(prompt, formatted=formatted, **kwargs)
+        self.timings.add("llm", time.perf_counter() - start)
+        _charge(prompt, response.text)
+        return response
+
+    async def achat(self, messages, **kwargs):
+        start = time.perf_counter()
+        response = await self.llm.achat(messages, **kwargs)
+        self.timings.add("llm", time.perf_counter() - start)
+        _charge(self._text(messages), response.message.content)
+        return response
+
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        start = time.perf_counter()
+        response = await self.llm.acomplete(prompt, formatted=formatted, **kwargs)
+        self.timings.add("llm", time.perf_counter() - start)
+        _charge(prompt, response.text)
+        return response
+
+
+class TimedRetriever:
+    """Times the retrievals of the baseline."""
+
+    def __init__(self, retriever, timings):
+        self.retriever = retriever
+        self.timings = timings
+
+    def retrieve(self, query):
+        start = time.perf_counter()
+        nodes = self.retriever.retrieve(query)
+        self.timings.add("retrieve", time.perf_counter() - start)
+        return nodes
+
+
+class Retrieve(tools.Retrieve):
+    """
+    The agent's retrieve tool, timed. It keeps the name, since the agent calls tools by their class name, and
+    sessions are copies, so they are timed too.
+    """
+
+    timings = None
+
+    def run(self, query):
+        start = time.perf_counter()
+        observation = super().run(query)
+        self.timings.add("retrieve", time.perf_counter() - start)
+        return observation
+
+
+def _normalize(text):
+    return " ".join("".join(char for char in str(text).lower() if char.isalnum() or char.isspace()).split())
+
+
+def score(results):
+    """Aggregates the per-query results of one system into its metrics."""
+    recalls = {k: [] for k in RECALL_KS}
+    reciprocal_ranks = []
+    correct_by_type = {}
+    for result in results:
+        gold = {evidence["title"] for evidence in result["gold_list"]}
+        retrieved = list(dict.fromkeys(node["metadata"].get("title") for node in result["retrieval_list"]))
+        if gold:
+            for k in RECALL_KS:
+                recalls[k].append(len(gold & set(retrieved[:k])) / len(gold))
+            rank = next((i + 1 for i, title in enumerate(retrieved) if title in gold), None)
+            reciprocal_ranks.append(1 / rank if rank else 0.0)
+        answer = _normalize(result["answer"])
+        correct = bool(answer) and answer in _normalize(result["generated_answer"])
+        correct_by_type.setdefault(result["question_type"], []).append(correct)
+
+    every_answer = [correct for answers in correct_by_type.values() for correct in answers]
+    metrics = {"queries": len(results)}
+    metrics.update({f"recall@{k}": float(np.mean(values)) if values else None for k, values in recalls.items()})
+    metrics["mrr"] = float(np.mean(reciprocal_ranks)) if reciprocal_ranks else None
+    metrics["accuracy"] = float(np.mean(every_answer)) if every_answer else None
+    metrics["accuracy_by_type"] = {question_type: float(np.mean(answers))
+                                   for question_type, answers in sorted(correct_by_type.items())}
+    for key in ("num_steps", "llm_calls", "prompt_tokens", "completion_tokens"):
+        values = [result[key] for result in results if key in result]
+        metrics[f"mean_{key}"] = float(np.mean(values)) if values else None
+    return metrics
+
+
+def run_system(name, queries, args, llm, handle):
+    timings = Timings()
+    metered = MeteredLLM(llm, timings)
+    if name == "baseline":
+        reranker = get_shared_reranker() if args.rerank else None
+        retriever = TimedRetriever(handle.retriever(args.top_k, mode=args.retrieval, reranker=reranker), timings)
+
+        def answer(stuff):
+            return baseline.answer_query(stuff, retriever, metered, args.context_tokens)
+    else:
+        retrieve = Retrieve(args.top_k, handle=handle, mode=args.retrieval, rerank=args.rerank,
+                              context_tokens=args.context_tokens)
+        retrieve.timings = timings
+        agent_class = PlanAndExecute if name == "plan" else AsyncReAct if args.parallel else ReAct
+        agent = agent_class([retrieve, Finish()], [], metered, max_steps=args.max_steps, verbose=False)
+
+        def answer(stuff):
+            return react_batch.answer_query(stuff, agent)
+
+    def run_query(stuff):
+        usage = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        _usage.set(usage)
+        start = time.perf_counter()
+        try:
+            result = answer(stuff)
+        except Exception as e:
+            print(f"{name} failed on {stuff['query'][:60]!r}: {e}", file=sys.stderr)
+            return None
+        timings.add("query", time.perf_counter() - start)
+        return {**result, **usage}
+
+    # copy_context gives every query its own usage counters, also in worker threads
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda stuff: contextvars.copy_context().run(run_query, stuff), queries))
+    finished = [result for result in results if result is not None]
+    metrics = score(finished)
+    metrics["errors"] = len(results) - len(finished)
+    metrics["latency"] = timings.report()
+    return metrics
+
+
+def _flatten(report, prefix=""):
+    flat = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _format(value):
+    return "-" if value is None else f"{value:.4g}"
+
+
+def compare(old, new, tolerance, latency_tolerance):
+    """
+    Prints every metric of both reports side by side and returns the regressions: quality metrics that dropped by
+    more than tolerance, and p95 latencies that grew by more than latency_tolerance relative to the old report.
+    """
+    old_flat, new_flat = _flatten(old["systems"]), _flatten(new["systems"])
+    regressions = []
+    print(f"{'metric':<50} {'old':>12} {'new':>12} {'delta':>12}")
+    for key in sorted(set(old_flat) | set(new_flat)):
+        before, after = old_flat.get(key), new_flat.get(key)
+        delta = after - before if before is not None and after is not None else None
+        print(f"{key:<50} {_format(before):>12} {_format(after):>12} {_format(delta):>12}")
+        if delta is None:
+            continue
+        metric = key.split(".")[1]
+        if metric.startswith(QUALITY_METRICS) and delta < -tolerance:
+            regressions.append(key)
+        elif key.endswith("p95_ms") and before > 0 and delta / before > latency_tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Retrieval, answer, cost and latency metrics of baseline and agent.")
+    parser.add_argument("--query-file", default=QUERY_DATA_PATH)
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--systems", nargs="+", choices=SYSTEMS, default=list(SYSTEMS))
+    parser.add_argument("--backend", choices=sorted(STORE_BACKENDS), default="chroma")
+    parser.add_argument("--retrieval", choices=["dense", "hybrid"], default="dense")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--rerank", action="store_true")
+    parser.add_argument("--context-tokens", type=int, default=None)
+    parser.add_argument("--max-steps", type=int, default=10)
+    parser.add_argument("--parallel", action="store_true", help="run the agent as AsyncReAct")
+    parser.add_argument("--llm", default="StandIn", help="StandIn runs offline, any loadllm host calls the provider")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="seconds every stand-in call takes")
+    parser.add_argument("--workers", type=int, default=1, help="queries run concurrently, 1 keeps latencies clean")
+    parser.add_argument("--output", default=None, help="also write the report here as JSON")
+    parser.add_argument("--compare", default=None, help="a report of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="drop in recall, MRR or accuracy that counts as a regression")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25,
+                        help="relative growth of a p95 latency that counts as a regression")
+    args = parser.parse_args()
+
+    if args.llm == "StandIn":
+        llm = StandInLLM(delay=args.llm_delay)
+    else:
+        llm = loadllm(args.llm)
+    handle = get_shared_index(backend=args.backend)
+    queries = [item for _, item in load_queries(args.query_file, args.start, args.start + args.queries)]
+
+    report = {"config": {**vars(args), "commit": git_commit()}, "systems": {}}
+    for name in args.systems:
+        report["systems"][name] = run_system(name, queries, args, llm, handle)
+
+    print(json.dumps(report["systems"], indent=2))
+    if args.output:
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare(json.load(file), report, args.tolerance, args.latency_tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions")
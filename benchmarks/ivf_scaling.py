@@ -0,0 +1,80 @@
+"""
+Measures how IVF query latency and recall behave as the number of vectors grows, against exact search.
+
+Vectors are synthetic: unit-normalised points scattered around random topic centres, so the lists are uneven the
+way real embeddings are, and queries are perturbed copies of random vectors. For each size the IVF index is trained,
+then every query is answered exactly and from the index, re-ranking refine * top_k candidates on the full vectors as
+IVFVectorStore does. Compare --pq-m values to see what memory saved by smaller PQ codes costs in recall.
+
+    python benchmarks/ivf_scaling.py --sizes 10000 100000 1000000 --dim 768 --quantizer pq --pq-m 192
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ivf import IVFIndex, DEFAULT_NPROBE, DEFAULT_REFINE
+
+
+def normalise(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic(rows, dim, topics, rng):
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    return normalise(centres[rng.integers(topics, size=rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32))
+
+
+def exact_top_k(vectors, query, top_k):
+    scores = vectors @ query
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    return best[np.argsort(-scores[best])]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="IVF latency and recall against exact search as the corpus grows.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 500_000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    parser.add_argument("--refine", type=int, default=DEFAULT_REFINE)
+    parser.add_argument("--quantizer", choices=["int8", "pq"], default="int8")
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = []
+    for size in args.sizes:
+        rng = np.random.default_rng(args.seed)
+        vectors = synthetic(size, args.dim, topics=max(10, size // 1000), rng=rng)
+        queries = vectors[rng.integers(size, size=args.queries)]
+        queries = normalise(queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32))
+
+        start = time.perf_counter()
+        ivf = IVFIndex.train(vectors, generation=0, quantizer=args.quantizer, pq_m=args.pq_m, seed=args.seed)
+        train_time = time.perf_counter() - start
+
+        exact_times, ivf_times, recalls = [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            expected = exact_top_k(vectors, query, args.top_k)
+            exact_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            rows = np.sort(ivf.search(query, args.top_k * args.refine, nprobe=args.nprobe))
+            found = rows[np.argsort(-(vectors[rows] @ query))[:args.top_k]]
+            ivf_times.append(time.perf_counter() - start)
+            recalls.append(len(set(expected) & set(found)) / args.top_k)
+
+        report.append({"vectors": size, "lists": len(ivf.centroids), "train_s": train_time,
+                       "full_bytes_per_vector": args.dim * 4, "code_bytes_per_vector": int(ivf.codes.shape[1]),
+                       "exact_p50_ms": float(np.percentile(exact_times, 50) * 1000),
+                       "ivf_p50_ms": float(np.percentile(ivf_times, 50) * 1000),
+                       "ivf_p95_ms": float(np.percentile(ivf_times, 95) * 1000),
+                       f"recall@{args.top_k}": float(np.mean(recalls))})
+        print(json.dumps(report[-1]))
@@ -0,0 +1,102 @@
+"""
+Compares the int8 ONNX Runtime embedding backend with the PyTorch one it was exported from.
+
+Both models embed the same corpus chunks and queries. We record load time and resident memory, chunk throughput,
+single-query latency, how close the ONNX vectors are to the PyTorch ones, and retrieval agreement: the share of
+the PyTorch top K chunks that are also found when the ONNX model embeds both sides ("onnx"), and when ONNX query
+vectors search chunks embedded by PyTorch ("mixed", i.e. querying an index built before switching).
+
+    python benchmarks/onnx_embedding.py --chunks 2000 --queries 200 --threads 4
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.schema import MetadataMode
+from batching import load_queries, QUERY_DATA_PATH
+from chunk_store import load_chunk_store
+from onnx_embedding import DEFAULT_MODEL_NAME, META_FILE, export_onnx_model, onnx_model_path
+from utils import loadEmbeddingModel
+from vectorstore import CORPUS_PATH
+
+
+def resident_mib():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def measure(host, name, texts, queries, threads):
+    rss = resident_mib()
+    start = time.perf_counter()
+    model = loadEmbeddingModel(host, name, num_threads=threads)
+    model.get_query_embedding("warm up")
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors = np.asarray(model.get_text_embedding_batch(texts), dtype=np.float32)
+    embed_seconds = time.perf_counter() - start
+    latencies, query_vectors = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(model.get_query_embedding(query))
+        latencies.append(time.perf_counter() - start)
+    latencies = np.asarray(latencies) * 1000
+    stats = {"model": model.model_name, "load_s": load_seconds, "rss_mib": resident_mib() - rss,
+             "chunks_per_s": len(texts) / embed_seconds, "query_p50_ms": float(np.percentile(latencies, 50)),
+             "query_p95_ms": float(np.percentile(latencies, 95))}
+    return stats, vectors, np.asarray(query_vectors, dtype=np.float32)
+
+
+def top_k(query_vectors, vectors, k):
+    return np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :k]
+
+
+def agreement(expected, actual):
+    return float(np.mean([len(set(e) & set(a)) / len(e) for e, a in zip(expected, actual)]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput and retrieval agreement of ONNX against PyTorch.")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--query-file", default=QUERY_DATA_PATH)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=None, help="threads per model, defaults to one per core")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--output", default=None, help="also write the report here as JSON")
+    args = parser.parse_args()
+
+    nodes = itertools.islice(load_chunk_store(args.corpus).iter_nodes(), args.chunks)
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    queries = [item["query"] for _, item in load_queries(args.query_file, 0, args.queries)]
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    if not os.path.exists(os.path.join(onnx_model_path(args.model), META_FILE)):
+        # Export up front so the ONNX load time is that of an existing export
+        export_onnx_model(args.model)
+    torch_stats, torch_vectors, torch_queries = measure("huggingface", args.model, texts, queries, args.threads)
+    onnx_stats, onnx_vectors, onnx_queries = measure("onnx", args.model, texts, queries, args.threads)
+
+    similarities = np.concatenate([(torch_vectors * onnx_vectors).sum(axis=1),
+                                   (torch_queries * onnx_queries).sum(axis=1)])
+    report = {"chunks": len(texts), "queries": len(queries), "pytorch": torch_stats, "onnx": onnx_stats,
+              "speedup": onnx_stats["chunks_per_s"] / torch_stats["chunks_per_s"],
+              "min_cosine": float(similarities.min()), "mean_cosine": float(similarities.mean())}
+    for k in args.top_k:
+        expected = top_k(torch_queries, torch_vectors, k)
+        report[f"onnx_recall@{k}"] = agreement(expected, top_k(onnx_queries, onnx_vectors, k))
+        report[f"mixed_recall@{k}"] = agreement(expected, top_k(onnx_queries, torch_vectors, k))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
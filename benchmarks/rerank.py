@@ -0,0 +1,71 @@
+"""
+Measures what cross-encoder reranking buys per retrieval: evidence recall and context tokens against added latency.
+
+For every query, each configuration retrieves its chunks, and we record the share of the gold evidence articles
+(matched by title) among them, the tokens of the context string the agent would see, and the retrieval latency.
+Reranked configurations are run twice, the second pass shows the effect of the score cache.
+
+    python benchmarks/rerank.py --queries 100 --configs 3 30:3 30:2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import load_queries, QUERY_DATA_PATH
+from history import count_tokens
+from rerank import Reranker, DEFAULT_RERANK_MODEL
+from utils import getContextString
+from vectorstore import get_shared_index, STORE_BACKENDS
+
+
+def run(retriever, queries):
+    recalls, tokens, timings = [], [], []
+    for item in queries:
+        start = time.perf_counter()
+        nodes = retriever.retrieve(item["query"])
+        timings.append(time.perf_counter() - start)
+        gold = {evidence["title"] for evidence in item["evidence_list"]}
+        found = {node.node.metadata.get("title") for node in nodes}
+        recalls.append(len(gold & found) / len(gold) if gold else 1.0)
+        tokens.append(count_tokens(getContextString(nodes)))
+    timings = np.asarray(timings) * 1000
+    return {"evidence_recall": float(np.mean(recalls)), "context_tokens": float(np.mean(tokens)),
+            "p50_ms": float(np.percentile(timings, 50)), "p95_ms": float(np.percentile(timings, 95))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evidence recall and context size against latency for reranking.")
+    parser.add_argument("--query-file", default=QUERY_DATA_PATH)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--configs", nargs="+", default=["3", "30:3", "30:2"],
+                        help="K to keep the top K without reranking, N:K to rerank N candidates down to K")
+    parser.add_argument("--mode", choices=["dense", "hybrid"], default="dense")
+    parser.add_argument("--backend", choices=sorted(STORE_BACKENDS), default="chroma")
+    parser.add_argument("--model", default=DEFAULT_RERANK_MODEL)
+    parser.add_argument("--output", default=None, help="also write the report here as JSON")
+    args = parser.parse_args()
+
+    handle = get_shared_index(backend=args.backend)
+    queries = [item for _, item in load_queries(args.query_file, 0, args.queries)]
+
+    report = {}
+    for config in args.configs:
+        if ":" not in config:
+            report[f"top{config}"] = run(handle.retriever(int(config), mode=args.mode), queries)
+            continue
+        fetch_k, top_k = map(int, config.split(":"))
+        # A fresh score cache per configuration, so the first pass is really cold
+        reranker = Reranker(args.model)
+        retriever = handle.retriever(top_k, mode=args.mode, reranker=reranker, rerank_fetch_k=fetch_k)
+        report[f"rerank{fetch_k}to{top_k}"] = run(retriever, queries)
+        report[f"rerank{fetch_k}to{top_k}_cached"] = run(retriever, queries)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
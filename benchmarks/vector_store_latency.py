@@ -0,0 +1,86 @@
+"""
+Compares query latency of the vector store backends on the same chunks.
+
+Every backend is opened (and built from the corpus if it does not exist yet), the queries are embedded once,
+and each backend then answers every query from the precomputed embedding, so the numbers only cover the store.
+Also reports how often each backend returns the same top-k chunks as the first one.
+
+    python benchmarks/vector_store_latency.py --backends chroma mmap ivf --queries 200 --nprobe 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from batching import load_queries, QUERY_DATA_PATH
+from utils import loadEmbeddingModel
+from vectorstore import open_store, STORE_BACKENDS, DATABASE_PATH, CORPUS_PATH
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1000
+    return {"p50_ms": float(np.percentile(timings, 50)), "p95_ms": float(np.percentile(timings, 95)),
+            "p99_ms": float(np.percentile(timings, 99)), "mean_ms": float(timings.mean())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare query latency of the vector store backends.")
+    parser.add_argument("--backends", nargs="+", choices=sorted(STORE_BACKENDS), default=["chroma", "mmap", "ivf"])
+    parser.add_argument("--database-path", default=DATABASE_PATH)
+    parser.add_argument("--name", default="default")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--query-file", default=QUERY_DATA_PATH)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--embed-host", default="huggingface")
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--refine", type=int, default=8)
+    parser.add_argument("--quantizer", choices=["int8", "pq"], default="int8")
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--output", default=None, help="also write the report here as JSON")
+    args = parser.parse_args()
+
+    embed_model = loadEmbeddingModel(args.embed_host)
+    queries = [item["query"] for _, item in load_queries(args.query_file, 0, args.queries)]
+    embeddings = embed_model.get_text_embedding_batch(queries)
+
+    report = {}
+    results = {}
+    ivf_options = {"nprobe": args.nprobe, "refine": args.refine, "quantizer": args.quantizer, "pq_m": args.pq_m}
+    for backend in args.backends:
+        options = ivf_options if backend == "ivf" else {}
+        store = open_store(backend, database_path=args.database_path, name=args.name, **options)
+        store.load_or_create_index(embed_model=embed_model, corpus_path=args.corpus)
+
+        start = time.perf_counter()
+        vector_store = open_store(backend, database_path=args.database_path, name=args.name, **options).vector_store()
+        if backend == "ivf":
+            ivf = vector_store.ensure_ivf()
+        open_time = time.perf_counter() - start
+
+        timings, ids = [], []
+        for embedding in embeddings:
+            query = VectorStoreQuery(query_embedding=embedding, similarity_top_k=args.top_k)
+            start = time.perf_counter()
+            result = vector_store.query(query)
+            timings.append(time.perf_counter() - start)
+            ids.append(result.ids)
+        results[backend] = ids
+        report[backend] = {"open_ms": open_time * 1000, **percentiles(timings)}
+        if backend == "ivf":
+            report[backend]["code_bytes_per_chunk"] = int(ivf.codes.shape[1])
+
+    reference = args.backends[0]
+    for backend in args.backends[1:]:
+        overlap = [len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(results[reference], results[backend])]
+        report[backend][f"overlap_with_{reference}"] = float(np.mean(overlap))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
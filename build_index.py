@@ -0,0 +1,44 @@
+import argparse
+from utils import loadEmbeddingModel, CHUNK_SIZE, CHUNK_OVERLAP
+from chunk_store import load_chunk_store, CHUNK_STORE_PATH
+from vectorstore import open_store, STORE_BACKENDS, DATABASE_PATH, CORPUS_PATH
+from indexing import EmbeddingPipeline, DEFAULT_BATCH_SIZE
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the vector index, or bring it up to date with the corpus.")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--database-path", default=DATABASE_PATH)
+    parser.add_argument("--name", default="default")
+    parser.add_argument("--backend", choices=sorted(STORE_BACKENDS), default="chroma")
+    parser.add_argument("--nlist", type=int, default=None, help="ivf lists, defaults to 4 * sqrt(chunks)")
+    parser.add_argument("--quantizer", choices=["int8", "pq"], default="int8", help="ivf code type")
+    parser.add_argument("--pq-m", type=int, default=None, help="bytes per chunk with pq codes, defaults to dim / 4")
+    parser.add_argument("--embed-host", default="huggingface")
+    parser.add_argument("--embed-name", default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--chunk-workers", type=int, default=0,
+                        help="processes splitting the corpus, only used when it has not been split with these settings")
+    parser.add_argument("--chunk-store", default=CHUNK_STORE_PATH)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="embedding worker processes, each loading its own model; 0 embeds in this process")
+    parser.add_argument("--embed-cache", action="store_true",
+                        help="reuse and fill the on-disk embedding cache, so unchanged text is never re-embedded")
+    parser.add_argument("--full", action="store_true",
+                        help="delete the stored collection and re-embed every chunk instead of updating it")
+    args = parser.parse_args()
+
+    embed_model = loadEmbeddingModel(args.embed_host, args.embed_name, cache=args.embed_cache)
+    options = {"nlist": args.nlist, "quantizer": args.quantizer, "pq_m": args.pq_m} if args.backend == "ivf" else {}
+    store = open_store(args.backend, database_path=args.database_path, name=args.name, **options)
+    pipeline = EmbeddingPipeline(embed_model=embed_model, embed_host=args.embed_host, embed_name=args.embed_name,
+                                 batch_size=args.batch_size, num_workers=args.workers)
+    chunks = load_chunk_store(args.corpus, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                              num_workers=args.chunk_workers, root=args.chunk_store)
+    nodes = chunks.iter_nodes()
+    if args.full:
+        store.create_index(llama_index_nodes=nodes, embed_model=embed_model, pipeline=pipeline, chunk_store=chunks)
+    else:
+        store.update_index(llama_index_nodes=nodes, embed_model=embed_model, pipeline=pipeline, chunk_store=chunks)
@@ -0,0 +1,245 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from llama_index.core.schema import MetadataMode, NodeRelationship, ObjectType, RelatedNodeInfo, TextNode
+from logger_config import logger
+from utils import (iter_records, record_to_document, make_text_splitter, CHUNK_SIZE, CHUNK_OVERLAP,
+                   DOCUMENT_WINDOW, READ_BLOCK_SIZE)
+
+CHUNK_STORE_PATH = "data/chunks"
+FINGERPRINTS_FILE = "fingerprints.json"
+META_FILE = "meta.json"
+DOCUMENTS_FILE = "documents.jsonl"
+IDS_FILE = "ids.bin"
+SPANS_FILE = "spans.bin"
+LOOSE_FILE = "loose.json"
+ID_DTYPE = np.dtype("S40")
+SPAN_DTYPE = np.dtype([("document", "<i8"), ("start", "<i8"), ("end", "<i8")])
+
+
+def corpus_fingerprint(input_file, cache_path=None):
+    """
+    SHA-1 of the corpus file. The hash is remembered next to the file's size and modification time in
+    cache_path, so an unchanged corpus is not read again on every start.
+    """
+    stat = os.stat(input_file)
+    key = os.path.abspath(input_file)
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r') as file:
+            cached = json.load(file)
+    entry = cached.get(key)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha1"]
+    digest = hashlib.sha1()
+    with open(input_file, 'rb') as file:
+        for block in iter(lambda: file.read(READ_BLOCK_SIZE), b""):
+            digest.update(block)
+    cached[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": digest.hexdigest()}
+    if cache_path:
+        with open(cache_path + ".tmp", 'w') as file:
+            json.dump(cached, file)
+        os.replace(cache_path + ".tmp", cache_path)
+    return cached[key]["sha1"]
+
+
+def _split_window(records, chunk_size, chunk_overlap):
+    """
+    Splits a window of corpus articles, returning (position in window, node id, start, end, text) per chunk.
+    text is only set for chunks whose offsets into the article are unknown.
+    """
+    documents = [record_to_document(data) for data in records]
+    positions = {document.doc_id: i for i, document in enumerate(documents)}
+    nodes = make_text_splitter(chunk_size, chunk_overlap).get_nodes_from_documents(documents)
+    chunks = []
+    for node in nodes:
+        located = node.start_char_idx is not None and node.end_char_idx is not None
+        chunks.append((positions[node.ref_doc_id], node.node_id, node.start_char_idx if located else -1,
+                       node.end_char_idx if located else -1,
+                       None if located else node.get_content(metadata_mode=MetadataMode.NONE)))
+    return chunks
+
+
+def _windows(input_file, window):
+    records = iter_records(input_file)
+    while True:
+        batch = list(itertools.islice(records, window))
+        if not batch:
+            return
+        yield batch
+
+
+class ChunkStore:
+    """
+    The split corpus on disk, so it is chunked once per corpus and splitter settings rather than on every build.
+
+    Articles are kept once in documents.jsonl and every chunk as its id and character span into its article, in
+    fixed-width binary files; the few chunks the splitter could not locate in their article keep their text in
+    loose.json. Nodes read back carry the same ids, text, metadata and relationships as freshly split ones.
+
+    Attributes:
+        path (str): Directory of the store, named after its key.
+        meta (dict): Corpus hash, splitter settings and counts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as file:
+            self.meta = json.load(file)
+
+    def __len__(self):
+        return self.meta["chunks"]
+
+    @staticmethod
+    def key(corpus_sha1, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+        return hashlib.sha1(f"{corpus_sha1}:{chunk_size}:{chunk_overlap}".encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def build(cls, input_file, path, corpus_sha1, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+              num_workers=0, window=DOCUMENT_WINDOW):
+        """
+        Splits the corpus into a new store at path, window articles per task across num_workers processes
+        (0 splits in this process). Nothing is visible at path until the store is complete.
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        num_documents = num_chunks = 0
+        loose = {}
+        with open(os.path.join(tmp_path, DOCUMENTS_FILE), 'w', encoding='utf-8') as documents_file, \
+                open(os.path.join(tmp_path, IDS_FILE), 'wb') as ids_file, \
+                open(os.path.join(tmp_path, SPANS_FILE), 'wb') as spans_file:
+
+            def write(records, chunks):
+                nonlocal num_documents, num_chunks
+                for data in records:
+                    document = record_to_document(data)
+                    documents_file.write(json.dumps({"id": document.doc_id, "metadata": document.metadata,
+                                                     "text": document.text}) + "\n")
+                spans = np.empty(len(chunks), dtype=SPAN_DTYPE)
+                for i, (position, node_id, start, end, text) in enumerate(chunks):
+                    spans[i] = (num_documents + position, start, end)
+                    if text is not None:
+                        loose[node_id] = text
+                ids_file.write(np.array([chunk[1] for chunk in chunks], dtype=ID_DTYPE).tobytes())
+                spans_file.write(spans.tobytes())
+                num_documents += len(records)
+                num_chunks += len(chunks)
+
+            if num_workers == 0:
+                for records in _windows(input_file, window):
+                    write(records, _split_window(records, chunk_size, chunk_overlap))
+            else:
+                with ProcessPoolExecutor(max_workers=num_workers,
+                                         mp_context=multiprocessing.get_context("spawn")) as pool:
+                    # Keep a bounded number of windows in flight so memory does not grow with the corpus
+                    pending = []
+                    for records in _windows(input_file, window):
+                        pending.append((records, pool.submit(_split_window, records, chunk_size, chunk_overlap)))
+                        if len(pending) >= 2 * num_workers:
+                            records, future = pending.pop(0)
+                            write(records, future.result())
+                    for records, future in pending:
+                        write(records, future.result())
+
+        with open(os.path.join(tmp_path, LOOSE_FILE), 'w') as file:
+            json.dump(loose, file)
+        meta = {"corpus": os.path.abspath(input_file), "corpus_sha1": corpus_sha1, "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap, "documents": num_documents, "chunks": num_chunks}
+        with open(os.path.join(tmp_path, META_FILE), 'w') as file:
+            json.dump(meta, file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        logger.info(f"Split {num_documents} documents from {input_file} into {num_chunks} chunks at {path}")
+        return cls(path)
+
+    def _spans(self):
+        return np.memmap(os.path.join(self.path, SPANS_FILE), dtype=SPAN_DTYPE, mode='r') if len(self) else \
+            np.empty(0, dtype=SPAN_DTYPE)
+
+    def _ids(self):
+        return np.memmap(os.path.join(self.path, IDS_FILE), dtype=ID_DTYPE, mode='r') if len(self) else \
+            np.empty(0, dtype=ID_DTYPE)
+
+    def _articles(self):
+        """
+        Yields every article as its documents.jsonl entry and its chunks as (node id, start, end, text), start and
+        end being None for loose chunks.
+        """
+        with open(os.path.join(self.path, LOOSE_FILE), 'r') as file:
+            loose = json.load(file)
+        ids, spans = self._ids(), self._spans()
+        i = 0
+        with open(os.path.join(self.path, DOCUMENTS_FILE), 'r', encoding='utf-8') as file:
+            for position, line in enumerate(file):
+                document = json.loads(line)
+                chunks = []
+                while i < len(spans) and spans[i]["document"] == position:
+                    node_id = ids[i].decode("ascii")
+                    start, end = int(spans[i]["start"]), int(spans[i]["end"])
+                    if start >= 0:
+                        chunks.append((node_id, start, end, document["text"][start:end]))
+                    else:
+                        chunks.append((node_id, None, None, loose[node_id]))
+                    i += 1
+                yield document, chunks
+
+    def iter_nodes(self):
+        """
+        Yields the chunks as nodes in corpus order, reading one article at a time.
+        """
+        for document, chunks in self._articles():
+            source = RelatedNodeInfo(node_id=document["id"], node_type=ObjectType.DOCUMENT,
+                                     metadata=document["metadata"])
+            nodes = []
+            for node_id, start, end, text in chunks:
+                node = TextNode(id_=node_id, text=text, metadata=dict(document["metadata"]), start_char_idx=start,
+                                end_char_idx=end, relationships={NodeRelationship.SOURCE: source})
+                if nodes:
+                    node.relationships[NodeRelationship.PREVIOUS] = nodes[-1].as_related_node_info()
+                    nodes[-1].relationships[NodeRelationship.NEXT] = node.as_related_node_info()
+                nodes.append(node)
+            yield from nodes
+
+    def iter_chunks(self):
+        """
+        Yields (node id, text, metadata) for every chunk in corpus order, without building nodes. This is what the
+        BM25 and metadata indexes are built from.
+        """
+        for document, chunks in self._articles():
+            for node_id, _, _, text in chunks:
+                yield node_id, text, document["metadata"]
+
+
+def load_chunk_store(input_file, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, num_workers=0,
+                     root=CHUNK_STORE_PATH):
+    """
+    Returns the chunk store of the corpus for the given splitter settings, splitting the corpus into it first
+    when this corpus has not been split with them before. Stores of earlier versions of the same corpus file
+    are removed.
+    """
+    os.makedirs(root, exist_ok=True)
+    corpus_sha1 = corpus_fingerprint(input_file, cache_path=os.path.join(root, FINGERPRINTS_FILE))
+    key = ChunkStore.key(corpus_sha1, chunk_size, chunk_overlap)
+    path = os.path.join(root, key)
+    if os.path.exists(os.path.join(path, META_FILE)):
+        logger.info(f"Reading chunks of {input_file} from {path}")
+        return ChunkStore(path)
+
+    corpus = os.path.abspath(input_file)
+    for name in os.listdir(root):
+        meta_path = os.path.join(root, name, META_FILE)
+        if name == key or not os.path.exists(meta_path):
+            continue
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        if meta.get("corpus") == corpus and meta.get("corpus_sha1") != corpus_sha1:
+            logger.info(f"Removing the chunk store of an earlier version of {input_file} at {name}")
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return ChunkStore.build(input_file, path, corpus_sha1, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                            num_workers=num_workers)
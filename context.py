@@ -0,0 +1,146 @@
+import re
+from llama_index.core.schema import MetadataMode
+from history import _terms, count_tokens
+
+MIN_TEXT_OVERLAP = 30
+GAP_MARKER = "[...]"
+
+
+def _document_key(node):
+    if node.ref_doc_id:
+        return node.ref_doc_id
+    metadata = node.metadata
+    return (metadata.get("title"), metadata.get("source"), metadata.get("published_at"))
+
+
+def _text_overlap(left, right, max_overlap):
+    """Length of the longest suffix of left that is a prefix of right, if at least MIN_TEXT_OVERLAP long."""
+    for size in range(min(len(left), len(right), max_overlap), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_spans(chunks):
+    """
+    Merges the chunks of one document into as few passages as possible.
+
+    Chunks with character offsets into their document are ordered by them, and a chunk starting before the end
+    of the previous passage only contributes the text past it. Chunks without offsets are merged pairwise where
+    the end of one repeats the start of the other, which is how the splitter's overlap shows up.
+
+    Args:
+        chunks (list): The nodes of one document.
+
+    Returns:
+        list: The passages, in document order where it is known.
+    """
+    located = [node for node in chunks if node.start_char_idx is not None and node.end_char_idx is not None]
+    located_ids = {id(node) for node in located}
+    passages = []
+    if located:
+        end = None
+        for node in sorted(located, key=lambda node: node.start_char_idx):
+            text = node.get_content(metadata_mode=MetadataMode.NONE)
+            if end is not None and node.start_char_idx <= end:
+                passages[-1] += text[end - node.start_char_idx:]
+            else:
+                passages.append(text)
+            end = max(end or 0, node.end_char_idx)
+
+    loose = [node.get_content(metadata_mode=MetadataMode.NONE) for node in chunks if id(node) not in located_ids]
+    max_overlap = max((len(text) for text in passages + loose), default=0) // 2
+    passages.extend(loose)
+    merged = True
+    while merged and len(passages) > 1:
+        merged = False
+        for i, left in enumerate(passages):
+            for j, right in enumerate(passages):
+                if i == j:
+                    continue
+                if right in left:
+                    overlap = len(right)
+                    joined = left
+                else:
+                    overlap = _text_overlap(left, right, max_overlap)
+                    joined = left + right[overlap:]
+                if overlap:
+                    passages[i] = joined
+                    del passages[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return passages
+
+
+def _sentences(text):
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence.strip()]
+
+
+def _render(articles):
+    blocks = []
+    for header, passages in articles:
+        body = f"\n{GAP_MARKER}\n".join(passages)
+        blocks.append(f"{header}\n{body}" if header else body)
+    return "\n\n".join(blocks)
+
+
+def assemble_context(nodes, query=None, max_tokens=None):
+    """
+    Builds the context string for retrieved nodes.
+
+    Chunks of the same article are merged so the splitter's overlap appears once, and every article gets its
+    metadata header once, articles in the order of their best-ranked chunk. With max_tokens, the sentences sharing
+    the fewest words with the query are dropped, those of lower-ranked articles first, until the context fits;
+    headers are always kept.
+
+    Args:
+        nodes (list): Retrieved nodes, best first.
+        query (str, optional): The query, used to rank sentences when trimming.
+        max_tokens (int, optional): Token budget of the context.
+
+    Returns:
+        str: The context.
+    """
+    documents = {}
+    for item in nodes:
+        node = getattr(item, "node", item)
+        documents.setdefault(_document_key(node), []).append(node)
+
+    articles = []
+    for chunks in documents.values():
+        header = chunks[0].get_metadata_str(mode=MetadataMode.LLM)
+        passages = [passage.replace("\n\n", "\n").strip() for passage in merge_spans(chunks)]
+        articles.append((header, passages))
+
+    context = _render(articles)
+    if not max_tokens:
+        return context
+    excess = count_tokens(context) - max_tokens
+    if excess <= 0:
+        return context
+
+    terms = _terms(query or "")
+    sentences = []
+    for rank, (_, passages) in enumerate(articles):
+        for p, passage in enumerate(passages):
+            for sentence in _sentences(passage):
+                sentences.append({"position": (rank, p), "text": sentence, "kept": True,
+                                  "relevance": len(_terms(sentence) & terms), "rank": rank})
+    # Least relevant first, and among equally relevant sentences those of lower-ranked articles
+    dropping = sorted(sentences, key=lambda sentence: (sentence["relevance"], -sentence["rank"]))
+    while excess > 0 and dropping:
+        # Drop roughly enough sentences for the estimated excess, then measure again
+        while excess > 0 and dropping:
+            sentence = dropping.pop(0)
+            sentence["kept"] = False
+            excess -= count_tokens(sentence["text"])
+        trimmed = []
+        for rank, (header, passages) in enumerate(articles):
+            kept = [" ".join(sentence["text"] for sentence in sentences
+                             if sentence["position"] == (rank, p) and sentence["kept"]) for p in range(len(passages))]
+            trimmed.append((header, [passage for passage in kept if passage]))
+        context = _render(trimmed)
+        excess = count_tokens(context) - max_tokens
+    return context
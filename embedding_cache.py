@@ -0,0 +1,180 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Any, List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from logger_config import logger
+from tracing import tracer
+
+DEFAULT_CACHE_PATH = "data/cache/embeddings.sqlite"
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_TOUCH_INTERVAL = 300
+MAX_PENDING_TOUCHES = 1000
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    An on-disk store of embeddings keyed by (model name, kind, normalized text).
+
+    Vectors are stored as float32 blobs in SQLite. Once the cache grows past max_entries the least recently
+    used tenth of it is evicted. The row count is kept in memory, and hits only refresh the last use of a row
+    touched more than touch_interval seconds ago; those updates are written along with the next put.
+
+    Attributes:
+        path (str): Location of the SQLite file.
+        max_entries (int): Number of vectors kept before evicting.
+        touch_interval (float): Seconds before a hit refreshes the last use of its row again.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that had to be embedded by the model.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 touch_interval=DEFAULT_TOUCH_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                           "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._conn.commit()
+        # Other processes sharing the file make this an underestimate, it is recounted before evicting
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._touched = {}
+
+    @staticmethod
+    def _key(model_name, kind, text):
+        return hashlib.sha1(f"{model_name}\x00{kind}\x00{normalize_text(text)}".encode("utf-8")).digest()
+
+    def get_many(self, model_name, kind, texts):
+        """
+        Returns the cached vector for each text, or None where it is not cached.
+        """
+        keys = [self._key(model_name, kind, text) for text in texts]
+        found = {}
+        with self._lock:
+            now = time.time()
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, vector, last_used in rows:
+                    found[key] = vector
+                    if now - last_used > self.touch_interval:
+                        self._touched[key] = now
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            if len(self._touched) >= MAX_PENDING_TOUCHES:
+                self._flush_touched()
+                self._conn.commit()
+        return [array("f", found[key]).tolist() if key in found else None for key in keys]
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(now, key) for key, now in self._touched.items()])
+            self._touched.clear()
+
+    def flush(self):
+        """Writes the pending last use updates of cache hits."""
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    def put_many(self, model_name, kind, texts, vectors):
+        now = time.time()
+        rows = [(self._key(model_name, kind, text), array("f", vector).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._flush_touched()
+            # A key already stored holds the same model's vector for the same text, so it is kept as it is
+            self._count += self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows).rowcount
+            if self._count > self.max_entries:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._count > self.max_entries:
+                evict = self._count - int(self.max_entries * 0.9)
+                self._conn.execute("DELETE FROM embeddings WHERE key IN "
+                                   "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (evict,))
+                self._count -= evict
+                logger.debug(f"Evicted {evict} embeddings from {self.path}")
+            self._conn.commit()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model so repeated texts are served from an EmbeddingCache instead of the model.
+    It reports the wrapped model's name, so indexes built through it stay compatible with the model itself. Cache
+    entries are keyed on the model's cache_name when it has one, e.g. an ONNX export that shares its name with the
+    original model but not its exact vectors.
+    """
+
+    _model: Any = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+    _cache_name: str = PrivateAttr()
+
+    def __init__(self, model, cache):
+        super().__init__(model_name=model.model_name, embed_batch_size=model.embed_batch_size,
+                         callback_manager=model.callback_manager)
+        self._model = model
+        self._cache = cache
+        self._cache_name = getattr(model, "cache_name", None) or model.model_name
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def lookup(self, texts, kind="text"):
+        return self._cache.get_many(self._cache_name, kind, texts)
+
+    def store(self, texts, vectors, kind="text"):
+        self._cache.put_many(self._cache_name, kind, texts, vectors)
+
+    def _embed(self, texts, kind, embed_fn):
+        vectors = self.lookup(texts, kind)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        span = tracer.current()
+        span.add("embedding_cache_hits", len(texts) - len(missing))
+        span.add("embedding_cache_misses", len(missing))
+        if missing:
+            computed = embed_fn([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+            self.store([texts[i] for i in missing], computed, kind)
+        return vectors
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query], "query", lambda texts: [self._model.get_query_embedding(texts[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        vector = self.lookup([query], "query")[0]
+        tracer.current().add("embedding_cache_hits" if vector is not None else "embedding_cache_misses")
+        if vector is None:
+            vector = await self._model.aget_query_embedding(query)
+            self.store([query], [vector], "query")
+        return vector
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "text", self._model.get_text_embedding_batch)
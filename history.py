@@ -0,0 +1,162 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+from logger_config import logger
+
+DEFAULT_TOKEN_BUDGET = 3000
+DEFAULT_SUMMARY_CHARS = 400
+HEADER_KEYS = ("title", "source", "published_at")
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Counts tokens with tiktoken's cl100k_base, or estimates four characters per token when it is unavailable."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, estimating token counts: {e}")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _terms(text):
+    return set(re.findall(r"\w{3,}", str(text).lower()))
+
+
+def summarize_observation(observation, terms, max_chars=DEFAULT_SUMMARY_CHARS):
+    """
+    Extractive summary of an observation: its metadata header lines, followed by the sentences sharing the most
+    words with terms, in their original order, up to max_chars.
+    """
+    header, body = [], []
+    for line in str(observation).split("\n"):
+        key = line.split(":", 1)[0].strip().lower()
+        (header if key in HEADER_KEYS else body).append(line)
+    sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", " ".join(body)) if sentence.strip()]
+    ranked = sorted(range(len(sentences)), key=lambda i: -len(_terms(sentences[i]) & terms))
+    chosen, used = set(), 0
+    for i in ranked:
+        if used + len(sentences[i]) > max_chars:
+            continue
+        chosen.add(i)
+        used += len(sentences[i]) + 1
+    summary = " ".join(sentences[i] for i in sorted(chosen))
+    return "\n".join(dict.fromkeys(header)) + ("\n" if header else "") + f"{summary} [...]"
+
+
+@dataclass
+class Action:
+    action: str
+    input: Any
+    observation: Optional[str] = None
+
+
+@dataclass
+class Episode:
+    """One step of the agent: its thought and the actions it took, with their observations."""
+    iteration: int
+    thought: str
+    actions: List[Action] = field(default_factory=list)
+
+    def render(self, terms=None, max_chars=DEFAULT_SUMMARY_CHARS):
+        """Renders the episode as plain text, summarising the observations when terms are given."""
+        lines = [f"THOUGHT {self.iteration} :{self.thought}"]
+        multiple = len(self.actions) > 1
+        for j, action in enumerate(self.actions, start=1):
+            label = f"{self.iteration}.{j}" if multiple else f"{self.iteration}"
+            lines.append(f"ACTION {label} :{action.action}")
+            lines.append(f"ACTION INPUT {label} :{action.input}")
+            if action.observation is not None:
+                observation = action.observation
+                if terms is not None:
+                    observation = summarize_observation(observation, terms | _terms(action.input), max_chars)
+                lines.append(f"OBSERVATION {label} :{observation}")
+        return "\n".join(lines)
+
+
+class History:
+    """
+    The agent's interaction history, kept as structured episodes and rendered to plain text for the prompt.
+
+    When the rendered history exceeds token_budget, the observations of older episodes are replaced by extractive
+    summaries, oldest first, leaving the most recent keep_full episodes intact. If that is still not enough, the
+    older episodes are dropped from the prompt, oldest first, and only as a last resort are the recent episodes
+    summarised too, and dropped down to the last one.
+    Plain strings can be appended too and are rendered verbatim.
+
+    Attributes:
+        episodes (list): The episodes in order.
+        token_budget (int): Maximum number of tokens of rendered history.
+        keep_full (int): Number of most recent episodes only summarised as a last resort.
+        summary_chars (int): Length of each summarised observation.
+    """
+
+    def __init__(self, episodes=None, token_budget=DEFAULT_TOKEN_BUDGET, keep_full=1, summary_chars=DEFAULT_SUMMARY_CHARS):
+        self.episodes = list(episodes or [])
+        self.token_budget = token_budget
+        self.keep_full = keep_full
+        self.summary_chars = summary_chars
+
+    def fresh(self):
+        """Returns an empty history with the same settings."""
+        return History(token_budget=self.token_budget, keep_full=self.keep_full, summary_chars=self.summary_chars)
+
+    def append(self, episode):
+        self.episodes.append(episode)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def __iter__(self):
+        return iter(self.episodes)
+
+    def _render(self, episode, terms=None):
+        if isinstance(episode, Episode):
+            return episode.render(terms, self.summary_chars)
+        return str(episode)
+
+    def render(self, query=""):
+        """
+        Renders the history as plain text that fits in the token budget.
+
+        Args:
+            query (str): The question, whose words steer which sentences survive summarisation.
+
+        Returns:
+            str: The rendered history.
+        """
+        parts = [self._render(episode) for episode in self.episodes]
+        tokens = [count_tokens(part) for part in parts]
+        if sum(tokens) <= self.token_budget:
+            return "\n\n".join(parts)
+
+        terms = _terms(query)
+        episodes = list(self.episodes)
+        recent = max(len(parts) - self.keep_full, 0)
+
+        def summarise(indexes):
+            for i in indexes:
+                if sum(tokens) <= self.token_budget:
+                    return
+                parts[i] = self._render(episodes[i], terms)
+                tokens[i] = count_tokens(parts[i])
+
+        summarise(range(recent))
+        dropped = 0
+        while dropped < recent and sum(tokens[dropped:]) > self.token_budget:
+            dropped += 1
+        del parts[:dropped], tokens[:dropped], episodes[:dropped]
+        # Last resort, the recent episodes alone are over the budget
+        summarise(range(len(parts)))
+        while len(parts) > 1 and sum(tokens) > self.token_budget:
+            parts.pop(0)
+            tokens.pop(0)
+            dropped += 1
+        logger.debug(f"History compacted to {sum(tokens)} tokens, {dropped} episodes dropped")
+        return "\n\n".join(parts)
@@ -0,0 +1,126 @@
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from llama_index.core.schema import MetadataMode
+from tqdm import tqdm
+from logger_config import logger
+from utils import loadEmbeddingModel
+from embedding_cache import CachedEmbedding
+
+DEFAULT_BATCH_SIZE = 64
+
+_worker_model = None
+
+
+def _init_worker(embed_host, embed_name, num_threads):
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    _worker_model = loadEmbeddingModel(embed_host, embed_name, num_threads=num_threads)
+
+
+def _embed_texts(texts):
+    return _worker_model.get_text_embedding_batch(texts)
+
+
+class EmbeddingPipeline:
+    """
+    The embedding stage of index construction.
+
+    Nodes are embedded in batches, either in-process with the given model or across a pool of worker processes
+    that each load their own copy of it, and every embedded batch is handed to a writer callback straight away
+    so the caller can store it in bulk and checkpoint progress. When embed_model is a CachedEmbedding, cached
+    chunks are looked up in this process and only the misses are sent to the workers.
+
+    Attributes:
+        embed_model (object): The model used when running in-process.
+        embed_host (str): Host passed to loadEmbeddingModel in the worker processes.
+        embed_name (str): Model name passed to loadEmbeddingModel in the worker processes.
+        batch_size (int): Number of chunks embedded per batch.
+        num_workers (int): Number of worker processes, 0 embeds in the current process.
+    """
+
+    def __init__(self, embed_model=None, embed_host="huggingface", embed_name=None, batch_size=DEFAULT_BATCH_SIZE,
+                 num_workers=0):
+        if embed_model is None and num_workers == 0:
+            raise ValueError("An embed_model is required to embed in-process")
+        self.embed_model = embed_model
+        self.embed_host = embed_host
+        self.embed_name = embed_name
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+    def _batches(self, nodes):
+        nodes = iter(nodes)
+        while True:
+            batch = list(itertools.islice(nodes, self.batch_size))
+            if not batch:
+                return
+            yield batch, [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+
+    def _embedded_batches(self, nodes):
+        if self.num_workers == 0:
+            for batch, texts in self._batches(nodes):
+                yield batch, self.embed_model.get_text_embedding_batch(texts)
+            return
+
+        cache = self.embed_model if isinstance(self.embed_model, CachedEmbedding) else None
+
+        def resolve(texts, vectors, missing, future):
+            if future is not None:
+                computed = future.result()
+                for i, vector in zip(missing, computed):
+                    vectors[i] = vector
+                if cache is not None:
+                    cache.store([texts[i] for i in missing], computed)
+            return vectors
+
+        num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        with ProcessPoolExecutor(max_workers=self.num_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(self.embed_host, self.embed_name, num_threads)) as pool:
+            # Keep a bounded number of batches in flight so memory does not grow with the corpus
+            pending = []
+            for batch, texts in self._batches(nodes):
+                vectors = cache.lookup(texts) if cache is not None else [None] * len(texts)
+                missing = [i for i, vector in enumerate(vectors) if vector is None]
+                future = pool.submit(_embed_texts, [texts[i] for i in missing]) if missing else None
+                pending.append((batch, texts, vectors, missing, future))
+                if len(pending) >= 2 * self.num_workers:
+                    batch, *rest = pending.pop(0)
+                    yield batch, resolve(*rest)
+            for batch, *rest in pending:
+                yield batch, resolve(*rest)
+
+    def run(self, nodes, write_batch):
+        """
+        Embeds the nodes and passes each batch to write_batch once its embeddings are set.
+
+        Args:
+            nodes (iterable): The nodes to embed, consumed one batch at a time.
+            write_batch (callable): Called with each list of embedded nodes, in order.
+
+        Returns:
+            float: Throughput in chunks per second.
+        """
+        start = time.perf_counter()
+        done = 0
+        total = len(nodes) if hasattr(nodes, "__len__") else None
+        with tqdm(total=total, desc="Embedding chunks", unit="chunk") as progress:
+            for batch, embeddings in self._embedded_batches(nodes):
+                for node, embedding in zip(batch, embeddings):
+                    node.embedding = embedding
+                write_batch(batch)
+                done += len(batch)
+                progress.update(len(batch))
+                progress.set_postfix(chunks_per_sec=f"{done / (time.perf_counter() - start):.1f}")
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Embedded {done} chunks in {elapsed:.1f}s ({rate:.1f} chunks/sec, batch_size={self.batch_size}, "
+                    f"num_workers={self.num_workers})")
+        return rate
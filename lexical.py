@@ -0,0 +1,164 @@
+import re
+from typing import List
+import numpy as np
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from logger_config import logger
+
+BM25_FILE = "bm25.npz"
+RRF_K = 60
+STOPWORDS = frozenset("a an and are as at be by for from has have in is it its of on or that the this to was were "
+                      "which with what who whom whose when where how did does do".split())
+
+
+def tokenize(text):
+    return [token for token in re.findall(r"\w+", text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    An in-memory BM25 inverted index over chunk texts.
+
+    Postings are kept in flat arrays, one int32 chunk position and one float32 precomputed BM25 weight per
+    (term, chunk) pair, laid out contiguously per term. Scoring a query is then a single weighted bincount over the
+    postings of its terms.
+
+    Attributes:
+        node_ids (np.ndarray): Node id of every indexed chunk, by position.
+        terms (dict): Term to position in offsets.
+        offsets (np.ndarray): Start of each term's postings, with the total count appended.
+        docs (np.ndarray): Chunk position of every posting.
+        weights (np.ndarray): BM25 weight of every posting.
+    """
+
+    def __init__(self, node_ids, terms, offsets, docs, weights):
+        self.node_ids = node_ids
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self._positions = None
+
+    @classmethod
+    def build(cls, chunks, k1=1.5, b=0.75):
+        """
+        Builds the index.
+
+        Args:
+            chunks (iterable): (node id, text) pairs.
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 length normalisation. Defaults to 0.75.
+
+        Returns:
+            BM25Index: The index.
+        """
+        node_ids, doc_lens = [], []
+        postings = {}
+        for position, (node_id, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            node_ids.append(node_id)
+            doc_lens.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((position, count))
+
+        doc_lens = np.asarray(doc_lens, dtype=np.float32)
+        avg_len = float(doc_lens.mean()) if len(doc_lens) else 1.0
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        docs, weights = [], []
+        for i, term in enumerate(terms):
+            positions = np.fromiter((position for position, _ in postings[term]), dtype=np.int32)
+            tfs = np.fromiter((count for _, count in postings[term]), dtype=np.float32)
+            idf = np.log(1 + (len(node_ids) - len(positions) + 0.5) / (len(positions) + 0.5))
+            norm = k1 * (1 - b + b * doc_lens[positions] / max(avg_len, 1.0))
+            docs.append(positions)
+            weights.append((idf * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32))
+            offsets[i + 1] = offsets[i] + len(positions)
+        logger.info(f"Built BM25 index over {len(node_ids)} chunks and {len(terms)} terms")
+        return cls(np.asarray(node_ids), {term: i for i, term in enumerate(terms)}, offsets,
+                   np.concatenate(docs) if docs else np.zeros(0, dtype=np.int32),
+                   np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32))
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            np.savez(file, node_ids=self.node_ids, terms=np.asarray(list(self.terms)), offsets=self.offsets,
+                     docs=self.docs, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        terms = {term: i for i, term in enumerate(data["terms"].tolist())}
+        return cls(data["node_ids"], terms, data["offsets"], data["docs"], data["weights"])
+
+    def search(self, query, top_k, node_ids=None):
+        """
+        Returns up to top_k (node id, score) pairs for the query, best first, only among node_ids when given.
+        """
+        spans = [(self.offsets[i], self.offsets[i + 1]) for i in
+                 (self.terms.get(token) for token in set(tokenize(query))) if i is not None]
+        if not spans:
+            return []
+        docs = np.concatenate([self.docs[start:end] for start, end in spans])
+        weights = np.concatenate([self.weights[start:end] for start, end in spans])
+        scores = np.bincount(docs, weights=weights, minlength=len(self.node_ids))
+        if node_ids is not None:
+            if self._positions is None:
+                self._positions = {str(node_id): i for i, node_id in enumerate(self.node_ids)}
+            allowed = np.zeros(len(self.node_ids), dtype=bool)
+            allowed[[self._positions[node_id] for node_id in node_ids if node_id in self._positions]] = True
+            scores[~allowed] = 0
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        best = np.argpartition(-scores, top_k - 1)[:top_k] if top_k else []
+        best = sorted(best, key=lambda i: -scores[i])
+        return [(str(self.node_ids[i]), float(scores[i])) for i in best]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses several rankings of ids into one with reciprocal rank fusion.
+
+    Args:
+        rankings (list): Lists of ids, each best first.
+        k (int, optional): Damping constant. Defaults to 60.
+
+    Returns:
+        list: (id, fused score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda pair: -pair[1])
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses dense retrieval with BM25 using reciprocal rank fusion.
+
+    Both retrievers fetch fetch_k candidates, among node_ids when given. The fused top_k come back with their RRF
+    score, and nodes found only lexically are loaded from the store.
+    """
+
+    def __init__(self, dense_retriever, lexical_index, store, top_k, fetch_k=20, rrf_k=RRF_K, node_ids=None):
+        super().__init__()
+        self._node_ids = node_ids
+        self._dense = dense_retriever
+        self._lexical = lexical_index
+        self._store = store
+        self._top_k = top_k
+        self._fetch_k = fetch_k
+        self._rrf_k = rrf_k
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        dense = self._dense.retrieve(query_bundle)
+        lexical = self._lexical.search(query_bundle.query_str, self._fetch_k, node_ids=self._node_ids)
+        fused = reciprocal_rank_fusion([[node.node_id for node in dense], [node_id for node_id, _ in lexical]],
+                                       k=self._rrf_k)[:self._top_k]
+        nodes = {node.node_id: node.node for node in dense}
+        missing = [node_id for node_id, _ in fused if node_id not in nodes]
+        if missing:
+            nodes.update({node.node_id: node for node in self._store.get_nodes(missing)})
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in fused if node_id in nodes]
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from llama_index.core.llms import ChatMessage, ChatResponse, CompletionResponse
+from logger_config import logger
+
+DEFAULT_CACHE_PATH = "data/cache/llm.sqlite"
+CACHE_MODES = ("off", "readwrite", "record", "replay")
+
+
+class LLMCacheMiss(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+
+class LLMCache:
+    """
+    An on-disk store of LLM responses keyed by a hash of the full request.
+
+    Attributes:
+        path (str): Location of the SQLite file.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                           "(key TEXT PRIMARY KEY, request TEXT NOT NULL, response TEXT NOT NULL, created REAL NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(request):
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, request):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (self.key(request),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, request, response):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                               (self.key(request), json.dumps(request), json.dumps(response), time.time()))
+            self._conn.commit()
+
+
+class CachedLLM:
+    """
+    Wraps a llama_index LLM so chat, stream_chat and complete calls are served from an LLMCache.
+
+    The cache key covers the provider, model, temperature, max_tokens and the full message list or prompt, so a
+    response is only reused for an identical request. Anything else is passed through to the wrapped LLM.
+
+    Modes:
+        readwrite: Serve hits from the cache, call the provider on a miss and record the response.
+        record: Always call the provider and overwrite the recorded response.
+        replay: Only serve from the cache, a miss raises LLMCacheMiss. The wrapped LLM may be None.
+
+    Attributes:
+        hits (int): Requests answered from the cache in this run.
+        misses (int): Requests that went to the provider in this run.
+    """
+
+    def __init__(self, llm, cache, provider, model, temperature=None, max_tokens=None, mode="readwrite"):
+        if mode not in CACHE_MODES[1:]:
+            raise ValueError(f"Unsupported LLM cache mode: {mode}")
+        self.llm = llm
+        self.cache = cache
+        self.provider = provider
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self.llm is None:
+            raise AttributeError(f"{name} is not available while replaying without an LLM")
+        return getattr(self.llm, name)
+
+    def stats(self):
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses}
+
+    def _request(self, kind, payload):
+        return {"provider": self.provider, "model": self.model, "temperature": self.temperature,
+                "max_tokens": self.max_tokens, "kind": kind, "payload": payload}
+
+    @staticmethod
+    def _messages_payload(messages):
+        return [{"role": str(message.role.value), "content": message.content} for message in messages]
+
+    def _lookup(self, request):
+        if self.mode != "record":
+            response = self.cache.get(request)
+            if response is not None:
+                with self._lock:
+                    self.hits += 1
+                return response
+        if self.mode == "replay":
+            raise LLMCacheMiss(f"No recorded {request['kind']} response for {self.provider}/{self.model}")
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def chat(self, messages, **kwargs):
+        request = self._request("chat", self._messages_payload(messages))
+        response = self._lookup(request)
+        if response is None:
+            message = self.llm.chat(messages, **kwargs).message
+            response = {"role": str(message.role.value), "content": message.content}
+            self.cache.put(request, response)
+        return ChatResponse(message=ChatMessage(role=response["role"], content=response["content"]))
+
+    def stream_chat(self, messages, **kwargs):
+        """
+        Streams the chat response. A recorded response is replayed as a single chunk, otherwise the provider's
+        stream is passed through and recorded once it is complete.
+        """
+        request = self._request("chat", self._messages_payload(messages))
+        response = self._lookup(request)
+        if response is not None:
+            yield ChatResponse(message=ChatMessage(role=response["role"], content=response["content"]),
+                               delta=response["content"])
+            return
+        chunk = None
+        for chunk in self.llm.stream_chat(messages, **kwargs):
+            yield chunk
+        if chunk is not None:
+            self.cache.put(request, {"role": str(chunk.message.role.value), "content": chunk.message.content})
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        request = self._request("complete", prompt)
+        response = self._lookup(request)
+        if response is None:
+            response = {"text": self.llm.complete(prompt, formatted=formatted, **kwargs).text}
+            self.cache.put(request, response)
+        return CompletionResponse(text=response["text"])
+
+    async def achat(self, messages, **kwargs):
+        request = self._request("chat", self._messages_payload(messages))
+        response = self._lookup(request)
+        if response is None:
+            message = (await self.llm.achat(messages, **kwargs)).message
+            response = {"role": str(message.role.value), "content": message.content}
+            self.cache.put(request, response)
+        return ChatResponse(message=ChatMessage(role=response["role"], content=response["content"]))
+
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        request = self._request("complete", prompt)
+        response = self._lookup(request)
+        if response is None:
+            response = {"text": (await self.llm.acomplete(prompt, formatted=formatted, **kwargs)).text}
+            self.cache.put(request, response)
+        return CompletionResponse(text=response["text"])
+
+    def log_stats(self):
+        logger.info(f"LLM cache ({self.mode}): {self.hits} hits, {self.misses} misses")
@@ -1,6 +1,91 @@
+import atexit
+import contextvars
+import json
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# LOG_FORMAT=json writes one JSON object per record to the log file, LOG_DEBUG_SAMPLE keeps that fraction of the
+# DEBUG records of every call site and LOG_DEBUG_RATE caps them per call site and second
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_DEBUG_SAMPLE = float(os.environ.get("LOG_DEBUG_SAMPLE", "1.0"))
+LOG_DEBUG_RATE = float(os.environ["LOG_DEBUG_RATE"]) if os.environ.get("LOG_DEBUG_RATE") else None
+
+_query_id = contextvars.ContextVar("query_id", default=None)
+
+
+@contextmanager
+def query_context(query_id=None):
+    """
+    Tags every record logged inside the block, also from asyncio tasks and threads started with the context
+    copied, with a correlation id for the query. Keeps the id of an enclosing block when none is given.
+    """
+    token = _query_id.set(query_id or _query_id.get() or uuid.uuid4().hex[:12])
+    try:
+        yield _query_id.get()
+    finally:
+        _query_id.reset(token)
+
+
+class QueryIdFilter(logging.Filter):
+    """Adds the correlation id of the current query to the record, "-" outside of a query."""
+
+    def filter(self, record):
+        record.query_id = _query_id.get() or "-"
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """
+    Thins out DEBUG records per call site: keeps one in every round(1 / sample) and at most max_per_second of them.
+    Records of other levels always pass.
+    """
+
+    def __init__(self, sample=1.0, max_per_second=None):
+        super().__init__()
+        self.every = max(1, round(1 / sample)) if sample > 0 else None
+        self.max_per_second = max_per_second
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or (self.every == 1 and self.max_per_second is None):
+            return True
+        if self.every is None:
+            return False
+        with self._lock:
+            # seen, window start, kept in window
+            site = self._sites.setdefault((record.pathname, record.lineno), [0, 0.0, 0])
+            site[0] += 1
+            if (site[0] - 1) % self.every:
+                return False
+            if self.max_per_second is not None:
+                now = time.monotonic()
+                if now - site[1] >= 1.0:
+                    site[1], site[2] = now, 0
+                if site[2] >= self.max_per_second:
+                    return False
+                site[2] += 1
+        return True
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for a listener in the same process. Only the message is resolved on the calling thread, in case
+    its arguments change later; formatting, tracebacks included, is left to the listener's handlers.
+    """
+
+    def prepare(self, record):
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        return record
+
 
 class CustomFormatter(logging.Formatter):
     yellow = "\x1b[33;20m"
@@ -15,11 +100,34 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: yellow + format + reset,
     }
 
+    def __init__(self):
+        super().__init__()
+        self._formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self._formatters.get(record.levelno, self._formatters[logging.INFO])
         return formatter.format(record)
 
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, with the query's correlation id."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "query_id": getattr(record, "query_id", "-"),
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
 # Ensure the log directory exists
 log_dir = "logs"
 if not os.path.exists(log_dir):
@@ -34,18 +142,25 @@ LOGGING_CONFIG = {
             "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         },
         "detailed": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s [in %(pathname)s:%(lineno)d]",
+            "format": "%(asctime)s - %(name)s - %(levelname)s - [%(query_id)s] %(message)s "
+                      "[in %(pathname)s:%(lineno)d]",
+        },
+        "json": {
+            "()": JsonFormatter,
+        },
+        "colored": {
+            "()": CustomFormatter,
         },
     },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
-            "formatter": "default",
+            "formatter": "colored",
         },
         "file": {
             "class": "logging.FileHandler",
             "filename": os.path.join(log_dir, "app.log"),
-            "formatter": "detailed",
+            "formatter": "json" if LOG_FORMAT == "json" else "detailed",
             "level": "DEBUG",
         },
     },
@@ -64,7 +179,23 @@ logging.config.dictConfig(LOGGING_CONFIG)
 # Get the logger
 logger = logging.getLogger('logger_config')
 
-# Apply custom formatter to the console handler
-for handler in logger.handlers:
-    if isinstance(handler, logging.StreamHandler):
-        handler.setFormatter(CustomFormatter())
+# The configured handlers run on a listener thread, the logging call itself only tags the record and queues it.
+# The filters run before the record is queued, where the query's context is still current.
+_log_queue = queue.SimpleQueue()
+_queue_handler = LocalQueueHandler(_log_queue)
+_queue_handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE, LOG_DEBUG_RATE))
+_queue_handler.addFilter(QueryIdFilter())
+listener = logging.handlers.QueueListener(_log_queue, *logger.handlers, respect_handler_level=True)
+for handler in list(logger.handlers):
+    logger.removeHandler(handler)
+logger.addHandler(_queue_handler)
+listener.start()
+
+
+@atexit.register
+def stop_logging():
+    """Writes the records still queued and stops the listener thread. Safe to call more than once."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
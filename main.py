@@ -2,6 +2,7 @@ from agent import ReAct
 from tools import Finish, AskHuman, Retrieve
 from logger_config import logger
 from utils import loadllm
+from llm_cache import CachedLLM
 from termcolor import colored
 
 
@@ -13,8 +14,10 @@ history = []
 tools = [retrieve, finish, askhuman]
 
 
-agent = ReAct(tools, history, llm)
+agent = ReAct(tools, history, llm, stream=True)
 
 if __name__ == '__main__':
     query = input(colored("Please enter your query: ", 'light_magenta'))
-    agent.agentloop(query)
\ No newline at end of file
+    agent.agentloop(query)
+    if isinstance(llm, CachedLLM):
+        llm.log_stats()
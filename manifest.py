@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+from logger_config import logger
+
+MANIFEST_FILE = "manifest.sqlite"
+LEGACY_MANIFEST_FILE = "manifest.json"
+
+
+class IndexManifest:
+    """
+    What a stored collection holds, in SQLite next to it so it is updated in place rather than rewritten.
+
+    Every chunk row records the id of its document, whether its vector has been written to the store, and the
+    last update run that saw it in the corpus. An update starts a new run, marks every chunk it meets, and
+    afterwards the chunks an update did not meet are the stale ones. Neither step keeps the ids in memory.
+
+    Attributes:
+        path (str): Location of the SQLite file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (node_id TEXT PRIMARY KEY, ref_doc_id TEXT, "
+                           "stored INTEGER NOT NULL, run INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_run ON chunks (run)")
+        self._conn.commit()
+        self._run = None
+        legacy_path = os.path.join(os.path.dirname(path), LEGACY_MANIFEST_FILE)
+        if os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, legacy_path):
+        """Moves a manifest.json written by earlier versions into the database."""
+        with open(legacy_path, 'r') as file:
+            legacy = json.load(file)
+        self._conn.execute("DELETE FROM chunks")
+        self._conn.executemany("INSERT INTO chunks VALUES (?, ?, 1, 0)", legacy.get("chunks", {}).items())
+        self._set("embed_model", legacy.get("embed_model"))
+        self._set("complete", json.dumps(legacy.get("complete", True)))
+        self._conn.commit()
+        os.remove(legacy_path)
+        logger.info(f"Moved {len(legacy.get('chunks', {}))} chunks from {legacy_path} to {self.path}")
+
+    def _get(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    @property
+    def embed_model(self):
+        """Name of the model that produced the stored vectors, None when nothing was ever stored."""
+        return self._get("embed_model")
+
+    @property
+    def complete(self):
+        """Whether the last update ran to the end."""
+        value = self._get("complete")
+        return True if value is None else json.loads(value)
+
+    @property
+    def chunk_store(self):
+        """Path of the ChunkStore the last update read its chunks from, None when they came from elsewhere."""
+        return self._get("chunk_store")
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE stored = 1").fetchone()[0]
+
+    def chunks(self):
+        """Yields (node id, document id) for every stored chunk."""
+        yield from self._conn.execute("SELECT node_id, ref_doc_id FROM chunks WHERE stored = 1")
+
+    def begin(self, embed_model, reset=False, chunk_store=None):
+        """
+        Starts an update by embed_model of the chunks at chunk_store, first forgetting every chunk when reset is
+        set, e.g. because the store was cleared for another model. Committed straight away, so an interrupted
+        update is known as such.
+        """
+        if reset:
+            self._conn.execute("DELETE FROM chunks")
+        self._run = int(self._get("run") or 0) + 1
+        self._set("run", str(self._run))
+        self._set("embed_model", embed_model)
+        self._set("chunk_store", chunk_store)
+        self._set("complete", "false")
+        self._conn.commit()
+
+    def see(self, node_id, ref_doc_id):
+        """
+        Marks a chunk of the corpus as met by the current update. Returns "stored" when its vector is already in
+        the store, "seen" when this update already met it, and "new" when it has to be embedded and written.
+        """
+        row = self._conn.execute("SELECT stored, run FROM chunks WHERE node_id = ?", (node_id,)).fetchone()
+        if row is not None and row[1] == self._run:
+            return "seen"
+        if row is None:
+            self._conn.execute("INSERT INTO chunks VALUES (?, ?, 0, ?)", (node_id, ref_doc_id, self._run))
+            return "new"
+        self._conn.execute("UPDATE chunks SET run = ? WHERE node_id = ?", (self._run, node_id))
+        return "stored" if row[0] else "new"
+
+    def stored(self, node_ids):
+        """Records that the vectors of the given chunks are written, and commits."""
+        self._conn.executemany("UPDATE chunks SET stored = 1 WHERE node_id = ?", ((node_id,) for node_id in node_ids))
+        self._conn.commit()
+
+    def stale_ids(self):
+        """Ids of the chunks the current update did not meet."""
+        return [node_id for node_id, in self._conn.execute("SELECT node_id FROM chunks WHERE run < ?", (self._run,))]
+
+    def finish(self, removed_ids):
+        """Forgets the removed chunks and marks the update complete."""
+        self._conn.executemany("DELETE FROM chunks WHERE node_id = ?", ((node_id,) for node_id in removed_ids))
+        self._set("complete", "true")
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,120 @@
+import json
+import os
+import re
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from logger_config import logger
+
+METADATA_INDEX_FILE = "metadata_index.json"
+
+
+def normalize_source(source):
+    """Lowercases a source and drops punctuation and a leading "the", so "The Verge" and "the-verge" match."""
+    source = re.sub(r"[^a-z0-9]+", " ", str(source).lower()).strip()
+    return re.sub(r"^the ", "", source)
+
+
+def parse_date(value, end_of_day=False):
+    """
+    Parses an ISO date or datetime to a UTC timestamp. Dates without a time cover the whole day, so as an upper
+    bound with end_of_day they include everything published on that day. Naive datetimes are taken as UTC.
+    """
+    text = str(value).strip()
+    if len(text) == 4 and text.isdigit():
+        text = f"{text}-12-31" if end_of_day else f"{text}-01-01"
+    elif re.fullmatch(r"\d{4}-\d{2}", text):
+        year, month = map(int, text.split("-"))
+        if end_of_day:
+            next_month = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+            return next_month.timestamp() - 1e-6
+        text = f"{text}-01"
+    moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    timestamp = moment.timestamp()
+    if end_of_day and "T" not in text and " " not in text:
+        timestamp += 86400 - 1e-6
+    return timestamp
+
+
+class MetadataIndex:
+    """
+    Precomputed lookups from chunk metadata to node ids, so filters can be resolved before any vector scoring.
+
+    Attributes:
+        node_ids (list): Node id of every indexed chunk, by position.
+        sources (dict): Normalised source to the positions of its chunks.
+        source_names (dict): Normalised source to the source as written in the corpus.
+        dates (list): Publication timestamps, sorted.
+        date_positions (list): Position of the chunk of every entry in dates.
+    """
+
+    def __init__(self, node_ids, sources, source_names, dates, date_positions):
+        self.node_ids = node_ids
+        self.sources = sources
+        self.source_names = source_names
+        self.dates = dates
+        self.date_positions = date_positions
+
+    @classmethod
+    def build(cls, chunks):
+        """
+        Builds the index from (node id, metadata) pairs.
+        """
+        node_ids, sources, source_names, dated = [], {}, {}, []
+        for position, (node_id, metadata) in enumerate(chunks):
+            node_ids.append(node_id)
+            source = metadata.get("source")
+            if source:
+                key = normalize_source(source)
+                sources.setdefault(key, []).append(position)
+                source_names.setdefault(key, source)
+            published_at = metadata.get("published_at")
+            if published_at:
+                try:
+                    dated.append((parse_date(published_at), position))
+                except ValueError:
+                    logger.warning(f"Unparseable published_at {published_at!r} on chunk {node_id}")
+        dated.sort()
+        logger.info(f"Built metadata index over {len(node_ids)} chunks, {len(sources)} sources")
+        return cls(node_ids, sources, source_names, [date for date, _ in dated], [position for _, position in dated])
+
+    def save(self, path):
+        with open(path + ".tmp", 'w') as file:
+            json.dump({"node_ids": self.node_ids, "sources": self.sources, "source_names": self.source_names,
+                       "dates": self.dates, "date_positions": self.date_positions}, file)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as file:
+            data = json.load(file)
+        return cls(data["node_ids"], data["sources"], data["source_names"], data["dates"], data["date_positions"])
+
+    def resolve(self, source=None, published_after=None, published_before=None):
+        """
+        Returns the ids of the chunks matching every given filter, or None when no filter is given.
+
+        Args:
+            source (str or list, optional): One or more sources, matched case-insensitively.
+            published_after (str, optional): Earliest publication date or datetime, inclusive.
+            published_before (str, optional): Latest publication date or datetime, inclusive.
+
+        Returns:
+            list: The matching node ids, possibly empty.
+        """
+        positions = None
+        if source:
+            wanted = [source] if isinstance(source, str) else source
+            positions = set()
+            for name in wanted:
+                positions.update(self.sources.get(normalize_source(name), []))
+        if published_after or published_before:
+            low = bisect_left(self.dates, parse_date(published_after)) if published_after else 0
+            high = bisect_right(self.dates, parse_date(published_before, end_of_day=True)) if published_before \
+                else len(self.dates)
+            in_range = set(self.date_positions[low:high])
+            positions = in_range if positions is None else positions & in_range
+        if positions is None:
+            return None
+        return [self.node_ids[position] for position in sorted(positions)]
@@ -0,0 +1,296 @@
+import json
+import os
+import threading
+from typing import Any, List, Optional
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (BasePydanticVectorStore, MetadataFilters, VectorStoreQuery,
+                                                  VectorStoreQueryResult)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+from logger_config import logger
+
+META_FILE = "meta.json"
+SCORE_BLOCK_ROWS = 16384
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """
+    A llama_index vector store kept as plain files and searched exactly with NumPy.
+
+    Every generation of the store is four append-only files:
+        <generation>.vectors: The unit-normalised embeddings as one contiguous row-major matrix.
+        <generation>.nodes: One JSON line per row, the node as node_to_metadata_dict serialises it.
+        <generation>.offsets: The int64 byte offset of every line in the nodes file.
+        <generation>.ids: One "node id<TAB>ref doc id" line per row.
+    meta.json records the dimension, dtype, generation, number of committed rows and committed byte sizes of the
+    nodes and ids files. It is replaced atomically after every add, once the appended bytes are synced, so rows
+    written by an interrupted add are ignored and truncated on the next write. Opening the store maps the matrix
+    and reads the ids, nothing else; an add only appends to the files and to the ids and live mask held in memory.
+
+    Re-adding an id supersedes its earlier row. Deleting rewrites the live rows into a new generation.
+
+    Attributes:
+        path (str): Directory holding the files.
+        dtype (str): Storage dtype of the matrix, "float16" or "float32". Scores are always computed in float32.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+    path: str
+    dtype: str = "float16"
+
+    _meta: dict = PrivateAttr()
+    _vectors: Any = PrivateAttr()
+    _offsets: Any = PrivateAttr()
+    _ids: list = PrivateAttr()
+    _ref_doc_ids: list = PrivateAttr()
+    _rows_by_id: dict = PrivateAttr()
+    _live: Any = PrivateAttr()
+    _live_buffer: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, path, dtype="float16", **kwargs):
+        super().__init__(path=path, dtype=dtype, **kwargs)
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as file:
+                self._meta = json.load(file)
+        else:
+            self._meta = {"dim": None, "dtype": dtype, "generation": 0, "rows": 0, "sizes": {"nodes": 0, "ids": 0}}
+        self._load()
+        if "sizes" not in self._meta:
+            # Written before the sizes were recorded, they are found once by scanning
+            self._meta["sizes"] = self._scan_sizes()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def _file(self, kind, generation=None):
+        generation = self._meta["generation"] if generation is None else generation
+        return os.path.join(self.path, f"{generation}.{kind}")
+
+    def _load(self):
+        """Maps the committed rows of the current generation and reads their ids."""
+        rows = self._meta["rows"]
+        ids, ref_doc_ids = [], []
+        if rows:
+            with open(self._file("ids"), 'r') as file:
+                for _, line in zip(range(rows), file):
+                    node_id, ref_doc_id = line.rstrip("\n").split("\t")
+                    ids.append(node_id)
+                    ref_doc_ids.append(ref_doc_id)
+        self._map()
+        rows_by_id = {node_id: row for row, node_id in enumerate(ids)}
+        self._live_buffer = np.zeros(max(rows, 1024), dtype=bool)
+        self._live_buffer[list(rows_by_id.values())] = True
+        self._live = self._live_buffer[:rows]
+        self._ids, self._ref_doc_ids, self._rows_by_id = ids, ref_doc_ids, rows_by_id
+
+    def _map(self):
+        """Maps the committed rows of the vectors and offsets files, which costs the same at any size."""
+        rows, dim = self._meta["rows"], self._meta["dim"]
+        if rows:
+            self._vectors = np.memmap(self._file("vectors"), dtype=self._meta["dtype"], mode='r', shape=(rows, dim))
+            self._offsets = np.memmap(self._file("offsets"), dtype=np.int64, mode='r', shape=(rows,))
+        else:
+            self._vectors = np.zeros((0, dim or 0), dtype=self._meta["dtype"])
+            self._offsets = np.zeros(0, dtype=np.int64)
+
+    def _save_meta(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + ".tmp", 'w') as file:
+            json.dump(self._meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _scan_sizes(self):
+        """Byte sizes of the nodes and ids files holding exactly the committed rows, found by reading them."""
+        rows = self._meta["rows"]
+        if not rows:
+            return {"nodes": 0, "ids": 0}
+        with open(self._file("nodes"), 'rb') as file:
+            file.seek(int(self._offsets[-1]))
+            nodes = int(self._offsets[-1]) + len(file.readline())
+        with open(self._file("ids"), 'rb') as file:
+            ids = sum(len(line) for _, line in zip(range(rows), file))
+        return {"nodes": nodes, "ids": ids}
+
+    def _append(self, ids, ref_doc_ids, vectors, lines):
+        rows, sizes = self._meta["rows"], self._meta["sizes"]
+        offsets = sizes["nodes"] + np.cumsum([0] + [len(line) for line in lines[:-1]], dtype=np.int64)
+        id_lines = "".join(f"{node_id}\t{ref_doc_id}\n"
+                           for node_id, ref_doc_id in zip(ids, ref_doc_ids)).encode("utf-8")
+        committed = {"vectors": rows * vectors.shape[1] * vectors.itemsize, "offsets": rows * 8, **sizes}
+        for kind, data in (("nodes", b"".join(lines)), ("vectors", vectors.tobytes()),
+                           ("offsets", offsets.tobytes()), ("ids", id_lines)):
+            with open(self._file(kind), 'ab') as file:
+                # Drop whatever an interrupted add left past the committed rows
+                file.truncate(committed[kind])
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+        self._meta["rows"] += len(ids)
+        self._meta["sizes"] = {"nodes": sizes["nodes"] + sum(len(line) for line in lines),
+                               "ids": sizes["ids"] + len(id_lines)}
+        self._save_meta()
+
+    def _index_appended(self, ids, ref_doc_ids):
+        """Brings the in-memory ids and live mask up to date with rows just appended."""
+        start = len(self._ids)
+        rows = start + len(ids)
+        if rows > len(self._live_buffer):
+            buffer = np.zeros(max(rows, 2 * len(self._live_buffer)), dtype=bool)
+            buffer[:start] = self._live_buffer[:start]
+            self._live_buffer = buffer
+        self._live_buffer[start:rows] = True
+        for row, node_id in enumerate(ids, start=start):
+            superseded = self._rows_by_id.get(node_id)
+            if superseded is not None:
+                self._live_buffer[superseded] = False
+            self._rows_by_id[node_id] = row
+        self._ids.extend(ids)
+        self._ref_doc_ids.extend(ref_doc_ids)
+        self._map()
+        self._live = self._live_buffer[:rows]
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        lines = [json.dumps(node_to_metadata_dict(node, remove_text=False, flat_metadata=False)).encode("utf-8") + b"\n"
+                 for node in nodes]
+        with self._lock:
+            if self._meta["dim"] is None or not self._meta["rows"]:
+                self._meta["dim"] = vectors.shape[1]
+            elif vectors.shape[1] != self._meta["dim"]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store's {self._meta['dim']}")
+            ids, ref_doc_ids = [node.node_id for node in nodes], [node.ref_doc_id or "" for node in nodes]
+            self._append(ids, ref_doc_ids, vectors.astype(self._meta["dtype"]), lines)
+            self._index_appended(ids, ref_doc_ids)
+        return [node.node_id for node in nodes]
+
+    def _rewrite(self, keep_rows):
+        """Copies the given rows into a new generation and switches to it."""
+        old_meta = dict(self._meta)
+        old_files = [self._file(kind) for kind in ("vectors", "nodes", "offsets", "ids")]
+        generation = old_meta["generation"] + 1
+        offset = ids_size = 0
+        with open(self._file("vectors", generation), 'wb') as vectors, \
+                open(self._file("nodes", generation), 'wb') as nodes, \
+                open(self._file("offsets", generation), 'wb') as offsets, \
+                open(self._file("ids", generation), 'wb') as ids:
+            for start in range(0, len(keep_rows), SCORE_BLOCK_ROWS):
+                block = keep_rows[start:start + SCORE_BLOCK_ROWS]
+                vectors.write(np.ascontiguousarray(self._vectors[block]).tobytes())
+                block_offsets = []
+                for row, line in zip(block, self._read_lines(block)):
+                    block_offsets.append(offset)
+                    offset += nodes.write(line)
+                    ids_size += ids.write(f"{self._ids[row]}\t{self._ref_doc_ids[row]}\n".encode("utf-8"))
+                offsets.write(np.asarray(block_offsets, dtype=np.int64).tobytes())
+            for file in (vectors, nodes, offsets, ids):
+                file.flush()
+                os.fsync(file.fileno())
+        self._meta = {**old_meta, "generation": generation, "rows": len(keep_rows),
+                      "sizes": {"nodes": offset, "ids": ids_size}}
+        self._save_meta()
+        self._load()
+        for file in old_files:
+            if os.path.exists(file):
+                os.remove(file)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None,
+                     **delete_kwargs: Any) -> None:
+        if filters is not None:
+            raise NotImplementedError("MmapVectorStore does not support metadata filters")
+        with self._lock:
+            deleted = {self._rows_by_id[node_id] for node_id in node_ids or [] if node_id in self._rows_by_id}
+            if not deleted:
+                return
+            self._rewrite([row for row in np.flatnonzero(self._live) if row not in deleted])
+        logger.info(f"Deleted {len(deleted)} rows from {self.path}")
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self.delete_nodes([node_id for node_id, row in self._rows_by_id.items() if self._ref_doc_ids[row] == ref_doc_id])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rewrite([])
+
+    def node_ids(self):
+        """Returns the ids of all live rows."""
+        return list(self._rows_by_id)
+
+    def _read_lines(self, rows):
+        if not len(rows):
+            return []
+        lines = []
+        with open(self._file("nodes"), 'rb') as file:
+            for row in rows:
+                file.seek(int(self._offsets[row]))
+                lines.append(file.readline())
+        return lines
+
+    def _read_nodes(self, rows):
+        return [metadata_dict_to_node(json.loads(line)) for line in self._read_lines(rows)]
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None) -> List[BaseNode]:
+        if filters is not None:
+            raise NotImplementedError("MmapVectorStore does not support metadata filters")
+        rows_by_id = self._rows_by_id
+        if node_ids is None:
+            return self._read_nodes(sorted(rows_by_id.values()))
+        return self._read_nodes([rows_by_id[node_id] for node_id in node_ids if node_id in rows_by_id])
+
+    def _candidate_rows(self, query):
+        rows_by_id = self._rows_by_id
+        rows = None
+        if query.node_ids is not None:
+            rows = {rows_by_id[node_id] for node_id in query.node_ids if node_id in rows_by_id}
+        if query.doc_ids is not None:
+            doc_ids = set(query.doc_ids)
+            doc_rows = {row for row in rows_by_id.values() if self._ref_doc_ids[row] in doc_ids}
+            rows = doc_rows if rows is None else rows & doc_rows
+        return None if rows is None else np.fromiter(sorted(rows), dtype=np.int64)
+
+    def score(self, query_embedding, rows=None):
+        """
+        Cosine similarity of the query to every live row, or to the given rows, in blocks so a float16 matrix is
+        never converted to float32 all at once.
+        """
+        vectors, live = self._vectors, self._live
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        if rows is not None:
+            return np.asarray(vectors[rows], dtype=np.float32) @ query
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            scores[start:start + SCORE_BLOCK_ROWS] = np.asarray(vectors[start:start + SCORE_BLOCK_ROWS],
+                                                                dtype=np.float32) @ query
+        scores[~live] = -np.inf
+        return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise NotImplementedError("MmapVectorStore does not support metadata filters")
+        rows = self._candidate_rows(query)
+        scores = self.score(query.query_embedding, rows)
+        top_k = min(query.similarity_top_k, int(np.isfinite(scores).sum()))
+        if top_k == 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        best_rows = best if rows is None else rows[best]
+        nodes = self._read_nodes(best_rows)
+        return VectorStoreQueryResult(nodes=nodes, similarities=[float(score) for score in scores[best]],
+                                      ids=[node.node_id for node in nodes])
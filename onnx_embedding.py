@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import os
+import shutil
+from typing import Any, List, Optional
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import MetadataMode
+from logger_config import logger
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+ONNX_MODEL_PATH = "data/models"
+MODEL_FILE = "model.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+META_FILE = "meta.json"
+DEFAULT_BATCH_SIZE = 32
+# Padded tokens per forward pass, keeps batches of long chunks from allocating much more than short ones
+DEFAULT_MAX_BATCH_TOKENS = 8192
+# Lowest cosine similarity to the PyTorch vectors at which the exported model may share an index with them
+COMPATIBILITY_THRESHOLD = 0.99
+# Corpus chunks the export is compared on, on top of PROBE_TEXTS
+DEFAULT_PROBES = 256
+PROBE_TEXTS = [
+    "What did the European Commission decide about Apple's App Store rules?",
+    "Sam Altman returned as chief executive of OpenAI after the board reversed its decision.",
+    "The court ruled that Google unlawfully maintained its monopoly in search.",
+    "Bitcoin rose above $40,000 for the first time since April 2022.",
+    "A short query",
+]
+
+
+def onnx_model_path(model_name, root=ONNX_MODEL_PATH):
+    """Directory the ONNX export of model_name is kept in."""
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def corpus_probe_texts(corpus_path, count=DEFAULT_PROBES):
+    """
+    Returns count chunks spread evenly over the corpus, as the embedding model sees them, or none when there is
+    no corpus at corpus_path.
+    """
+    from chunk_store import load_chunk_store
+
+    if not os.path.exists(corpus_path):
+        logger.warning(f"No corpus at {corpus_path}, the ONNX export is only compared on the built-in probe texts")
+        return []
+    chunks = load_chunk_store(corpus_path)
+    nodes = itertools.islice(chunks.iter_nodes(), 0, None, max(1, len(chunks) // count))
+    return [node.get_content(metadata_mode=MetadataMode.EMBED) for node in itertools.islice(nodes, count)]
+
+
+def _pool(hidden, mask, pooling):
+    if pooling == "cls":
+        vectors = hidden[:, 0]
+    else:
+        weights = mask[:, :, None].astype(hidden.dtype)
+        vectors = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def export_onnx_model(model_name=DEFAULT_MODEL_NAME, output_dir=None, quantize=True, probe_texts=None):
+    """
+    Exports the transformer of a sentence-transformers model to ONNX, quantizes its weights to int8, and checks
+    its vectors against the PyTorch model's on probe_texts.
+
+    The export is written to a temporary directory and renamed into place once complete. Its meta.json records
+    the pooling, the maximum sequence length, and how close the vectors came to the PyTorch ones: with a minimum
+    cosine similarity of at least COMPATIBILITY_THRESHOLD the export is marked compatible, and OnnxEmbedding then
+    reports the PyTorch model's name so existing indexes stay valid. Pass chunks of the corpus as probe_texts
+    (see corpus_probe_texts), a handful of sentences says little about how the vectors of real chunks compare.
+
+    Needs torch, sentence-transformers and onnx, which only the export uses.
+
+    Parameters
+    ----------
+    model_name : str
+        The sentence-transformers model to export.
+    output_dir : str
+        Where to write the export, defaults to onnx_model_path(model_name).
+    quantize : bool
+        Whether to quantize the weights to int8.
+    probe_texts : list of str
+        Texts to compare the vectors on, defaults to PROBE_TEXTS.
+
+    Returns
+    -------
+    dict
+        The export's metadata.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = output_dir or onnx_model_path(model_name)
+    tmp_dir = output_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    logger.info(f"Exporting {model_name} to ONNX at {output_dir}")
+    reference = SentenceTransformer(model_name, device="cpu")
+    transformer, tokenizer = reference[0].auto_model.eval(), reference[0].tokenizer
+    pooling = "cls" if getattr(reference[1], "pooling_mode_cls_token", False) else "mean"
+    sample = tokenizer(["An example sentence to trace the model with."], return_tensors="pt")
+    fp32_path = os.path.join(tmp_dir, "model.fp32.onnx")
+    axes = {0: "batch", 1: "sequence"}
+    # Newer torch exports through dynamo by default, which needs onnxscript; the TorchScript exporter does not
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(transformer, (sample["input_ids"], sample["attention_mask"]), fp32_path,
+                          input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+                          dynamic_axes={"input_ids": axes, "attention_mask": axes, "last_hidden_state": axes},
+                          opset_version=14, **legacy)
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(tmp_dir, MODEL_FILE), weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, os.path.join(tmp_dir, MODEL_FILE))
+    tokenizer.backend_tokenizer.save(os.path.join(tmp_dir, TOKENIZER_FILE))
+
+    meta = {"model_name": model_name, "quantized": quantize, "pooling": pooling,
+            "max_length": reference.max_seq_length, "pad_token_id": tokenizer.pad_token_id,
+            "pad_token": tokenizer.pad_token}
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as file:
+        json.dump(meta, file)
+
+    probe_texts = probe_texts or PROBE_TEXTS
+    expected = reference.encode(probe_texts, normalize_embeddings=True, convert_to_numpy=True)
+    actual = np.asarray(OnnxEmbedding(tmp_dir).embed(probe_texts))
+    similarities = (expected * actual).sum(axis=1)
+    meta.update(probes=len(probe_texts), min_cosine=float(similarities.min()), mean_cosine=float(similarities.mean()),
+                compatible=bool(similarities.min() >= COMPATIBILITY_THRESHOLD))
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as file:
+        json.dump(meta, file)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+    logger.info(f"Exported {model_name}: cosine similarity to PyTorch min {meta['min_cosine']:.4f}, "
+                f"mean {meta['mean_cosine']:.4f}, {'compatible' if meta['compatible'] else 'not compatible'} "
+                f"with indexes built by the PyTorch model")
+    return meta
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """
+    Sentence embeddings from an ONNX export of a sentence-transformers model, run by ONNX Runtime on the CPU.
+
+    Texts are tokenized together, sorted by length and cut into batches of at most batch_size texts and
+    max_batch_tokens padded tokens, so each forward pass pads as little as possible. Vectors are pooled like the
+    original model (mean or CLS) and normalized.
+
+    model_name is the original model's name when the export is compatible with it (see export_onnx_model), so
+    indexes built by either can be queried by the other, and "<name>:onnx-int8" otherwise, which makes
+    VectorStore.update_index re-embed what the original model stored. cache_name is "<name>:onnx-int8" either
+    way: close vectors are still not the same vectors, so the embedding cache keeps them apart.
+
+    Attributes:
+        path (str): Directory of the export.
+        num_threads (int): Threads ONNX Runtime uses per forward pass, None for one per core.
+        batch_size (int): Most texts per forward pass.
+        max_batch_tokens (int): Most padded tokens per forward pass.
+    """
+
+    path: str
+    num_threads: Optional[int] = None
+    batch_size: int = DEFAULT_BATCH_SIZE
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _meta: dict = PrivateAttr()
+    _cache_name: str = PrivateAttr()
+
+    def __init__(self, path, num_threads=None, batch_size=DEFAULT_BATCH_SIZE,
+                 max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS, **kwargs):
+        with open(os.path.join(path, META_FILE), 'r') as file:
+            meta = json.load(file)
+        suffix = ":onnx-int8" if meta.get("quantized") else ":onnx"
+        # Sort across more texts than one forward pass takes, so long and short texts end up in separate passes
+        kwargs.setdefault("embed_batch_size", min(2048, batch_size * 8))
+        super().__init__(model_name=meta["model_name"] + ("" if meta.get("compatible") else suffix), path=path,
+                         num_threads=num_threads, batch_size=batch_size, max_batch_tokens=max_batch_tokens, **kwargs)
+        self._meta = meta
+        self._cache_name = meta["model_name"] + suffix
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or 0
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(os.path.join(path, MODEL_FILE), sess_options=options,
+                                             providers=["CPUExecutionProvider"])
+        self._tokenizer = Tokenizer.from_file(os.path.join(path, TOKENIZER_FILE))
+        self._tokenizer.no_padding()
+        self._tokenizer.enable_truncation(meta["max_length"])
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    @property
+    def meta(self):
+        return self._meta
+
+    @property
+    def cache_name(self):
+        return self._cache_name
+
+    def _batches(self, lengths):
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        start = 0
+        while start < len(order):
+            end = start + 1
+            # Lengths are sorted, so the last text of a batch sets its padded length
+            while (end < len(order) and end - start < self.batch_size
+                   and lengths[order[end]] * (end - start + 1) <= self.max_batch_tokens):
+                end += 1
+            yield order[start:end]
+            start = end
+
+    def embed(self, texts):
+        """Returns the normalized vector of every text, in order."""
+        encodings = self._tokenizer.encode_batch(list(texts))
+        lengths = [len(encoding.ids) for encoding in encodings]
+        vectors = [None] * len(encodings)
+        for batch in self._batches(lengths):
+            length = lengths[batch[-1]]
+            input_ids = np.full((len(batch), length), self._meta["pad_token_id"], dtype=np.int64)
+            attention_mask = np.zeros((len(batch), length), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, :lengths[i]] = encodings[i].ids
+                attention_mask[row, :lengths[i]] = 1
+            hidden = self._session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+            for i, vector in zip(batch, _pool(hidden, attention_mask, self._meta["pooling"])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        # ONNX Runtime releases the GIL, so the event loop keeps running while the query is embedded
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts)
+
+
+def load_onnx_embedding(model_name=DEFAULT_MODEL_NAME, num_threads=None, root=ONNX_MODEL_PATH, corpus_path=None,
+                        **kwargs):
+    """
+    Returns an OnnxEmbedding of model_name, exporting and quantizing the model first when there is no export.
+    The export is checked on chunks of the corpus at corpus_path, which defaults to the one indexes are built from.
+    """
+    path = onnx_model_path(model_name, root)
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        if corpus_path is None:
+            from vectorstore import CORPUS_PATH
+            corpus_path = CORPUS_PATH
+        export_onnx_model(model_name, path, probe_texts=PROBE_TEXTS + corpus_probe_texts(corpus_path))
+    embed_model = OnnxEmbedding(path, num_threads=num_threads, **kwargs)
+    if not embed_model.meta.get("compatible"):
+        logger.warning(f"The ONNX export of {model_name} does not reproduce its vectors (min cosine similarity "
+                       f"{embed_model.meta.get('min_cosine', 0):.4f}), indexes built with it have to be rebuilt")
+    return embed_model
+
+
+if __name__ == '__main__':
+    from vectorstore import CORPUS_PATH
+
+    parser = argparse.ArgumentParser(description="Export a sentence-transformers model to quantized ONNX.")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--output", default=None, help="defaults to data/models/<model>")
+    parser.add_argument("--no-quantize", action="store_true", help="keep the float32 weights")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="chunks of this corpus are used as probe texts")
+    parser.add_argument("--probes", type=int, default=DEFAULT_PROBES,
+                        help="number of corpus chunks to compare the vectors on")
+    args = parser.parse_args()
+
+    probes = corpus_probe_texts(args.corpus, args.probes)
+    meta = export_onnx_model(args.model, args.output, quantize=not args.no_quantize, probe_texts=PROBE_TEXTS + probes)
+    print(json.dumps(meta, indent=2))
@@ -0,0 +1,66 @@
+PLAN_PROMPT = """
+
+**IMPORTANT**: Strictly return only the JSON formatted results without any surrounding text.
+
+Plan the retrievals for the question:
+{query}
+
+The question is answered from a corpus of news articles. Break it down into the sub-questions that each need ONE
+article to be retrieved, and write a retrieval for every one of them. All retrievals are run at the same time, so
+none of them can depend on what another one finds: when a part of the question can only be looked up after another
+part is known, retrieve what the question itself says about it instead.
+
+Every retrieval is given to this tool:
+{tool_descriptions}
+
+Return the plan in the below JSON format, with at most {max_sub_queries} retrievals:
+
+```
+{{
+    "thought": <how the question breaks down>
+    "sub_queries": [<the input of a retrieval as per the description>, ...]
+}}
+```
+
+Here is an example:
+#######################################################################################################################
+Plan the retrievals for the question:
+Which entity is currently engaged with Amazon to address competition concerns, facilitating dialogue with consumer groups against Meta, deploying staff within its AI Office for future regulations, and has previously focused on illegal content and disinformation issues related to the Israel-Hamas war, as reported by TechCrunch?
+
+```
+{{
+    "thought": "The question describes one entity through four independent facts, all reported by TechCrunch. Each fact needs its own article.",
+    "sub_queries": [
+        {{"query": "entity engaged with Amazon to address competition concerns", "source": "TechCrunch"}},
+        {{"query": "entity facilitating dialogue with consumer groups against Meta", "source": "TechCrunch"}},
+        {{"query": "entity deploying staff within its AI Office for future regulations", "source": "TechCrunch"}},
+        {{"query": "entity focused on illegal content and disinformation related to the Israel-Hamas war", "source": "TechCrunch"}}
+    ]
+}}
+```
+#######################################################################################################################
+"""
+
+ANSWER_PROMPT = """
+
+**IMPORTANT**: Strictly return only the JSON formatted results without any surrounding text.
+
+Answer the question:
+{query}
+
+Here is the evidence retrieved for it, one block per retrieval:
+{evidence}
+
+Thoroughly analyse the evidence and answer the question. The answer is always a "yes", "no", "before", "after" or an
+entity's name, be succinct and do not mention the evidence. If the evidence is missing something needed to answer,
+do not guess: return null as the answer, and the question will be worked on step by step.
+
+Return your answer in the below JSON format:
+
+```
+{{
+    "thought": <your reasoning over the evidence>
+    "answer": <the answer, or null>
+}}
+```
+"""
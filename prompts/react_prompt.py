@@ -48,7 +48,7 @@ And you respond as:
 {{
     "thought": "Let's break down the steps required to answer the query. First, I need to retrieve the entity engaged with Amazon to address competition concerns. Then, I need to find the entity facilitating dialogue with consumer groups against Meta. Next, I need to identify the entity deploying staff within its AI Office for future regulations. Finally, I need to find the entity previously focused on illegal content and disinformation issues related to the Israel-Hamas war. After gathering all these pieces, I will determine the entity that matches all these criteria.",
     "action": "retrieve",
-    "input": "entity engaged with Amazon to address competition concerns, TechCrunch"
+    "input": {{"query": "entity engaged with Amazon to address competition concerns", "source": "TechCrunch"}}
 }}
 ```
 
@@ -66,7 +66,7 @@ And you respond as:
 {{
     "thought": "The European Commission is engaged with Amazon to address competition concerns. Next, I need to find the entity facilitating dialogue with consumer groups against Meta.",
     "action": "retrieve",
-    "input": "entity facilitating dialogue with consumer groups against Meta, TechCrunch"
+    "input": {{"query": "entity facilitating dialogue with consumer groups against Meta", "source": "TechCrunch"}}
 }}
 ```
 
@@ -83,7 +83,7 @@ And you respond as:
 {{
     "thought": "The European Commission is also facilitating dialogue with consumer groups against Meta. Now, I need to identify the entity deploying staff within its AI Office for future regulations.",
     "action": "retrieve",
-    "input": "entity deploying staff within its AI Office for future regulations, TechCrunch"
+    "input": {{"query": "entity deploying staff within its AI Office for future regulations", "source": "TechCrunch"}}
 }}
 ```
 
@@ -100,7 +100,7 @@ And you respond as:
 {{
     "thought": "The European Commission is deploying staff within its AI Office for future regulations. Finally, I need to find the entity previously focused on illegal content and disinformation issues related to the Israel-Hamas war.",
     "action": "retrieve",
-    "input": "entity previously focused on illegal content and disinformation issues related to the Israel-Hamas war, TechCrunch"
+    "input": {{"query": "entity previously focused on illegal content and disinformation issues related to the Israel-Hamas war", "source": "TechCrunch"}}
 }}
 ```
 
@@ -123,4 +123,104 @@ And you respond as:
 
 The loop ends when you decide to choose the action "finish".
 #######################################################################################################################
-"""
\ No newline at end of file
+"""
+PARALLEL_PROMPT = """
+
+**IMPORTANT**: Strictly return only the JSON formatted results without any surrounding text.
+
+Given the question:
+{query}
+
+Here are your previous steps:
+{history}
+
+Thoroughly analyse the observations from your steps, and then take the actions needed to reach towards the final answer
+for the given question. Whenever stuck or not finding correct context, strictly ask for Human assistance and follow what
+the human tells you.
+
+You can take SEVERAL ACTIONS IN ONE STEP when they do not depend on each other, for example retrieving the articles for
+independent parts of the question. They are run at the same time and you get all their observations in the next step.
+Each retrieve action should still look for ONE article only. Only take an action in a later step when its input depends
+on what an earlier observation tells you.
+
+Here are the tools that you can choose from along with their descriptions, YOU ARE ALLOWED TO CHOOSE ONLY THESE ACTIONS,
+DO NOT REQUEST FOR OTHER ACTIONS:
+{tool_descriptions}
+
+Return your final answer in the below JSON format:
+
+```
+{{
+    "thought": <your thought/reasoning>
+    "actions": [
+        {{"action": <an action you want to take next>, "input": <the input parameters that the action requires as per the description>}},
+        ...
+    ]
+}}
+```
+
+The "finish" action must be the only action of its step.
+
+If you don't know the answer or you are not sure, even after asking for human help, return the final answer as "I don't know".
+
+Here is an example session:
+#######################################################################################################################
+You will initially be called with:
+QUESTION:
+Which entity is currently engaged with Amazon to address competition concerns, facilitating dialogue with consumer groups against Meta, deploying staff within its AI Office for future regulations, and has previously focused on illegal content and disinformation issues related to the Israel-Hamas war, as reported by TechCrunch?
+
+And you respond as:
+```
+{{
+    "thought": "The question describes one entity through four independent facts, so I can look up all four at once and then find the entity they have in common.",
+    "actions": [
+        {{"action": "retrieve", "input": {{"query": "entity engaged with Amazon to address competition concerns", "source": "TechCrunch"}}}},
+        {{"action": "retrieve", "input": {{"query": "entity facilitating dialogue with consumer groups against Meta", "source": "TechCrunch"}}}},
+        {{"action": "retrieve", "input": {{"query": "entity deploying staff within its AI Office for future regulations", "source": "TechCrunch"}}}},
+        {{"action": "retrieve", "input": {{"query": "entity previously focused on illegal content and disinformation issues related to the Israel-Hamas war", "source": "TechCrunch"}}}}
+    ]
+}}
+```
+
+Then you will again be called with:
+Observation 1.1:
+Title: Amazon’s iRobot purchase sucks up formal competition concerns in EU
+Source: TechCrunch
+Published_at: 2023-11-27T23:29:10+00:00
+
+We continue to work through the process with the European Commission and are focused on addressing its questions and any identified concerns at this stage.
+
+Observation 1.2:
+Title: European consumer groups band together to fight Meta’s self-serving ad-free sub — branding it ‘unfair’ and ‘illegal’
+Source: TechCrunch
+Published_at: 2023-11-30T05:00:57+00:00
+
+The process also loops in the European Commission to help facilitate dialogue, assess issues and bring pressure to bear on unfair practices.
+
+Observation 1.3:
+Title: EU says incoming rules for general purpose AIs can evolve over time
+Source: TechCrunch
+Published_at: 2023-12-11T17:57:55+00:00
+
+And some of these staff will also be deployed within the European Commission,” they added.
+
+Observation 1.4:
+Title: Elon Musk’s X faces first DSA probe in EU over illegal content risks, moderation, transparency and deceptive UX design
+Source: TechCrunch
+Published_at: 2023-12-18T13:04:56+00:00
+
+Its earlier actions were focused on concerns about the spread of illegal content and disinformation related to the Israel-Hamas war.
+
+And you respond as:
+```
+{{
+    "thought": "All four observations point to the European Commission, so it is the entity that matches all the criteria.",
+    "actions": [
+        {{"action": "finish", "input": "European Commission (the final answer)"}}
+    ]
+}}
+```
+
+The loop ends when you decide to choose the action "finish".
+#######################################################################################################################
+"""
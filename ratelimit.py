@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket allowing requests_per_minute requests, with bursts of up to burst requests.
+    """
+
+    def __init__(self, requests_per_minute, burst=1):
+        self.interval = 60.0 / requests_per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Takes a token and returns how long the caller has to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens * self.interval
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class RateLimitedLLM:
+    """
+    Wraps a llama_index LLM so every request to the provider first waits on a RateLimiter.
+    Anything other than the request methods is passed through to the wrapped LLM.
+    """
+
+    def __init__(self, llm, limiter):
+        self.llm = llm
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def chat(self, messages, **kwargs):
+        self.limiter.acquire()
+        return self.llm.chat(messages, **kwargs)
+
+    def stream_chat(self, messages, **kwargs):
+        self.limiter.acquire()
+        return self.llm.stream_chat(messages, **kwargs)
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        self.limiter.acquire()
+        return self.llm.complete(prompt, formatted=formatted, **kwargs)
+
+    async def achat(self, messages, **kwargs):
+        await self.limiter.aacquire()
+        return await self.llm.achat(messages, **kwargs)
+
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        await self.limiter.aacquire()
+        return await self.llm.acomplete(prompt, formatted=formatted, **kwargs)
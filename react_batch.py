@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+from agent import ReAct, AsyncReAct, PlanAndExecute
+from tools import Finish, Retrieve
+from utils import loadllm, nodeExtractor
+from llm_cache import CachedLLM
+from batching import load_queries, run_batch, QUERY_DATA_PATH
+from vectorstore import STORE_BACKENDS
+from tracing import tracer
+
+
+def answer_query(stuff, agent):
+    """
+    Runs one query on a fresh session of the agent and returns it in the same schema baseline.py produces, plus
+    the agent's steps.
+    """
+    session = agent.spawn()
+    result = session.agentloop(stuff['query'])
+    retrieve = next(tool for tool in session.tools if isinstance(tool, Retrieve))
+    save = {}
+    save['query'] = stuff['query']
+    save['answer'] = stuff['answer']
+    save['generated_answer'] = result['final_answer'] if result['final_answer'] is not None else "I don't know"
+    save['question_type'] = stuff['question_type']
+    save['retrieval_list'] = nodeExtractor(retrieve.retrieved_nodes)
+    save['gold_list'] = stuff['evidence_list']
+    save['num_steps'] = len(result['steps'])
+    save['steps'] = result['steps']
+    return save
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the ReAct agent over the MultiHopRAG queries.")
+    parser.add_argument("--queries", default=QUERY_DATA_PATH)
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--end", type=int, default=50, help="end of the query range, -1 runs to the end of the dataset")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests-per-minute", type=float, default=30)
+    parser.add_argument("--max-steps", type=int, default=10)
+    parser.add_argument("--parallel", action="store_true",
+                        help="use AsyncReAct, which may run several independent tool calls per step")
+    parser.add_argument("--plan", action="store_true",
+                        help="use PlanAndExecute, which plans all retrievals in one LLM call and answers in a second")
+    parser.add_argument("--backend", choices=sorted(STORE_BACKENDS), default="chroma")
+    parser.add_argument("--retrieval", choices=["dense", "hybrid"], default="dense")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--rerank", action="store_true",
+                        help="over-fetch candidates and keep the top-k by cross-encoder score")
+    parser.add_argument("--context-tokens", type=int, default=None,
+                        help="token budget of each retrieved context, trimming the least relevant sentences")
+    parser.add_argument("--llm", default="Groq")
+    parser.add_argument("--output", default="output/react_agent.jsonl",
+                        help="results are appended here per query, finished queries are skipped on restart")
+    parser.add_argument("--trace", default=None,
+                        help="append a JSONL span per agent step, LLM call and tool run to this file, and write "
+                             "Prometheus metrics next to it")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.configure(args.trace)
+
+    llm = loadllm(args.llm, requests_per_minute=args.requests_per_minute)
+    # AskHuman is left out, nobody is there to answer while a batch runs
+    agent_class = PlanAndExecute if args.plan else AsyncReAct if args.parallel else ReAct
+    retrieve = Retrieve(args.top_k, mode=args.retrieval, backend=args.backend, rerank=args.rerank,
+                        context_tokens=args.context_tokens)
+    agent = agent_class([retrieve, Finish()], [], llm, max_steps=args.max_steps, verbose=False)
+
+    query_data = load_queries(args.queries, args.start, None if args.end < 0 else args.end)
+    metalist = run_batch(query_data, lambda stuff: answer_query(stuff, agent), args.output, workers=args.workers)
+
+    save_file = os.path.splitext(args.output)[0] + ".json"
+    with open(save_file, 'w') as json_file:
+        json.dump(metalist, json_file)
+    if args.trace:
+        tracer.write_metrics(args.trace + ".prom")
+
+    if isinstance(llm, CachedLLM):
+        llm.log_stats()
@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from logger_config import logger
+from tracing import tracer
+
+# A Hugging Face name or a local directory, e.g. for machines without hub access
+DEFAULT_RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+DEFAULT_FETCH_K = 30
+DEFAULT_SCORE_CACHE_SIZE = 20_000
+
+
+class Reranker:
+    """
+    Scores (query, chunk) pairs with a small cross-encoder on the CPU.
+
+    All pairs of a call that are not cached are scored in one batched forward pass. Scores are kept in an LRU
+    cache keyed by query and node id; node ids are content hashes, so a cached score stays valid for as long as
+    the chunk exists.
+
+    Attributes:
+        model_name (str): Hugging Face name or local path of the cross-encoder.
+        max_length (int): Tokens per pair, longer chunks are truncated.
+        cache_size (int): Number of scores kept.
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, max_length=512, cache_size=DEFAULT_SCORE_CACHE_SIZE):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._model = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+                logger.info(f"Loaded cross-encoder {self.model_name}")
+            return self._model
+
+    def score(self, query, nodes):
+        """
+        Returns the relevance score of every node to the query, in order.
+        """
+        scores = [None] * len(nodes)
+        with self._lock:
+            for i, node in enumerate(nodes):
+                key = (query, node.node_id)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+            missing = [i for i, score in enumerate(scores) if score is None]
+            self.hits += len(nodes) - len(missing)
+            self.misses += len(missing)
+        span = tracer.current()
+        span.add("rerank_cache_hits", len(nodes) - len(missing))
+        span.add("rerank_cache_misses", len(missing))
+        if missing:
+            pairs = [(query, nodes[i].get_content(metadata_mode=MetadataMode.NONE)) for i in missing]
+            predicted = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False,
+                                           convert_to_numpy=True)
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._cache[(query, nodes[i].node_id)] = scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query, nodes_with_scores, top_n):
+        """
+        Returns the top_n of the retrieved nodes by cross-encoder score, carrying that score.
+        """
+        if not nodes_with_scores:
+            return []
+        scores = self.score(query, [node_with_score.node for node_with_score in nodes_with_scores])
+        ranked = sorted(zip(nodes_with_scores, scores), key=lambda pair: -pair[1])[:top_n]
+        return [NodeWithScore(node=node_with_score.node, score=score) for node_with_score, score in ranked]
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    Over-fetches candidates from another retriever and keeps the top_n after cross-encoder reranking.
+    """
+
+    def __init__(self, retriever, reranker, top_n):
+        super().__init__()
+        self._retriever = retriever
+        self._reranker = reranker
+        self._top_n = top_n
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        candidates = self._retriever.retrieve(query_bundle)
+        return self._reranker.rerank(query_bundle.query_str, candidates, self._top_n)
+
+
+_shared_rerankers = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_reranker(model_name=DEFAULT_RERANK_MODEL):
+    """Returns the process-wide Reranker for model_name, so every tool session shares one model and score cache."""
+    with _shared_lock:
+        if model_name not in _shared_rerankers:
+            _shared_rerankers[model_name] = Reranker(model_name)
+        return _shared_rerankers[model_name]
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import threading
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from aiohttp import web
+from agent import ReAct, AsyncReAct, PlanAndExecute
+from tools import AskHuman, Finish, Retrieve
+from utils import loadllm
+from logger_config import logger, query_context
+from vectorstore import STORE_BACKENDS
+from tracing import tracer
+
+DEFAULT_HUMAN_TIMEOUT = 60.0
+DEFAULT_MAX_CONCURRENT = 8
+
+
+class QueryRun:
+    """
+    The state of one query on the server: the events waiting to be sent to its client and the questions its
+    agent is waiting on a human for.
+
+    Agents run in worker threads or on the event loop, so events are handed to the loop thread-safely. Events are
+    only queued while a client is streaming them, otherwise nothing would ever take them off the queue.
+    """
+
+    def __init__(self, loop, stream=True):
+        self.id = uuid.uuid4().hex
+        self.loop = loop
+        self.stream = stream
+        self.events = asyncio.Queue()
+        self.questions = {}
+        self.error = None
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        if self.stream:
+            self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+    def ask(self, query, timeout):
+        """AskHuman responder: sends the question to the client and waits for POST /query/<id>/human."""
+        question_id = uuid.uuid4().hex
+        future = Future()
+        with self._lock:
+            self.questions[question_id] = future
+        self.emit({"event": "ask_human", "question_id": question_id, "query": query, "timeout": timeout})
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            return None
+        finally:
+            with self._lock:
+                self.questions.pop(question_id, None)
+
+    def answer(self, text, question_id=None):
+        """Answers the given question, or the oldest open one. Returns False when there is none."""
+        with self._lock:
+            if question_id is None:
+                question_id = next(iter(self.questions), None)
+            future = self.questions.get(question_id)
+        if future is None or future.done():
+            return False
+        future.set_result(text)
+        return True
+
+
+class AgentServer:
+    """
+    Serves the agent over HTTP, with the index, embedding model and LLM client loaded once for all requests.
+
+    Every query runs on its own agent.spawn(), so histories and tool sessions are never shared between requests,
+    and at most max_concurrent queries run at once. Routes:
+        POST /query               {"query": ..., "stream": true}. Streams the steps as server-sent events
+                                  (start, thought, action, observation, ask_human, final, done), or with
+                                  "stream": false answers once with the final answer and the steps. A
+                                  non-streaming client never sees ask_human, so its agent goes on alone.
+        POST /query/{id}/human    {"answer": ..., "question_id": optional}. Answers an ask_human event.
+        GET  /health              Liveness and the number of running queries.
+        GET  /metrics             Latency histograms and counters of the traced spans, in the Prometheus text
+                                  format. Empty unless tracing is on.
+
+    Attributes:
+        agent (ReAct): The agent every request spawns from.
+        human_timeout (float): Seconds an AskHuman question waits for the client before the agent goes on alone.
+        max_concurrent (int): Number of queries run at once, later ones wait.
+    """
+
+    def __init__(self, agent, human_timeout=DEFAULT_HUMAN_TIMEOUT, max_concurrent=DEFAULT_MAX_CONCURRENT):
+        self.agent = agent
+        self.human_timeout = human_timeout
+        self.max_concurrent = max_concurrent
+        self.runs = {}
+        self._slots = None
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/query", self.query)
+        app.router.add_post("/query/{id}/human", self.human)
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/metrics", self.metrics)
+        return app
+
+    @staticmethod
+    def _no_human(query, timeout):
+        return None
+
+    def _session(self, run, stream=True):
+        session = self.agent.spawn(listener=run.emit)
+        for tool in session.tools:
+            if isinstance(tool, AskHuman):
+                # Only a streaming client learns the run id and question ids in time to answer
+                tool.responder = run.ask if stream else self._no_human
+                tool.timeout = self.human_timeout
+        return session
+
+    async def _run(self, run, query, stream=True):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        async with self._slots:
+            session = self._session(run, stream)
+            try:
+                # The agent's log records carry the id the client knows the query by
+                with query_context(run.id):
+                    if isinstance(session, AsyncReAct):
+                        result = await session.aagentloop(query)
+                    else:
+                        result = await asyncio.to_thread(session.agentloop, query)
+            except Exception as e:
+                logger.error(f"Query {run.id} failed: {e}")
+                run.error = str(e)
+                run.emit({"event": "error", "id": run.id, "error": run.error})
+                return None
+            finally:
+                self.runs.pop(run.id, None)
+        run.emit({"event": "done", "id": run.id, "final_answer": result["final_answer"],
+                  "num_steps": len(result["steps"])})
+        return result
+
+    async def query(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="The body must be a JSON object with a query")
+        query = body.get("query") if isinstance(body, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            raise web.HTTPBadRequest(text="The body must be a JSON object with a query")
+
+        stream = body.get("stream", True)
+        run = QueryRun(asyncio.get_running_loop(), stream=stream)
+        self.runs[run.id] = run
+        logger.info(f"Query {run.id}: {query}")
+        task = asyncio.create_task(self._run(run, query, stream))
+
+        if not stream:
+            result = await task
+            if result is None:
+                return web.json_response({"id": run.id, "error": run.error}, status=500)
+            return web.json_response({"id": run.id, **result}, dumps=lambda data: json.dumps(data, default=str))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                               "X-Query-Id": run.id})
+        await response.prepare(request)
+        await self._send(response, {"event": "start", "id": run.id, "query": query})
+        try:
+            while True:
+                event = await run.events.get()
+                await self._send(response, event)
+                if event["event"] in ("done", "error"):
+                    break
+            await response.write_eof()
+        except ConnectionResetError:
+            # The agent runs to the end regardless, a thread cannot be interrupted halfway through a step
+            logger.info(f"Client of query {run.id} disconnected")
+            run.stream = False
+        return response
+
+    @staticmethod
+    async def _send(response, event):
+        data = json.dumps(event, default=str)
+        await response.write(f"event: {event['event']}\ndata: {data}\n\n".encode("utf-8"))
+
+    async def human(self, request):
+        run = self.runs.get(request.match_info["id"])
+        if run is None:
+            raise web.HTTPNotFound(text="No running query with this id")
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="The body must be a JSON object with an answer")
+        if not isinstance(body, dict) or not isinstance(body.get("answer"), str):
+            raise web.HTTPBadRequest(text="The body must be a JSON object with an answer")
+        if not run.answer(body["answer"], body.get("question_id")):
+            raise web.HTTPConflict(text="The agent is not waiting for this answer")
+        return web.json_response({"id": run.id, "answered": True})
+
+    async def health(self, request):
+        return web.json_response({"status": "ok", "running": len(self.runs)})
+
+    async def metrics(self, request):
+        return web.Response(text=tracer.metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+def build_agent(args):
+    """Loads the LLM and the index and builds the agent, so the first request does not pay for it."""
+    llm = loadllm(args.llm, requests_per_minute=args.requests_per_minute)
+    retrieve = Retrieve(args.top_k, mode=args.retrieval, backend=args.backend, rerank=args.rerank,
+                        context_tokens=args.context_tokens)
+    # Load the lexical and metadata indexes and the embedding model's weights now rather than on the first query
+    if args.retrieval == "hybrid":
+        _ = retrieve.handle.lexical
+    _ = retrieve.handle.metadata
+    retrieve.handle.embed_model.get_query_embedding("warm up")
+    agent_class = PlanAndExecute if args.plan else AsyncReAct if args.parallel else ReAct
+    return agent_class([retrieve, AskHuman(), Finish()], [], llm, max_steps=args.max_steps, verbose=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the ReAct agent over HTTP with streamed steps.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--llm", default="Groq", help="StandIn serves offline, e.g. to try the server locally")
+    parser.add_argument("--requests-per-minute", type=float, default=None)
+    parser.add_argument("--max-steps", type=int, default=10)
+    parser.add_argument("--parallel", action="store_true",
+                        help="use AsyncReAct, which may run several independent tool calls per step")
+    parser.add_argument("--plan", action="store_true",
+                        help="use PlanAndExecute, which plans all retrievals in one LLM call and answers in a second")
+    parser.add_argument("--backend", choices=sorted(STORE_BACKENDS), default="chroma")
+    parser.add_argument("--retrieval", choices=["dense", "hybrid"], default="dense")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--rerank", action="store_true")
+    parser.add_argument("--context-tokens", type=int, default=None)
+    parser.add_argument("--human-timeout", type=float, default=DEFAULT_HUMAN_TIMEOUT,
+                        help="seconds the agent waits for a client to answer its question before going on")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_MAX_CONCURRENT)
+    parser.add_argument("--trace", default=None,
+                        help="append a JSONL span per agent step, LLM call and tool run to this file, and serve "
+                             "their metrics on /metrics")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.configure(args.trace)
+
+    server = AgentServer(build_agent(args), human_timeout=args.human_timeout, max_concurrent=args.max_concurrent)
+    logger.info(f"Serving the agent on http://{args.host}:{args.port}")
+    web.run_app(server.app(), host=args.host, port=args.port)
@@ -0,0 +1,130 @@
+import json
+import re
+import time
+from collections import Counter
+from llama_index.core.llms import ChatMessage, ChatResponse, CompletionResponse
+
+MAX_HOPS = 3
+STREAM_CHUNK_CHARS = 16
+YES_NO_WORDS = ("does", "do", "did", "is", "are", "was", "were", "has", "have", "had", "can", "could", "will",
+                "would", "should")
+_ENTITY = re.compile(r"\b[A-Z][\w'’.&-]*(?:\s+(?:of\s+|the\s+|de\s+)?[A-Z][\w'’.&-]*)*")
+_NOT_ENTITIES = {"title", "source", "published_at", "category", "the", "a", "an", "this", "that", "it", "in", "on",
+                 "observation", "thought", "action", "action input", "i", "we", "they", "he", "she", "but", "and"}
+
+
+def sub_questions(question, max_hops=MAX_HOPS):
+    """Splits a multi-hop question into up to max_hops lookups along its clauses."""
+    parts = [part.strip(" ,.?") for part in re.split(r",|;|\band\b|\bwhile\b|\bwhereas\b", question)]
+    parts = [part for part in parts if len(part.split()) >= 3]
+    if len(parts) <= max_hops:
+        return parts or [question]
+    # Merge neighbouring clauses so every lookup still covers part of the question
+    size = -(-len(parts) // max_hops)
+    return [", ".join(parts[i:i + size]) for i in range(0, len(parts), size)]
+
+
+def guess_answer(question, evidence):
+    """
+    Answers from the evidence without a language model: "Yes" for yes/no questions, otherwise the capitalised
+    name that the evidence mentions most and the question does not.
+    """
+    words = question.strip().split()
+    if not words:
+        return "I don't know"
+    if words[0].lower() in YES_NO_WORDS:
+        return "Yes"
+    asked = question.lower()
+    counts = Counter(match.group(0).strip() for match in _ENTITY.finditer(evidence))
+    for name, _ in counts.most_common():
+        if name.lower() not in _NOT_ENTITIES and name.lower() not in asked and len(name) > 1:
+            return name
+    return "I don't know"
+
+
+class StandInLLM:
+    """
+    A deterministic, offline stand-in for the LLM, for benchmarks and tests that must run without a provider.
+
+    It follows the prompts of this repository just well enough to drive every code path: in the ReAct prompts it
+    retrieves one clause of the question per step (all of them in one step under the parallel prompt) and then
+    finishes, it plans one retrieval per clause under the plan-and-execute prompts, and for the baseline prompt it
+    answers from the context. Answers come from guess_answer, so answer
+    accuracy is only meaningful relative to other runs with the stand-in. It speaks the same chat, stream_chat,
+    complete, achat and acomplete interface as the llama_index LLMs.
+
+    Attributes:
+        delay (float): Seconds every call sleeps, to stand in for provider latency.
+        max_hops (int): Number of retrievals before finishing.
+    """
+
+    model = "stand-in"
+
+    def __init__(self, delay=0.0, max_hops=MAX_HOPS):
+        self.delay = delay
+        self.max_hops = max_hops
+
+    @staticmethod
+    def _section(prompt, start, end):
+        match = re.search(start + r"\s*(.*?)\s*(?:" + end + r"|$)", prompt, re.DOTALL)
+        return match.group(1).strip() if match else ""
+
+    def _react(self, prompt):
+        question = self._section(prompt, r"Given the question:", r"Here are your previous steps:")
+        history = self._section(prompt, r"Here are your previous steps:", r"Thoroughly analyse")
+        lookups = sub_questions(question, self.max_hops)
+        done = len(re.findall(r"^ACTION [\d.]+ :retrieve", history, re.MULTILINE))
+        parallel = '"actions"' in prompt
+        if done >= len(lookups) or (parallel and done):
+            evidence = "\n".join(line for line in history.split("\n") if not line.startswith(("THOUGHT", "ACTION")))
+            answer = guess_answer(question, evidence)
+            step = {"thought": "I have looked up every part of the question.", "action": "finish", "input": answer}
+        elif parallel:
+            step = {"thought": "The parts of the question are independent, so I look them all up at once.",
+                    "actions": [{"action": "retrieve", "input": lookup} for lookup in lookups]}
+        else:
+            step = {"thought": f"Next I look up part {done + 1} of the question.", "action": "retrieve",
+                    "input": lookups[done]}
+        return json.dumps(step)
+
+    def _respond(self, prompt):
+        if self.delay:
+            time.sleep(self.delay)
+        if "Given the question:" in prompt:
+            return self._react(prompt)
+        if "Plan the retrievals for the question:" in prompt:
+            question = self._section(prompt, r"Plan the retrievals for the question:", r"The question is answered")
+            return json.dumps({"thought": "Every clause of the question is looked up on its own.",
+                               "sub_queries": sub_questions(question, self.max_hops)})
+        if "Answer the question:" in prompt:
+            question = self._section(prompt, r"Answer the question:", r"Here is the evidence")
+            evidence = self._section(prompt, r"Here is the evidence retrieved for it, one block per retrieval:",
+                                     r"Thoroughly analyse")
+            answer = guess_answer(question, evidence)
+            return json.dumps({"thought": "I answer from the evidence.",
+                               "answer": None if answer == "I don't know" else answer})
+        question = self._section(prompt, r"QUESTION:", r"Please provide")
+        context = self._section(prompt, r"CONTEXT:", r"QUESTION:")
+        return guess_answer(question, context)
+
+    @staticmethod
+    def _prompt(messages):
+        return "\n".join(str(message.content) for message in messages)
+
+    def chat(self, messages, **kwargs):
+        return ChatResponse(message=ChatMessage(role="assistant", content=self._respond(self._prompt(messages))))
+
+    def stream_chat(self, messages, **kwargs):
+        content = self._respond(self._prompt(messages))
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            yield ChatResponse(message=ChatMessage(role="assistant", content=content[:i + STREAM_CHUNK_CHARS]),
+                               delta=content[i:i + STREAM_CHUNK_CHARS])
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        return CompletionResponse(text=self._respond(prompt))
+
+    async def achat(self, messages, **kwargs):
+        return self.chat(messages, **kwargs)
+
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        return self.complete(prompt, formatted=formatted, **kwargs)
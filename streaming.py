@@ -0,0 +1,131 @@
+import json
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class JSONFieldStream:
+    """
+    Incrementally parses the top-level fields of a JSON object from a stream of text chunks.
+
+    feed() returns events as soon as they can be known:
+        ("partial", key, text): More characters of a string value, already unescaped.
+        ("complete", key, value): A value is complete, with value decoded by json.loads.
+
+    Text before the opening brace, such as a ```json fence, is skipped. Only the top-level object is tracked,
+    nested objects and arrays are buffered and reported once complete.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._state = "start"
+        self._key = None
+        self._raw = ""
+        self._escape = ""
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, chunk):
+        events = []
+        self.text += chunk
+        for char in chunk:
+            self._consume(char, events)
+        return events
+
+    @property
+    def done(self):
+        return self._state == "done"
+
+    def _complete(self, events):
+        try:
+            events.append(("complete", self._key, json.loads(self._raw)))
+        except json.JSONDecodeError:
+            pass
+        self._key = None
+        self._raw = ""
+
+    def _consume(self, char, events):
+        state = self._state
+        if state == "start":
+            if char == "{":
+                self._state = "key"
+        elif state == "key":
+            if char == '"':
+                self._state = "key_string"
+                self._raw = ""
+            elif char == "}":
+                self._state = "done"
+        elif state == "key_string":
+            if self._escape:
+                self._raw += char
+                self._escape = ""
+            elif char == "\\":
+                self._raw += char
+                self._escape = char
+            elif char == '"':
+                self._key = json.loads(f'"{self._raw}"')
+                self._state = "colon"
+            else:
+                self._raw += char
+        elif state == "colon":
+            if char == ":":
+                self._state = "value"
+        elif state == "value":
+            if char.isspace():
+                return
+            self._raw = char
+            if char == '"':
+                self._state = "string_value"
+            elif char in "{[":
+                self._depth = 1
+                self._in_string = False
+                self._state = "nested_value"
+            else:
+                self._state = "scalar_value"
+        elif state == "string_value":
+            self._raw += char
+            if self._escape:
+                self._escape += char
+                if self._escape[1] != "u":
+                    events.append(("partial", self._key, _ESCAPES.get(char, char)))
+                    self._escape = ""
+                elif len(self._escape) == 6:
+                    code = int(self._escape[2:], 16)
+                    if not 0xD800 <= code <= 0xDFFF:
+                        events.append(("partial", self._key, chr(code)))
+                    self._escape = ""
+            elif char == "\\":
+                self._escape = char
+            elif char == '"':
+                self._complete(events)
+                self._state = "separator"
+            else:
+                events.append(("partial", self._key, char))
+        elif state == "nested_value":
+            self._raw += char
+            if self._in_string:
+                if self._escape:
+                    self._escape = ""
+                elif char == "\\":
+                    self._escape = char
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete(events)
+                    self._state = "separator"
+        elif state == "scalar_value":
+            if char in ",}" or char.isspace():
+                self._complete(events)
+                self._state = "done" if char == "}" else ("key" if char == "," else "separator")
+            else:
+                self._raw += char
+        elif state == "separator":
+            if char == ",":
+                self._state = "key"
+            elif char == "}":
+                self._state = "done"
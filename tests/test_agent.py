@@ -0,0 +1,92 @@
+import json
+import threading
+from llama_index.core.llms import ChatMessage, ChatResponse
+from agent import AsyncReAct, ReAct
+from tools import AskHuman, Finish, Tool
+
+
+class Lookup(Tool):
+    def __init__(self):
+        self.calls = []
+
+    def run(self, input_params):
+        self.calls.append(input_params)
+        return f"facts about {input_params}"
+
+
+class ScriptedLLM:
+    """Replies with the given steps in turn."""
+
+    model = "scripted"
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+
+    async def achat(self, messages, **kwargs):
+        return ChatResponse(message=ChatMessage(role="assistant", content=json.dumps(self.steps.pop(0))))
+
+
+def test_actions_without_dicts_fall_back_to_action_fields():
+    lookup = Lookup()
+    llm = ScriptedLLM({"thought": "look", "actions": ["lookup", "x"], "action": "lookup", "input": "Acme"},
+                      {"thought": "done", "actions": [{"action": "finish", "input": "Acme"}]})
+    result = AsyncReAct([lookup, Finish()], [], llm, verbose=False).agentloop("Which company?")
+    assert lookup.calls == ["Acme"]
+    assert result["final_answer"] == "Acme"
+
+
+def test_unusable_actions_record_an_error_step():
+    llm = ScriptedLLM({"thought": "confused", "actions": ["lookup"]})
+    result = AsyncReAct([Lookup(), Finish()], [], llm, verbose=False).agentloop("Which company?")
+    assert result["final_answer"] is None
+    assert result["steps"] == [{"thought": "confused", "action": "Empty", "input": "Empty",
+                                "observation": "No matching tool found"}]
+
+
+def test_actions_alongside_finish_run_first():
+    lookup = Lookup()
+    llm = ScriptedLLM({"thought": "both", "actions": [{"action": "lookup", "input": "Acme"},
+                                                      {"action": "finish", "input": "Acme"}]})
+    result = AsyncReAct([lookup, Finish()], [], llm, verbose=False).agentloop("Which company?")
+    assert lookup.calls == ["Acme"]
+    assert [step["action"] for step in result["steps"]] == ["lookup", "finish"]
+    assert result["steps"][0]["observation"] == "facts about Acme"
+    assert result["final_answer"] == "Acme"
+
+
+class StreamingLLM:
+    """Streams each reply in small chunks."""
+
+    model = "streaming"
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+
+    def stream_chat(self, messages, **kwargs):
+        text = json.dumps(self.steps.pop(0))
+        for i in range(0, len(text), 5):
+            yield ChatResponse(message=ChatMessage(role="assistant", content=text[:i + 5]), delta=text[i:i + 5])
+
+
+def test_stdin_human_is_not_asked_while_streaming(monkeypatch):
+    threads = []
+
+    def fake_input(prompt):
+        threads.append(threading.current_thread())
+        return "Acme"
+
+    monkeypatch.setattr("builtins.input", fake_input)
+    llm = StreamingLLM({"thought": "ask", "action": "askhuman", "input": "Which one?"},
+                       {"thought": "done", "action": "finish", "input": "Acme"})
+    result = ReAct([AskHuman(), Finish()], [], llm, stream=True, verbose=False).agentloop("Which company?")
+    assert threads == [threading.main_thread()]
+    assert result["final_answer"] == "Acme"
+
+
+def test_tools_dispatch_early_while_streaming():
+    lookup = Lookup()
+    llm = StreamingLLM({"action": "lookup", "input": "Acme", "thought": "look it up"},
+                       {"thought": "done", "action": "finish", "input": "Acme"})
+    agent = ReAct([lookup, Finish()], [], llm, stream=True, verbose=False)
+    thought, action, action_input, pending = agent._run_stream("Which company?", 1)
+    assert pending is not None and pending.result() == "facts about Acme"
@@ -0,0 +1,35 @@
+from typing import List
+from llama_index.core.embeddings import BaseEmbedding
+from embedding_cache import EmbeddingCache, CachedEmbedding
+
+
+class ConstantEmbedding(BaseEmbedding):
+    """Embeds every text as the same vector, optionally under a cache name of its own."""
+
+    value: float = 1.0
+    own_cache_name: str = ""
+
+    @property
+    def cache_name(self):
+        return self.own_cache_name or None
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return [self.value, 0.0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return [self.value, 0.0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return [self.value, 0.0]
+
+
+def test_cache_is_keyed_on_the_cache_name(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"))
+    original = CachedEmbedding(ConstantEmbedding(model_name="mpnet", value=1.0), cache)
+    export = CachedEmbedding(ConstantEmbedding(model_name="mpnet", value=2.0, own_cache_name="mpnet:onnx-int8"),
+                             cache)
+    assert original.model_name == export.model_name == "mpnet"
+
+    assert original.get_text_embedding("Some chunk") == [1.0, 0.0]
+    assert export.get_text_embedding("Some chunk") == [2.0, 0.0]
+    assert original.get_text_embedding("Some chunk") == [1.0, 0.0]
@@ -0,0 +1,33 @@
+from history import Action, Episode, History, count_tokens
+
+FILLER = "Nothing in this sentence is about the question at all. " * 40
+
+
+def episode(iteration, topic):
+    observation = f"title: Article {iteration}\nsource: Wire\n{FILLER}The {topic} was announced on Monday. {FILLER}"
+    return Episode(iteration, f"Look up the {topic}", [Action("Retrieve", {"query": topic}, observation)])
+
+
+def test_fits_in_budget_unchanged():
+    history = History([episode(1, "merger"), episode(2, "ruling")], token_budget=100_000)
+    assert history.render("merger") == "\n\n".join(e.render() for e in history)
+
+
+def test_most_recent_episode_stays_verbatim():
+    episodes = [episode(i, topic) for i, topic in enumerate(["merger", "ruling", "launch", "recall"], start=1)]
+    last = episodes[-1].render()
+    history = History(episodes, token_budget=count_tokens(last) + 200, keep_full=1)
+    rendered = history.render("merger recall")
+    assert count_tokens(rendered) <= history.token_budget
+    assert rendered.endswith(last)
+    # Older episodes are summarised, keeping their header and the sentence on the query, or dropped entirely
+    for part in rendered.split("\n\n")[:-1]:
+        assert "[...]" in part and "title: Article" in part
+
+
+def test_keep_full_episodes_summarised_as_last_resort():
+    episodes = [episode(1, "merger"), episode(2, "recall")]
+    history = History(episodes, token_budget=count_tokens(episodes[-1].render()) // 2, keep_full=1)
+    rendered = history.render("recall")
+    assert rendered.startswith("THOUGHT 2 ")
+    assert "The recall was announced on Monday." in rendered and "[...]" in rendered
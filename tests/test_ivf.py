@@ -0,0 +1,120 @@
+import os
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from ivf import IVFIndex, IVFVectorStore, default_pq_m
+
+DIM = 32
+
+
+def clustered(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((20, DIM)).astype(np.float32)
+    vectors = centres[rng.integers(20, size=rows)] + 0.5 * rng.standard_normal((rows, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall(ivf, vectors, queries, top_k=10, refine=8, nprobe=32):
+    found = 0
+    for query in queries:
+        exact = np.argsort(-(vectors @ query))[:top_k]
+        candidates = ivf.search(query, top_k * refine, nprobe=nprobe)
+        refined = candidates[np.argsort(-(vectors[candidates] @ query))][:top_k]
+        found += len(set(exact) & set(refined))
+    return found / (top_k * len(queries))
+
+
+def test_default_pq_m_divides_dim():
+    assert default_pq_m(64) == 16
+    assert default_pq_m(768) == 192
+    assert default_pq_m(770) == 154
+    assert default_pq_m(3) == 1
+
+
+@pytest.mark.parametrize("quantizer", ["int8", "pq"])
+def test_search_recall(quantizer):
+    vectors = clustered(3000)
+    queries = clustered(50, seed=1)
+    ivf = IVFIndex.train(vectors, generation=0, quantizer=quantizer)
+    assert ivf.rows == len(vectors)
+    assert ivf.codes.shape[1] == (DIM if quantizer == "int8" else DIM // 4)
+    assert recall(ivf, vectors, queries) >= 0.95
+
+
+def test_smaller_pq_codes_lose_recall():
+    vectors = clustered(3000)
+    queries = clustered(50, seed=1)
+    default = IVFIndex.train(vectors, generation=0, quantizer="pq")
+    small = IVFIndex.train(vectors, generation=0, quantizer="pq", pq_m=DIM // 8)
+    assert recall(small, vectors, queries) < recall(default, vectors, queries) - 0.05
+
+
+def test_add_extends_lists():
+    vectors = clustered(1200)
+    ivf = IVFIndex.train(vectors[:1000], generation=0)
+    centroids = ivf.centroids.copy()
+    ivf.add(vectors)
+    assert ivf.rows == 1200
+    assert np.array_equal(ivf.centroids, centroids)
+    assert sorted(ivf.order) == list(range(1200))
+
+
+def nodes(vectors, start=0):
+    return [TextNode(id_=f"n{start + i}", text=f"chunk {start + i}", embedding=vector.tolist())
+            for i, vector in enumerate(vectors)]
+
+
+def test_store_trains_extends_and_retrains(tmp_path):
+    vectors = clustered(1500)
+    store = IVFVectorStore(str(tmp_path), nprobe=8)
+    store.add(nodes(vectors[:1000]))
+    result = store.query(VectorStoreQuery(query_embedding=vectors[10].tolist(), similarity_top_k=5))
+    assert result.ids[0] == "n10"
+    assert os.path.exists(store.ivf_path)
+    trained = store.ensure_ivf()
+
+    store.add(nodes(vectors[1000:], start=1000))
+    extended = store.ensure_ivf()
+    assert extended.rows == 1500 and np.array_equal(extended.centroids, trained.centroids)
+    result = store.query(VectorStoreQuery(query_embedding=vectors[1200].tolist(), similarity_top_k=5))
+    assert result.ids[0] == "n1200"
+
+    # A delete rewrites the store into a new generation, the index is retrained on the rows left
+    store.delete_nodes(["n10"])
+    retrained = store.ensure_ivf()
+    assert retrained.generation == store._meta["generation"] == 1 and retrained.rows == 1499
+    result = store.query(VectorStoreQuery(query_embedding=vectors[10].tolist(), similarity_top_k=5))
+    assert "n10" not in result.ids
+
+    reopened = IVFVectorStore(str(tmp_path), nprobe=8)
+    assert reopened.ensure_ivf().generation == 1
+    assert reopened.query(VectorStoreQuery(query_embedding=vectors[20].tolist(), similarity_top_k=1)).ids == ["n20"]
+
+
+def test_superseded_rows_are_not_returned(tmp_path):
+    vectors = clustered(600)
+    store = IVFVectorStore(str(tmp_path))
+    store.add(nodes(vectors))
+    store.ensure_ivf()
+    store.add(nodes(vectors[300:301] * -1, start=0))
+    result = store.query(VectorStoreQuery(query_embedding=vectors[0].tolist(), similarity_top_k=3))
+    assert "n0" not in result.ids
+
+
+def test_changed_settings_retrain(tmp_path):
+    vectors = clustered(800)
+    store = IVFVectorStore(str(tmp_path), quantizer="pq", pq_m=8, nlist=20)
+    store.add(nodes(vectors))
+    ivf = store.ensure_ivf()
+    assert (ivf.nlist, ivf.pq_m, ivf.codes.shape[1]) == (20, 8, 8)
+
+    # The same settings, or no nlist at all, reuse the saved index
+    assert IVFVectorStore(str(tmp_path), quantizer="pq", pq_m=8).ensure_ivf().nlist == 20
+
+    retrained = IVFVectorStore(str(tmp_path), quantizer="pq", pq_m=16, nlist=20).ensure_ivf()
+    assert (retrained.pq_m, retrained.codes.shape[1]) == (16, 16)
+    retrained = IVFVectorStore(str(tmp_path), quantizer="pq", pq_m=16, nlist=10).ensure_ivf()
+    assert (retrained.nlist, len(retrained.centroids)) == (10, 10)
+    # The default pq_m is dim / 4
+    assert IVFVectorStore(str(tmp_path), quantizer="pq", nlist=10).ensure_ivf().pq_m == DIM // 4 == 8
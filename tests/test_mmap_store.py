@@ -0,0 +1,77 @@
+import json
+import os
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from mmap_store import META_FILE, MmapVectorStore
+
+
+def make_nodes(names, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return [TextNode(id_=name, text=f"text of {name}", embedding=rng.normal(size=dim).tolist()) for name in names]
+
+
+def test_add_and_query(tmp_path):
+    store = MmapVectorStore(str(tmp_path), dtype="float32")
+    nodes = make_nodes([f"n{i}" for i in range(20)])
+    store.add(nodes[:12])
+    store.add(nodes[12:])
+    result = store.query(VectorStoreQuery(query_embedding=nodes[15].embedding, similarity_top_k=3))
+    assert result.ids[0] == "n15"
+    assert np.isclose(result.similarities[0], 1.0, atol=1e-5)
+    assert store.node_ids() == [f"n{i}" for i in range(20)]
+
+
+def test_readd_supersedes_and_delete(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    store.add(make_nodes(["a", "b", "c"]))
+    replacement = make_nodes(["b"], seed=1)
+    store.add(replacement)
+    assert sorted(store.node_ids()) == ["a", "b", "c"]
+    assert int(store._live.sum()) == 3
+    result = store.query(VectorStoreQuery(query_embedding=replacement[0].embedding, similarity_top_k=4))
+    assert result.ids.count("b") == 1 and result.ids[0] == "b"
+    store.delete_nodes(["a"])
+    reopened = MmapVectorStore(str(tmp_path))
+    assert sorted(reopened.node_ids()) == ["b", "c"]
+    assert [node.get_content() for node in reopened.get_nodes(["b", "c"])] == ["text of b", "text of c"]
+
+
+def test_torn_write_is_discarded(tmp_path):
+    store = MmapVectorStore(str(tmp_path), dtype="float32")
+    first = make_nodes([f"n{i}" for i in range(5)])
+    store.add(first)
+    meta = json.loads((tmp_path / META_FILE).read_text())
+    assert meta["rows"] == 5 and meta["sizes"]["ids"] == os.path.getsize(tmp_path / "0.ids")
+
+    # An add interrupted before meta.json was replaced leaves partial rows behind in every file
+    for kind, garbage in (("nodes", b'{"half a node'), ("ids", b"torn\t"), ("vectors", b"\x01" * 13),
+                          ("offsets", b"\x02" * 8)):
+        with open(tmp_path / f"0.{kind}", 'ab') as file:
+            file.write(garbage)
+
+    reopened = MmapVectorStore(str(tmp_path), dtype="float32")
+    assert reopened.node_ids() == [f"n{i}" for i in range(5)]
+    second = make_nodes([f"m{i}" for i in range(3)], seed=1)
+    reopened.add(second)
+
+    store = MmapVectorStore(str(tmp_path), dtype="float32")
+    assert store.node_ids() == [f"n{i}" for i in range(5)] + [f"m{i}" for i in range(3)]
+    assert [node.get_content() for node in store.get_nodes()] == [node.get_content() for node in first + second]
+    for node in first + second:
+        assert store.query(VectorStoreQuery(query_embedding=node.embedding, similarity_top_k=1)).ids == [node.node_id]
+    assert os.path.getsize(tmp_path / "0.vectors") == 8 * 8 * 4
+
+
+def test_store_without_recorded_sizes(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    store.add(make_nodes(["a", "b"]))
+    meta = json.loads((tmp_path / META_FILE).read_text())
+    sizes = meta.pop("sizes")
+    (tmp_path / META_FILE).write_text(json.dumps(meta))
+    with open(tmp_path / "0.ids", 'ab') as file:
+        file.write(b"torn")
+    store = MmapVectorStore(str(tmp_path))
+    assert store._meta["sizes"] == sizes
+    store.add(make_nodes(["c"]))
+    assert MmapVectorStore(str(tmp_path)).node_ids() == ["a", "b", "c"]
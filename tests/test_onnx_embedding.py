@@ -0,0 +1,15 @@
+import json
+from onnx_embedding import corpus_probe_texts
+
+
+def test_probe_texts_are_spread_over_the_corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    records = [{"title": f"Article {i}", "published_at": "2023-10-01T10:00:00+00:00", "source": "Wire",
+                "body": f"Body of article {i}."} for i in range(40)]
+    corpus = tmp_path / "corpus.json"
+    corpus.write_text(json.dumps(records))
+
+    probes = corpus_probe_texts(str(corpus), count=4)
+    assert len(probes) == 4
+    assert [next(i for i in range(40) if f"article {i}." in probe) for probe in probes] == [0, 10, 20, 30]
+    assert corpus_probe_texts(str(tmp_path / "missing.json")) == []
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from aiohttp.test_utils import TestClient, TestServer
+from llama_index.core.llms import ChatMessage, ChatResponse
+from agent import ReAct
+import server as server_module
+from server import AgentServer
+from tools import AskHuman, Finish, NO_HUMAN_ANSWER
+
+
+class AskThenFinishLLM:
+    """Asks the human once, then finishes with whatever the human answered."""
+
+    model = "ask-then-finish"
+
+    def chat(self, messages, **kwargs):
+        prompt = messages[-1].content
+        if "OBSERVATION 1 :" in prompt:
+            answer = prompt.split("OBSERVATION 1 :", 1)[1].split("\n")[0].strip()
+            step = {"thought": "The human answered", "action": "finish", "input": answer}
+        else:
+            step = {"thought": "Ask the human", "action": "askhuman", "input": "Which one?"}
+        return ChatResponse(message=ChatMessage(role="assistant", content=json.dumps(step)))
+
+
+def make_server(human_timeout=5.0):
+    agent = ReAct([AskHuman(), Finish()], [], AskThenFinishLLM(), max_steps=3, verbose=False)
+    return AgentServer(agent, human_timeout=human_timeout)
+
+
+def run_with_client(server, scenario):
+    async def main():
+        async with TestClient(TestServer(server.app())) as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def parse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        data = next(line for line in block.split("\n") if line.startswith("data: "))
+        events.append(json.loads(data[len("data: "):]))
+    return events
+
+
+def test_stream_answers_ask_human():
+    server = make_server()
+
+    async def scenario(client):
+        response = await client.post("/query", json={"query": "Which company?"})
+        assert response.headers["Content-Type"] == "text/event-stream"
+        text = ""
+        while True:
+            line = (await response.content.readline()).decode("utf-8")
+            text += line
+            if line.startswith("data: ") and '"ask_human"' in line:
+                event = json.loads(line[len("data: "):])
+                answered = await client.post(f"/query/{response.headers['X-Query-Id']}/human",
+                                             json={"answer": "Acme", "question_id": event["question_id"]})
+                assert answered.status == 200
+            if not line:
+                break
+        return parse_events(text)
+
+    events = run_with_client(server, scenario)
+    kinds = [event["event"] for event in events]
+    assert kinds[0] == "start" and kinds[-1] == "done" and "ask_human" in kinds
+    assert events[-1]["final_answer"] == "Acme"
+    assert not server.runs
+
+
+def test_non_streaming_does_not_wait_for_a_human():
+    server = make_server(human_timeout=30.0)
+
+    async def scenario(client):
+        response = await asyncio.wait_for(client.post("/query", json={"query": "Which company?", "stream": False}),
+                                          timeout=10)
+        assert response.status == 200
+        return await response.json()
+
+    result = run_with_client(server, scenario)
+    assert result["id"]
+    assert result["steps"][0]["observation"] == NO_HUMAN_ANSWER
+    assert result["final_answer"] == NO_HUMAN_ANSWER
+
+
+def test_non_streaming_queues_no_events(monkeypatch):
+    runs = []
+
+    class RecordedRun(server_module.QueryRun):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            runs.append(self)
+
+    monkeypatch.setattr(server_module, "QueryRun", RecordedRun)
+    server = make_server()
+
+    async def scenario(client):
+        response = await client.post("/query", json={"query": "Which company?", "stream": False})
+        assert response.status == 200
+        # Let any event handed over by a worker thread reach the queue
+        await asyncio.sleep(0.05)
+        return runs[0].events.qsize()
+
+    assert run_with_client(server, scenario) == 0
+
+
+def test_bad_requests():
+    server = make_server()
+
+    async def scenario(client):
+        missing = await client.post("/query", json={"stream": False})
+        unknown = await client.post("/query/nope/human", json={"answer": "x"})
+        health = await (await client.get("/health")).json()
+        return missing.status, unknown.status, health
+
+    assert run_with_client(server, scenario) == (400, 404, {"status": "ok", "running": 0})
@@ -0,0 +1,56 @@
+import json
+import pytest
+from streaming import JSONFieldStream
+
+
+def feed_all(text, chunk_size):
+    parser = JSONFieldStream()
+    events = []
+    for i in range(0, len(text), chunk_size):
+        events.extend(parser.feed(text[i:i + chunk_size]))
+    return parser, events
+
+
+def streamed(events, key):
+    return "".join(text for kind, field, text in events if kind == "partial" and field == key)
+
+
+def completed(events):
+    return {key: value for kind, key, value in events if kind == "complete"}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_fenced_response(chunk_size):
+    response = '```json\n{\n    "thought": "Look it up",\n    "action": "Retrieve",\n    "action_input": ' \
+               '{"query": "a [b] {c}", "k": 3}\n}\n```'
+    parser, events = feed_all(response, chunk_size)
+    assert parser.done
+    assert streamed(events, "thought") == "Look it up"
+    assert completed(events) == {"thought": "Look it up", "action": "Retrieve",
+                                 "action_input": {"query": "a [b] {c}", "k": 3}}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7])
+def test_escaped_strings(chunk_size):
+    answer = 'He said "yes" \\ no\n\ttab café \U0001F600 /'
+    response = json.dumps({"answer": answer, "nested": {"text": 'quote " and }'}})
+    parser, events = feed_all(response, chunk_size)
+    assert completed(events) == {"answer": answer, "nested": {"text": 'quote " and }'}}
+    # Surrogate halves are not streamed, so the emoji only shows up in the decoded value
+    assert streamed(events, "answer") == answer.replace("\U0001F600", "")
+
+
+def test_reordered_fields():
+    response = '{"answer": "Paris", "score": 0.5, "ok": true, "missing": null, "thought": "last"}'
+    parser, events = feed_all(response, 4)
+    assert parser.done
+    assert [key for kind, key, _ in events if kind == "complete"] == ["answer", "score", "ok", "missing", "thought"]
+    assert completed(events) == json.loads(response)
+    assert streamed(events, "answer") == "Paris"
+
+
+def test_incomplete_object_is_not_done():
+    parser, events = feed_all('{"thought": "still going', 5)
+    assert not parser.done
+    assert streamed(events, "thought") == "still going"
+    assert completed(events) == {}
@@ -0,0 +1,43 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+from tools import Retrieve
+
+
+class FakeRetriever:
+    def __init__(self, nodes, queries):
+        self.nodes = nodes
+        self.queries = queries
+
+    def retrieve(self, query):
+        self.queries.append(query)
+        return [NodeWithScore(node=node, score=1.0) for node in self.nodes]
+
+
+class FakeHandle:
+    """Returns the same chunks for every query, recording the queries."""
+
+    def __init__(self, count=6):
+        self.queries = []
+        self.nodes = [TextNode(id_=f"n{i}", text=f"Body of article {i}.",
+                               metadata={"title": f"Article {i}", "source": "Wire"}) for i in range(count)]
+
+    def retriever(self, top_k, mode="dense", node_ids=None, reranker=None, **kwargs):
+        return FakeRetriever(self.nodes, self.queries)
+
+
+def test_non_string_inputs_are_retrieved_as_text():
+    handle = FakeHandle()
+    retrieve = Retrieve(2, handle=handle)
+    assert "Article 0" in retrieve.run(["Acme", "merger"])
+    assert "Article 2" in retrieve.run(2023)
+    assert "Article 4" in retrieve.run({"query": ["Acme"]})
+    assert handle.queries == ["['Acme', 'merger']", "2023", "['Acme']"]
+
+
+def test_repeated_retrieval_points_to_earlier_result():
+    handle = FakeHandle()
+    retrieve = Retrieve(2, handle=handle).session()
+    first = retrieve.run("Acme merger")
+    assert "Article 0" in first and "Article 1" in first
+    repeat = retrieve.run("  acme   MERGER ")
+    assert "already made" in repeat and "Article 0; Article 1" in repeat
+    assert len(handle.queries) == 1
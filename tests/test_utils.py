@@ -0,0 +1,39 @@
+import json
+import pytest
+from utils import iter_records
+
+
+def articles(count, body_size=50):
+    return [{"title": f"Article {i}", "published_at": "2023-10-01T10:00:00+00:00", "source": "Wire",
+             "body": f"{i} " + "x" * body_size} for i in range(count)]
+
+
+def test_array_parsed_across_blocks(tmp_path):
+    records = articles(5)
+    records[2]["body"] = 'A "quoted" body, with [brackets] and {braces}. ' * 200
+    path = tmp_path / "corpus.json"
+    path.write_text(json.dumps(records, indent=2))
+    assert len(records[2]["body"]) > 64
+    assert list(iter_records(str(path), block_size=64)) == records
+
+
+def test_array_with_whitespace_and_empty(tmp_path):
+    path = tmp_path / "corpus.json"
+    path.write_text("\n  [ ]  \n")
+    assert list(iter_records(str(path), block_size=4)) == []
+    path.write_text(" [\n" + ",\n".join(json.dumps(record) for record in articles(3)) + "\n]\n")
+    assert list(iter_records(str(path), block_size=16)) == articles(3)
+
+
+def test_jsonl(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in articles(4)) + "\n\n")
+    assert list(iter_records(str(path), block_size=32)) == articles(4)
+
+
+@pytest.mark.parametrize("cut", [-2, -40])
+def test_truncated_array_raises(tmp_path, cut):
+    path = tmp_path / "corpus.json"
+    path.write_text(json.dumps(articles(3))[:cut])
+    with pytest.raises(ValueError):
+        list(iter_records(str(path), block_size=32))
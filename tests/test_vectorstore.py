@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import List
+import numpy as np
+import pytest
+from llama_index.core.embeddings import BaseEmbedding
+from chunk_store import load_chunk_store
+from indexing import EmbeddingPipeline
+from manifest import LEGACY_MANIFEST_FILE
+from vectorstore import MmapStore
+
+
+class CountingEmbedding(BaseEmbedding):
+    """Deterministic pseudo-random vectors, counting the texts it embeds."""
+
+    embedded: int = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).normal(size=16).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self.embedded += 1
+        return self._vector(text)
+
+
+def write_corpus(path, bodies):
+    records = [{"title": f"Article {i}", "published_at": "2023-10-01T10:00:00+00:00", "source": "Wire", "body": body}
+               for i, body in enumerate(bodies)]
+    path.write_text(json.dumps(records))
+
+
+def chunk_ids_by_document(store):
+    ids = {}
+    manifest = store.manifest()
+    for node_id, document_id in manifest.chunks():
+        ids.setdefault(document_id, set()).add(node_id)
+    manifest.close()
+    return ids
+
+
+def test_reindex_touches_only_changed_article(tmp_path):
+    bodies = [" ".join(f"Sentence {i}.{j} about topic {i}." for j in range(120)) for i in range(4)]
+    corpus = tmp_path / "corpus.json"
+    write_corpus(corpus, bodies)
+    store = MmapStore(database_path=str(tmp_path / "vector"), name="test")
+    model = CountingEmbedding(model_name="counting")
+
+    chunks = load_chunk_store(str(corpus), root=str(tmp_path / "chunks"))
+    store.update_index(chunks.iter_nodes(), model)
+    before = chunk_ids_by_document(store)
+    assert len(before) == 4 and model.embedded == sum(len(ids) for ids in before.values())
+    assert set(store.stored_ids()) == set().union(*before.values())
+
+    bodies[2] = bodies[2].replace("topic 2", "a revised topic")
+    write_corpus(corpus, bodies)
+    model.embedded = 0
+    chunks = load_chunk_store(str(corpus), root=str(tmp_path / "chunks"))
+    store.update_index(chunks.iter_nodes(), model)
+    after = chunk_ids_by_document(store)
+
+    changed = set(before) - set(after)
+    added = set(after) - set(before)
+    assert len(changed) == 1 and len(added) == 1
+    for document_id in set(before) & set(after):
+        assert before[document_id] == after[document_id]
+    assert model.embedded == len(after[added.pop()])
+    assert set(store.stored_ids()) == set().union(*after.values())
+    manifest = store.manifest()
+    assert manifest.complete and len(manifest) == len(store.stored_ids())
+    manifest.close()
+
+
+def test_interrupted_update_resumes(tmp_path):
+    bodies = [" ".join(f"Sentence {i}.{j} about topic {i}." for j in range(120)) for i in range(4)]
+    corpus = tmp_path / "corpus.json"
+    write_corpus(corpus, bodies)
+    store = MmapStore(database_path=str(tmp_path / "vector"), name="test")
+    model = CountingEmbedding(model_name="counting")
+    chunks = load_chunk_store(str(corpus), root=str(tmp_path / "chunks"))
+    total = sum(1 for _ in chunks.iter_nodes())
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupted(nodes):
+        for i, node in enumerate(nodes):
+            if i == total // 2:
+                raise Interrupted()
+            yield node
+
+    with pytest.raises(Interrupted):
+        store.update_index(interrupted(chunks.iter_nodes()), model, pipeline=EmbeddingPipeline(model, batch_size=4))
+    manifest = store.manifest()
+    written = len(manifest)
+    assert not manifest.complete and 0 < written <= total // 2
+    manifest.close()
+
+    model.embedded = 0
+    store.update_index(chunks.iter_nodes(), model)
+    assert model.embedded == total - written
+    assert len(set(store.stored_ids())) == total
+
+
+def test_legacy_manifest_is_imported(tmp_path):
+    store = MmapStore(database_path=str(tmp_path / "vector"), name="test")
+    os.makedirs(store.path)
+    with open(os.path.join(store.path, LEGACY_MANIFEST_FILE), "w") as file:
+        json.dump({"embed_model": "counting", "complete": False, "chunks": {"a": "doc", "b": "doc"}}, file)
+    manifest = store.manifest()
+    assert manifest.embed_model == "counting" and not manifest.complete
+    assert sorted(manifest.chunks()) == [("a", "doc"), ("b", "doc")]
+    manifest.close()
+    assert not os.path.exists(os.path.join(store.path, LEGACY_MANIFEST_FILE))
+
+
+def test_lexical_and_metadata_indexes_read_the_chunk_store(tmp_path):
+    bodies = [" ".join(f"Sentence {i}.{j} about topic {i}." for j in range(120)) for i in range(3)]
+    corpus = tmp_path / "corpus.json"
+    write_corpus(corpus, bodies + bodies[:1])
+    store = MmapStore(database_path=str(tmp_path / "vector"), name="test")
+    chunks = load_chunk_store(str(corpus), root=str(tmp_path / "chunks"))
+    store.update_index(chunks.iter_nodes(), CountingEmbedding(model_name="counting"), chunk_store=chunks)
+
+    def read_back(*args, **kwargs):
+        raise AssertionError("the collection was read back")
+
+    original = store.iter_chunks
+    store.iter_chunks = read_back
+    lexical = store.load_lexical_index()
+    metadata = store.load_metadata_index()
+    stored = set(store.stored_ids())
+    assert sorted(lexical.node_ids) == sorted(stored)
+    assert sorted(metadata.node_ids) == sorted(stored)
+
+    # Without its chunk store the collection is read back instead
+    store.iter_chunks = original
+    shutil.rmtree(chunks.path)
+    os.remove(store.bm25_path)
+    assert sorted(store.load_lexical_index().node_ids) == sorted(stored)
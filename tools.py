@@ -1,12 +1,17 @@
+import asyncio
+import copy
+import threading
 from abc import ABC, abstractmethod
 from logger_config import logger
-from llama_index.core.node_parser import LangchainNodeParser
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from llama_index.core.retrievers import VectorIndexRetriever
-from utils import load_data, loadllm, loadEmbeddingModel, nodeExtractor, getContextString, extract_json_manually
-from vectorstore import VectorStore
-import json, os
+from utils import loadllm, nodeExtractor, getContextString, extract_json_manually
+from vectorstore import get_shared_index
+from rerank import get_shared_reranker
+from tracing import tracer
+import json
 from termcolor import colored
+
+FILTER_KEYS = ("source", "published_after", "published_before")
+NO_HUMAN_ANSWER = "No human is available to help, continue with what you have or answer \"I don't know\"."
 class Tool(ABC):
     """
     Abstract base class for tools.
@@ -14,11 +19,36 @@ class Tool(ABC):
     Methods:
     run(input_params):
     Abstract method to run the tool with given input parameters.
+    session():
+    Returns the instance to use for a single query.
+    arun(input_params):
+    Runs the tool without blocking the event loop.
+
+    Attributes:
+    dispatch_early : bool
+    Whether a streaming agent may start the tool while the rest of the response is still being printed. Tools
+    that read the terminal must not, their prompt would interleave with the streamed text.
     """
+    dispatch_early = True
+
     @abstractmethod
     def run(self, input_params):
         pass
 
+    async def arun(self, input_params):
+        """
+        Async counterpart of run. By default run is executed in a worker thread, so several tool calls awaited
+        together proceed concurrently.
+        """
+        return await asyncio.to_thread(self.run, input_params)
+
+    def session(self):
+        """
+        Returns the tool instance to use for a single query. Tools that keep per-query state return a copy with
+        fresh state that shares everything expensive with this instance; stateless tools return themselves.
+        """
+        return self
+
 class Retrieve(Tool):
     """
     A retriever tool to retrieve relevant documents based on a query.
@@ -29,40 +59,135 @@ class Retrieve(Tool):
     Methods
     retriever : VectorIndexRetriever
     The retriever object for fetching relevant documents.
+    retrieved_nodes : list
+    Every node retrieved in the current session, in order.
+    seen_ids : set
+    Ids of the chunks already returned in the current session. Later calls skip them and return the next-best
+    chunks instead, so rephrasing a query brings up new articles rather than the same ones again.
     """
-    def __init__(self, top_k):
+    def __init__(self, top_k, handle=None, mode="dense", backend="chroma", rerank=False, context_tokens=None):
         """
         Initializes the Retriever with the top_k parameter and sets up the retriever.
         Parameters
         top_k : int
         The number of top similar documents to retrieve.
+        handle : IndexHandle, optional
+        The index to retrieve from. Defaults to the process-wide shared index, which is only built from
+        the corpus when no persisted index exists.
+        mode : str, optional
+        "dense" for vector similarity only, "hybrid" to fuse it with BM25 keyword matching, which does
+        better on names, outlets and dates.
+        backend : str, optional
+        The vector store backend of the shared index, "chroma", "mmap" or "ivf". Ignored when handle is given.
+        rerank : bool, optional
+        Over-fetch candidates and keep the top_k by cross-encoder score, so fewer, better chunks reach the
+        prompt.
+        context_tokens : int, optional
+        Token budget of each observation. Overlapping chunks are always merged; beyond that, the sentences
+        least related to the query are dropped to fit.
+        """
+        self.handle = handle or get_shared_index(backend=backend)
+        self.top_k = top_k
+        self.mode = mode
+        self.reranker = get_shared_reranker() if rerank else None
+        self.context_tokens = context_tokens
+        self.retriever = self.handle.retriever(top_k, mode=mode, reranker=self.reranker)
+        self._reset()
+
+    def _reset(self):
+        self.retrieved_nodes = []
+        self.seen_ids = set()
+        self._repeats = {}
+        self._lock = threading.Lock()
+
+    def session(self):
+        tool = copy.copy(self)
+        tool._reset()
+        return tool
+
+    def _retrieve_new(self, query, node_ids=None):
+        """
+        Retrieves the top_k best chunks not returned earlier in the session, over-fetching by the number of
+        chunks already seen so that skipping them still leaves top_k candidates.
         """
-        embed_model = loadEmbeddingModel("huggingface")
-        store = VectorStore()
-        vector_store_path = "data/vector/default"
-        data = load_data('data/corpus.json')
-        text_splitter = LangchainNodeParser(RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200))
-        nodes = text_splitter.get_nodes_from_documents(data)
-        if os.path.exists(vector_store_path):
-            index = store.create_index_from_stored(embed_model=embed_model)
+        with self._lock:
+            seen = set(self.seen_ids)
+        if node_ids is None and not seen:
+            retriever = self.retriever
         else:
-            index = store.create_index(llama_index_nodes=nodes, embed_model=embed_model)
-        retriever = VectorIndexRetriever(index=index, similarity_top_k=top_k, embedding_model=embed_model, verbose=True)
-        self.retriever = retriever
+            retriever = self.handle.retriever(self.top_k + len(seen), mode=self.mode, node_ids=node_ids,
+                                              reranker=self.reranker)
+        candidates = retriever.retrieve(query)
+        fresh = [node for node in candidates if node.node.node_id not in seen][:self.top_k]
+        if len(fresh) < len(candidates):
+            logger.info(f"Skipped {len(candidates) - len(fresh)} chunks already retrieved in this session")
+            tracer.current().add("skipped_seen", len(candidates) - len(fresh))
+        with self._lock:
+            fresh = [node for node in fresh if node.node.node_id not in self.seen_ids]
+            self.seen_ids.update(node.node.node_id for node in fresh)
+            self.retrieved_nodes.extend(fresh)
+        return fresh
 
     def run(self, query):
         """
         Runs the retriever engine with the given query and returns the relevant context string.
         Parameters:
-        query : str
+        query : str or dict
         The query string should encompass the essence of the documents that need to be retrieved, enter
         only the content, and only ONE source. DO NOT try to retrieve multiple articles at once.
+        When the question names the source or the time of an article, pass a JSON object instead so only
+        matching articles are searched:
+        {"query": <the content>, "source": <e.g. "TechCrunch">, "published_after": <YYYY-MM-DD>, "published_before": <YYYY-MM-DD>}
+        Every key except "query" is optional and the dates are inclusive.
         Returns:
         context: str
         The context string extracted from the retrieved documents.
         """
-        retrieved_nodes = self.retriever.retrieve(query)
-        context = getContextString(retrieved_nodes)
+        if isinstance(query, str):
+            try:
+                parsed = json.loads(query)
+            except ValueError:
+                parsed = None
+            if isinstance(parsed, dict):
+                query = parsed
+        node_ids = None
+        filters = {}
+        if isinstance(query, dict):
+            filters = {key: query[key] for key in FILTER_KEYS if query.get(key)}
+            query = str(query.get("query", ""))
+            if filters:
+                try:
+                    node_ids = self.handle.metadata.resolve(**filters)
+                except ValueError as e:
+                    logger.warning(f"Invalid retrieval filters {filters}: {e}")
+                    return f"The filters {filters} could not be applied: {e}. Use dates like 2023-11-27."
+                if not node_ids:
+                    return f"No articles match the filters {filters}, relax them or retrieve without them."
+                logger.info(f"Filters {filters} matched {len(node_ids)} chunks")
+        elif not isinstance(query, str):
+            # Models sometimes send a list or a number as the input
+            query = str(query)
+
+        key = (" ".join(query.lower().split()), tuple(sorted((k, str(v)) for k, v in filters.items())))
+        with self._lock:
+            repeat = self._repeats.get(key)
+        if repeat is not None:
+            logger.info(f"Repeated retrieval in this session: {query}")
+            tracer.current().add("repeated_retrievals")
+            return f"This exact retrieval was already made and its result is in the history ({repeat}). " \
+                   f"Retrieve something different or finish."
+
+        with tracer.span("retrieve", mode=self.mode, filters=filters) as span:
+            retrieved_nodes = self._retrieve_new(query, node_ids)
+            span.add("chunks", len(retrieved_nodes))
+        titles = list(dict.fromkeys(str(node.node.metadata.get("title", node.node.node_id))
+                                    for node in retrieved_nodes))
+        with self._lock:
+            self._repeats[key] = "articles: " + "; ".join(titles) if titles else "no new articles"
+        if not retrieved_nodes:
+            return "Every article matching this query has already been retrieved in this session, see the " \
+                   "observations above. Retrieve something different or finish."
+        context = getContextString(retrieved_nodes, query=query, max_tokens=self.context_tokens)
         return context
 
 
@@ -70,11 +195,31 @@ class AskHuman(Tool):
     """
     A tool that prompts a human for assistance in answering a query.
 
+    Parameters
+    responder : callable, optional
+    Asks the human without a terminal, e.g. a client of the server: called with the query and the timeout, it
+    returns the answer, or None when nobody answered in time. Without one the human is asked on stdin.
+    timeout : float, optional
+    Seconds the responder waits for an answer.
+
     Methods:
     run(query):
     Prompts the user with a query to obtain human assistance.
     """
 
+    def __init__(self, responder=None, timeout=None):
+        self.responder = responder
+        self.timeout = timeout
+
+    def session(self):
+        # The responder is set per query, e.g. to reach the client that asked it
+        return copy.copy(self)
+
+    @property
+    def dispatch_early(self):
+        # Without a responder the human is asked on stdin, which waits until the response is printed
+        return self.responder is not None
+
     def run(self, query):
         """
         Prompts the human for help and awaits their input. Use this when the retrieved information is
@@ -89,6 +234,12 @@ class AskHuman(Tool):
         response : str
         The response provided by the human.
         """
+        if self.responder is not None:
+            answer = self.responder(query, self.timeout)
+            if answer is None:
+                logger.info("Nobody answered the agent's question in time")
+                return NO_HUMAN_ANSWER
+            return answer
         return input(
             colored(f"You have been summoned by the agent to help with the query: {query}\nAnswer it the best you can so it helps the agent: ", 'cyan', attrs=['bold'])) + " Do not irritate me again by asking for help"
 
@@ -0,0 +1,198 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from logger_config import logger
+
+# Setting TRACE_FILE turns tracing on for every entry point, spans are appended to that file
+TRACE_FILE_ENV = "TRACE_FILE"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "agent"
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """What Tracer.span returns while tracing is off: every method does nothing."""
+    recording = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, name, value=1):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    A timed operation within a trace. Spans opened while another is current become its children, also across
+    asyncio tasks and threads started with the context copied.
+
+    Attributes:
+        name (str): What was timed, e.g. "llm" or "tool".
+        trace_id (str): Shared by all spans below the same root span.
+        span_id (str): Unique id of this span.
+        parent_id (str): span_id of the enclosing span, None for a root span.
+        attributes (dict): Values describing the operation.
+    """
+    recording = True
+
+    def __init__(self, tracer, name, attributes):
+        parent = _current.get()
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes)
+        self._counted = {}
+        self._token = None
+
+    def set(self, **attributes):
+        """Records attributes of the span."""
+        self.attributes.update(attributes)
+
+    def add(self, name, value=1):
+        """Adds value to an attribute of the span and to the counter of that name across all spans of this kind."""
+        self.attributes[name] = self.attributes.get(name, 0) + value
+        self._counted[name] = self._counted.get(name, 0) + value
+
+    def __enter__(self):
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._start
+        _current.reset(self._token)
+        self.tracer.finish(self, duration, None if exc is None else f"{exc_type.__name__}: {exc}")
+        return False
+
+
+class Metrics:
+    """
+    Counters and latency histograms aggregated over spans, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, span_name, seconds):
+        with self._lock:
+            histogram = self.histograms.setdefault(span_name, {"buckets": [0] * (len(self.buckets) + 1),
+                                                               "sum": 0.0, "count": 0})
+            histogram["buckets"][bisect_left(self.buckets, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def count(self, name, span_name, value=1):
+        with self._lock:
+            key = (name, span_name)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            lines = [f"# HELP {METRIC_PREFIX}_span_seconds Duration of traced operations.",
+                     f"# TYPE {METRIC_PREFIX}_span_seconds histogram"]
+            for span_name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f'{METRIC_PREFIX}_span_seconds_bucket{{span="{span_name}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{span_name}"}} {histogram["sum"]:.6f}')
+                lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{span_name}"}} {histogram["count"]}')
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+                for (counter, span_name), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f'{METRIC_PREFIX}_{name}_total{{span="{span_name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """
+    Records spans around the agent's steps, LLM calls and tool runs.
+
+    Finished spans are appended to a JSONL file, one object per span, and aggregated into Metrics. While
+    disabled, span() hands out a shared no-op span, so instrumented code costs one attribute check; code that
+    computes attributes should only do so when span.recording is set.
+
+    Attributes:
+        enabled (bool): Whether spans are recorded.
+        path (str): JSONL file the spans are appended to, None to only aggregate metrics.
+        metrics (Metrics): The aggregates of every finished span.
+    """
+
+    def __init__(self, path=None, enabled=False):
+        self.enabled = enabled
+        self.path = path
+        self.metrics = Metrics()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def configure(self, path=None, enabled=True):
+        """Turns tracing on or off and sets the file spans are written to."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+            self.enabled = enabled
+        if enabled:
+            logger.info(f"Tracing enabled{f', writing spans to {path}' if path else ''}")
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    @staticmethod
+    def current():
+        """The innermost open span of the calling context, or the no-op span."""
+        return _current.get() or NOOP_SPAN
+
+    def finish(self, span, duration, error=None):
+        self.metrics.observe(span.name, duration)
+        for name, value in span._counted.items():
+            self.metrics.count(name, span.name, value)
+        if error is not None:
+            self.metrics.count("errors", span.name)
+        if not self.path:
+            return
+        record = {"trace_id": span.trace_id, "span_id": span.span_id, "parent_id": span.parent_id,
+                  "name": span.name, "start": span.start, "duration_ms": duration * 1000,
+                  "attributes": span.attributes, "error": error}
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'a', buffering=1)
+            self._file.write(line)
+
+    def write_metrics(self, path):
+        with open(path + ".tmp", 'w') as file:
+            file.write(self.metrics.render())
+        os.replace(path + ".tmp", path)
+
+
+tracer = Tracer()
+if os.environ.get(TRACE_FILE_ENV):
+    tracer.configure(os.environ[TRACE_FILE_ENV])
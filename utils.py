@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import re
@@ -5,8 +6,15 @@ from typing import Any, Generator, List, Optional
 from llama_index.core.schema import QueryBundle, MetadataMode
 from llama_index.core.llms import ChatMessage
 from logger_config import logger
+from embedding_cache import EmbeddingCache, CachedEmbedding
+from llm_cache import LLMCache, CachedLLM, DEFAULT_CACHE_PATH as DEFAULT_LLM_CACHE_PATH
+from ratelimit import RateLimiter, RateLimitedLLM
+from context import assemble_context
+from standin_llm import StandInLLM
 from llama_index.core import Settings
 from llama_index.core import Document
+from llama_index.core.node_parser import LangchainNodeParser
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.llms.groq import Groq
@@ -16,22 +24,98 @@ from llama_index.llms.openai import OpenAI
 
 DEFAULT_MAX_TOKENS = 2048
 DEFAULT_TEMP = 0.5
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+DOCUMENT_WINDOW = 256
+READ_BLOCK_SIZE = 1 << 20
+_SEPARATORS = re.compile(r"[\s,]*")
+
+DEFAULT_LLM_NAMES = {"Ollama": "llama3", "Groq": "llama3-70b-8192", "OpenAI": "gpt-4", "StandIn": "stand-in"}
 
-os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY")
 os.environ["OLLAMA_BASE_URL"] = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+
+def document_fingerprint(data: dict) -> str:
+    """Content hash of a corpus article, used as its stable document id."""
+    content = json.dumps([data['title'], data['published_at'], data['source'], data['body']])
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def chunk_id_func(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    """
+    Returns a node id function for the splitter. The id of a chunk only depends on its document's content
+    and the splitter settings, so unchanged chunks keep their id across runs.
+    """
+    def id_func(i, doc):
+        return hashlib.sha1(f"{doc.doc_id}:{chunk_size}:{chunk_overlap}:{i}".encode("utf-8")).hexdigest()
+    return id_func
+
+def iter_records(input_file: str, block_size: int = READ_BLOCK_SIZE) -> Generator[dict, None, None]:
+    """
+    Yields the articles of a corpus file one at a time without reading the whole file, so memory does not grow
+    with the corpus. The file is either one JSON array, which is parsed incrementally, or JSON Lines.
+    """
+    with open(input_file, 'r', encoding='utf-8') as file:
+        head = file.read(block_size)
+        if not head.lstrip().startswith('['):
+            file.seek(0)
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = head.lstrip()[1:]
+        position = 0
+        eof = False
+        while True:
+            position = _SEPARATORS.match(buffer, position).end()
+            if position < len(buffer):
+                if buffer[position] == ']':
+                    return
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                    yield record
+                    continue
+                except json.JSONDecodeError:
+                    # The record is cut off at the end of the buffer, unless the file has ended
+                    if eof:
+                        raise
+            elif eof:
+                raise ValueError(f"{input_file} ends inside its JSON array")
+            # Read at least as much as is buffered, so a record longer than a block is not re-parsed block by block
+            more = file.read(max(block_size, len(buffer) - position))
+            eof = not more
+            buffer, position = buffer[position:] + more, 0
+
+def record_to_document(data: dict) -> Document:
+    """Turns a corpus article into a Document with its content hash as id."""
+    metadata = {"title": data['title'], "published_at": data['published_at'], "source": data['source']}
+    return Document(text=data['body'], metadata=metadata, id_=document_fingerprint(data))
+
+def make_text_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    """Returns the node parser that splits the corpus, with stable chunk ids."""
+    return LangchainNodeParser(RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+                               id_func=chunk_id_func(chunk_size, chunk_overlap))
 
 def load_data(input_file: str) -> List[Document]:
     """Load data from the input file."""
-    documents = []
-    with open(input_file, 'r') as file:
-        load_data = json.load(file)
-    for data in load_data:
-        metadata = {"title": data['title'], "published_at": data['published_at'], "source": data['source']}
-        documents.append(Document(text=data['body'], metadata=metadata))
-    return documents
-
-def loadEmbeddingModel(host, name=None):
+    return [record_to_document(data) for data in iter_records(input_file)]
+
+def load_nodes(input_file: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    """Load the corpus from the input file and split it into nodes ready for indexing."""
+    documents = load_data(input_file)
+    nodes = make_text_splitter(chunk_size, chunk_overlap).get_nodes_from_documents(documents)
+    logger.info(f"Split {len(documents)} documents from {input_file} into {len(nodes)} nodes")
+    return nodes
+
+def withEmbeddingCache(model, cache=None):
+    """Wraps the model in a CachedEmbedding when cache is an EmbeddingCache, or True for the default on-disk one."""
+    if not cache or model is None:
+        return model
+    if cache is True:
+        cache = EmbeddingCache()
+    return CachedEmbedding(model, cache)
+
+def loadEmbeddingModel(host, name=None, cache=None, num_threads=None):
     if host == "ollama":
         default_name = "nomic-embed-text"
         logger.info(f"Loading ollama model {default_name} by default. You can change it with the 'name' parameter.")
@@ -40,7 +124,7 @@ def loadEmbeddingModel(host, name=None):
                 model_name=name or default_name,
                 base_url=os.environ.get("OLLAMA_BASE_URL"),
             )
-            return model
+            return withEmbeddingCache(model, cache)
         except Exception as e:
             logger.error(f"Error loading ollama model: {e}")
     elif host == "huggingface":
@@ -48,13 +132,51 @@ def loadEmbeddingModel(host, name=None):
         logger.info(f"Loading huggingface model {default_name} by default. You can change it with the 'name' parameter.")
         try:
             model = HuggingFaceEmbedding(model_name=name or default_name)
-            return model
+            return withEmbeddingCache(model, cache)
         except Exception as e:
             logger.error(f"Error loading huggingface model: {e}")
+    elif host == "onnx":
+        # The int8 ONNX export of the huggingface model, exported on first use, see onnx_embedding
+        from onnx_embedding import load_onnx_embedding, DEFAULT_MODEL_NAME
+        logger.info(f"Loading the ONNX export of {name or DEFAULT_MODEL_NAME}")
+        try:
+            model = load_onnx_embedding(name or DEFAULT_MODEL_NAME, num_threads=num_threads)
+            return withEmbeddingCache(model, cache)
+        except Exception as e:
+            logger.error(f"Error loading onnx model: {e}")
     else:
         raise ValueError(f"Unsupported model type: {host}")
 
-def loadllm(host, name=None, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMP):
+def embeddingModelName(embed_model):
+    """Name recorded in index manifests to tell which model produced the stored vectors."""
+    return getattr(embed_model, "model_name", None) or embed_model.__class__.__name__
+
+def loadllm(host, name=None, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMP, cache_mode=None,
+            cache_path=DEFAULT_LLM_CACHE_PATH, requests_per_minute=None):
+    """
+    Loads the LLM for the given host. With cache_mode "readwrite", "record" or "replay" (defaulting to the
+    LLM_CACHE_MODE environment variable) it is wrapped in a CachedLLM; see llm_cache for what each mode does.
+    Replay works without provider credentials, since no request ever reaches the provider.
+
+    With requests_per_minute set, requests that reach the provider are rate limited client-side. Cache hits
+    are not.
+    """
+    cache_mode = cache_mode or os.environ.get("LLM_CACHE_MODE", "off")
+    if cache_mode == "replay" and not os.environ.get(f"{host.upper()}_API_KEY") and host != "Ollama":
+        llm = None
+    else:
+        llm = loadProviderLLM(host, name, max_tokens, temperature)
+    # Key the cache on the model actually called, the name is only a request that a provider may not honour
+    model = getattr(llm, "model", None) or name or DEFAULT_LLM_NAMES.get(host)
+    if llm is not None and requests_per_minute:
+        llm = RateLimitedLLM(llm, RateLimiter(requests_per_minute))
+    if cache_mode == "off" or (llm is None and cache_mode != "replay"):
+        return llm
+    logger.info(f"Caching {host} llm responses in {cache_path} ({cache_mode} mode)")
+    return CachedLLM(llm, LLMCache(cache_path), provider=host, model=model,
+                     temperature=temperature, max_tokens=max_tokens, mode=cache_mode)
+
+def loadProviderLLM(host, name=None, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMP):
     if host == "Ollama":
         default_name = "llama3"
         logger.info(f"Loading ollama llm {default_name} by default. You can change it with the 'name' parameter.")
@@ -76,7 +198,8 @@ def loadllm(host, name=None, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_
             return None
         default_name = "llama3-70b-8192"
         try:
-            Settings.llm = Groq(model=default_name, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+            Settings.llm = Groq(model=name or default_name, api_key=api_key, temperature=temperature,
+                                max_tokens=max_tokens)
             return Settings.llm
         except Exception as e:
             logger.error(f"Error loading groq llm model: {e}")
@@ -91,6 +214,9 @@ def loadllm(host, name=None, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_
             return model
         except Exception as e:
             logger.error(f"Error loading Open AI llm model: {e}")
+    elif host == "StandIn":
+        logger.info("Loading the offline stand-in llm, its answers are heuristic")
+        return StandInLLM()
 
 def nodeExtractor(context_list):
     context_nodes = []
@@ -102,15 +228,21 @@ def nodeExtractor(context_list):
         })
     return context_nodes
 
-def getContextString(nodes):
-    contexts = []
-    for node in nodes:
-        content = node.get_content(metadata_mode=MetadataMode.LLM).replace("\n\n", "\n")
-        contexts.append(content)
-    context_str = "\n\n".join(contexts)
-    return context_str
+def getContextString(nodes, query=None, max_tokens=None):
+    """
+    Context string of the retrieved nodes, with overlapping chunks of an article merged under a single header
+    and, given max_tokens, the sentences least related to query dropped to fit. See context.assemble_context.
+    """
+    return assemble_context(nodes, query=query, max_tokens=max_tokens)
 
 def extract_json_manually(text):
+    # Try the widest {...} span first so nested objects survive, then the first flat one
+    start, end = text.find('{'), text.rfind('}')
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            pass
     try:
         match = re.search(r'\{.*?}', text, re.DOTALL)
         if match:
@@ -1,58 +1,483 @@
 import shutil
+import threading
+import time
 from abc import ABC, abstractmethod
-from utils import loadEmbeddingModel
+from utils import loadEmbeddingModel, embeddingModelName
 import chromadb, os
 from logger_config import logger
+from indexing import EmbeddingPipeline
+from chunk_store import load_chunk_store, ChunkStore, META_FILE as CHUNK_STORE_META_FILE
+from lexical import BM25Index, HybridRetriever, BM25_FILE
+from rerank import RerankingRetriever, DEFAULT_FETCH_K as RERANK_FETCH_K
+from metadata_index import MetadataIndex, METADATA_INDEX_FILE
+from mmap_store import MmapVectorStore
+from manifest import IndexManifest, MANIFEST_FILE
+from ivf import IVFVectorStore
 from llama_index.core import VectorStoreIndex
+from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core.schema import MetadataMode
+import numpy as np
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+from llama_index.core.vector_stores.utils import node_to_metadata_dict, metadata_dict_to_node
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core import StorageContext
 
 DATABASE_PATH = "data/vector"
+# Embedding host of the indexes opened through get_shared_index, e.g. "onnx" for the quantized ONNX export
+EMBED_HOST = os.environ.get("EMBED_HOST", "huggingface")
+CORPUS_PATH = "data/corpus.json"
+DELETE_BATCH_SIZE = 5000
+FETCH_BATCH_SIZE = 5000
 
 
 class VectorStore(ABC):
+    """
+    A named, persisted collection of embedded chunks with a manifest of what it holds.
+
+    Subclasses provide the storage backend: opening it as a llama_index vector store and reading, writing and
+    deleting chunks. Incremental updates, resuming interrupted builds and the lexical index are shared.
+    """
     def __init__(self, database_path=DATABASE_PATH, name="default"):
         self.database_path = database_path
         self.name = name
 
+    @property
+    def path(self):
+        return os.path.join(self.database_path, self.name)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @property
+    def bm25_path(self):
+        return os.path.join(self.path, BM25_FILE)
+
+    @property
+    def metadata_index_path(self):
+        return os.path.join(self.path, METADATA_INDEX_FILE)
+
+    @abstractmethod
+    def vector_store(self):
+        """Opens the stored collection as a llama_index vector store, creating it if needed."""
+
+    @abstractmethod
+    def stored_ids(self):
+        """Returns the id of every stored chunk."""
+
+    @abstractmethod
+    def delete_chunks(self, node_ids):
+        pass
+
+    def clear(self):
+        """Deletes every stored chunk, so the next write may hold vectors of another dimension."""
+        self.delete_chunks(self.stored_ids())
+
+    @abstractmethod
+    def write_chunks(self, nodes):
+        """Writes embedded nodes, replacing any stored chunk with the same id."""
+
+    @abstractmethod
+    def iter_chunks(self, batch_size=1000):
+        """Yields (node id, text, metadata) for every stored chunk."""
+
+    def get_nodes(self, node_ids):
+        """
+        Returns the stored nodes with the given ids, in the same order.
+        """
+        nodes = self.vector_store().get_nodes(node_ids=list(node_ids))
+        by_id = {node.node_id: node for node in nodes}
+        return [by_id[node_id] for node_id in node_ids if node_id in by_id]
+
+    def indexed_chunks(self):
+        """
+        Yields (node id, text, metadata) for every stored chunk. They are read from the chunk store the collection
+        was last synced with, which is much cheaper than reading the collection back, unless that store is gone.
+        """
+        manifest = self.manifest()
+        path, complete = manifest.chunk_store, manifest.complete
+        manifest.close()
+        if not (complete and path and os.path.exists(os.path.join(path, CHUNK_STORE_META_FILE))):
+            yield from self.iter_chunks()
+            return
+        logger.info(f"Reading the chunks of {self.path} from {path}")
+        # Identical articles split into the same ids, the collection holds them once
+        seen = set()
+        for node_id, text, metadata in ChunkStore(path).iter_chunks():
+            if node_id not in seen:
+                seen.add(node_id)
+                yield node_id, text, metadata
+
+    def load_lexical_index(self):
+        """
+        Returns the BM25 index over the stored chunks, building and saving it next to the collection when it is
+        missing. update_index removes it, so it never goes stale.
+        """
+        if os.path.exists(self.bm25_path):
+            return BM25Index.load(self.bm25_path)
+        lexical = BM25Index.build((node_id, text) for node_id, text, _ in self.indexed_chunks())
+        lexical.save(self.bm25_path)
+        return lexical
+
+    def load_metadata_index(self):
+        """
+        Returns the source and publication date index over the stored chunks, building and saving it next to the
+        collection when it is missing. Like the BM25 index, update_index removes it.
+        """
+        if os.path.exists(self.metadata_index_path):
+            return MetadataIndex.load(self.metadata_index_path)
+        metadata_index = MetadataIndex.build((node_id, metadata) for node_id, _, metadata in self.indexed_chunks())
+        metadata_index.save(self.metadata_index_path)
+        return metadata_index
+
     def create_index_from_stored(self, embed_model):
         logger.info("Index already exists")
-        client = chromadb.PersistentClient(path=os.path.join(self.database_path, self.name))
-        collection = client.get_collection(self.name)
-        vectorstore = ChromaVectorStore(chroma_collection=collection)
         index = VectorStoreIndex.from_vector_store(
-            vector_store=vectorstore, embed_model=embed_model, show_progress=True
+            vector_store=self.vector_store(), embed_model=embed_model, show_progress=True
         )
         logger.info("Vector store index created")
         return index
 
-    def create_index(self, llama_index_nodes, embed_model):
+    def manifest(self):
+        """
+        Opens the manifest of the stored collection: the embedding model that produced its vectors and the id of
+        every chunk in it, with the id of its document. Close it when done.
+        """
+        return IndexManifest(os.path.join(self.path, MANIFEST_FILE))
+
+    def create_index(self, llama_index_nodes, embed_model, pipeline=None, chunk_store=None):
         logger.info("Starting index creation process")
-        if os.path.exists(os.path.join(self.database_path, self.name)):
+        if os.path.exists(self.path):
             try:
-                shutil.rmtree(os.path.join(self.database_path, self.name))
+                shutil.rmtree(self.path)
                 logger.info("Index already existed, so deleting before creating again")
             except Exception as e:
                 logger.info(f"Index existed but could not delete, this WILL cause retrieval to fail,"
                             f"please resolve manually: {e}")
 
-        chroma_client = chromadb.PersistentClient(path=os.path.join(self.database_path, self.name))
-        logger.info("Created Chroma persistent client")
+        return self.update_index(llama_index_nodes, embed_model, pipeline=pipeline, chunk_store=chunk_store)
+
+    def update_index(self, llama_index_nodes, embed_model, pipeline=None, chunk_store=None):
+        """
+        Incrementally syncs the stored collection with the given nodes. Node ids are content hashes
+        (see utils.chunk_id_func), so only chunks missing from the manifest are embedded and chunks that
+        disappeared from the corpus are deleted. Changing the embedding model re-embeds everything.
+
+        llama_index_nodes may be a generator such as ChunkStore.iter_nodes: nodes are embedded and written batch by
+        batch as they arrive, and chunks that never showed up are deleted at the end. Which chunks were met is
+        tracked in the SQLite manifest rather than in memory, so memory stays bounded by the batch size rather
+        than the corpus. Every written batch is committed to the manifest, so an interrupted build picks up where
+        it stopped the next time this is called.
 
-        collection = chroma_client.get_or_create_collection(self.name)
+        chunk_store is the ChunkStore the nodes come from, if any. It is recorded in the manifest so the BM25 and
+        metadata indexes are later built from it rather than from the collection.
+        """
+        start = time.perf_counter()
+        vectorstore = self.vector_store()
         logger.info(f"Created or retrieved collection {self.name}")
 
-        vectorstore = ChromaVectorStore(chroma_collection=collection)
+        model_name = embeddingModelName(embed_model)
+        manifest = self.manifest()
+        try:
+            # Collections built before manifests existed have random node ids, nothing in them can be reused
+            reusable = manifest.embed_model == model_name
+            if manifest.embed_model is not None and not reusable:
+                logger.info(f"Embedding model changed from {manifest.embed_model} to {model_name}, "
+                            f"re-embedding every chunk")
+            if not reusable:
+                self.clear()
+                vectorstore = self.vector_store()
 
-        storage_context = StorageContext.from_defaults(vector_store=vectorstore)
-        logger.info("Storage context created")
+            for derived_path in (self.bm25_path, self.metadata_index_path):
+                if os.path.exists(derived_path):
+                    os.remove(derived_path)
+
+            manifest.begin(model_name, reset=not reusable,
+                           chunk_store=os.path.abspath(chunk_store.path) if chunk_store is not None else None)
+            counts = {"new": 0, "unchanged": 0}
+
+            def new_nodes():
+                for node in llama_index_nodes:
+                    state = manifest.see(node.node_id, node.ref_doc_id)
+                    if state == "stored":
+                        counts["unchanged"] += 1
+                    elif state == "new":
+                        counts["new"] += 1
+                        yield node
+
+            def write_batch(nodes):
+                self.write_chunks(nodes)
+                manifest.stored([node.node_id for node in nodes])
+
+            pipeline = pipeline or EmbeddingPipeline(embed_model=embed_model)
+            pipeline.run(new_nodes(), write_batch)
+
+            stale_ids = manifest.stale_ids()
+            self.delete_chunks(stale_ids)
+            manifest.finish(stale_ids)
+        finally:
+            manifest.close()
+        logger.info(f"Vector store index updated in {time.perf_counter() - start:.1f}s: {counts['new']} chunks "
+                    f"embedded, {len(stale_ids)} removed, {counts['unchanged']} unchanged")
+
+        return VectorStoreIndex.from_vector_store(vector_store=vectorstore, embed_model=embed_model)
+
+    def load_or_create_index(self, embed_model, corpus_path=CORPUS_PATH):
+        """
+        Opens the persisted index, only loading and splitting the corpus when there is nothing stored yet. The
+        chunks are read from the corpus' chunk store, so a rebuild does not split the corpus again.
+        """
+        if self.exists():
+            manifest = self.manifest()
+            stored_model, complete = manifest.embed_model, manifest.complete
+            manifest.close()
+            if stored_model not in (None, embeddingModelName(embed_model)):
+                logger.warning(f"The index at {self.path} was embedded by {stored_model}, its vectors are "
+                               f"not comparable to those of {embeddingModelName(embed_model)}. Rebuild it with "
+                               f"build_index.py and the same embedding model.")
+            if complete:
+                return self.create_index_from_stored(embed_model=embed_model)
+            logger.info(f"Index build at {self.path} was interrupted, resuming it from {corpus_path}")
+            chunks = load_chunk_store(corpus_path)
+            return self.update_index(llama_index_nodes=chunks.iter_nodes(), embed_model=embed_model,
+                                     chunk_store=chunks)
+        logger.info(f"No stored index at {self.path}, building it from {corpus_path}")
+        chunks = load_chunk_store(corpus_path)
+        return self.create_index(llama_index_nodes=chunks.iter_nodes(), embed_model=embed_model, chunk_store=chunks)
+
+
+class SubsetChromaVectorStore(ChromaVectorStore):
+    """
+    ChromaVectorStore that honours VectorStoreQuery.node_ids, which Chroma's query API cannot express. The
+    embeddings of just those chunks are fetched and scored by cosine similarity with NumPy.
+    """
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SubsetChromaVectorStore"
+
+    def query(self, query, **kwargs):
+        if query.node_ids is None:
+            return super().query(query, **kwargs)
+        ids, embeddings, documents, metadatas = [], [], [], []
+        for i in range(0, len(query.node_ids), FETCH_BATCH_SIZE):
+            result = self._collection.get(ids=query.node_ids[i:i + FETCH_BATCH_SIZE],
+                                          include=["embeddings", "documents", "metadatas"])
+            ids.extend(result["ids"])
+            embeddings.extend(result["embeddings"])
+            documents.extend(result["documents"])
+            metadatas.extend(result["metadatas"])
+        if not ids:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        scores = vectors @ embedding / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(embedding), 1e-12)
+        best = np.argsort(-scores)[:query.similarity_top_k]
+        nodes = []
+        for i in best:
+            node = metadata_dict_to_node(metadatas[i])
+            node.set_content(documents[i])
+            nodes.append(node)
+        return VectorStoreQueryResult(nodes=nodes, similarities=[float(scores[i]) for i in best],
+                                      ids=[ids[i] for i in best])
+
+
+class ChromaStore(VectorStore):
+    """A collection in a Chroma PersistentClient database at data/vector/<name>."""
+
+    def collection(self):
+        return chromadb.PersistentClient(path=self.path).get_or_create_collection(self.name)
+
+    def vector_store(self):
+        return SubsetChromaVectorStore(chroma_collection=self.collection())
+
+    def stored_ids(self):
+        return self.collection().get(include=[])["ids"]
+
+    def clear(self):
+        # Chroma fixes a collection's dimension on the first write, only a new collection takes another one
+        client = chromadb.PersistentClient(path=self.path)
+        if self.name in [collection.name for collection in client.list_collections()]:
+            client.delete_collection(self.name)
+
+    def delete_chunks(self, node_ids):
+        vectorstore = self.vector_store()
+        for i in range(0, len(node_ids), DELETE_BATCH_SIZE):
+            vectorstore.delete_nodes(node_ids=node_ids[i:i + DELETE_BATCH_SIZE])
+
+    def write_chunks(self, nodes):
+        upsert_nodes(self.collection(), nodes)
+
+    def iter_chunks(self, batch_size=1000):
+        collection = self.collection()
+        offset = 0
+        while True:
+            result = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not result["ids"]:
+                break
+            yield from zip(result["ids"], result["documents"], result["metadatas"])
+            offset += len(result["ids"])
+
+
+class MmapStore(VectorStore):
+    """
+    A MmapVectorStore at data/vector/<name>.mmap: the embeddings as one memory-mapped matrix searched exactly
+    with NumPy, without a database client.
+    """
+    def __init__(self, database_path=DATABASE_PATH, name="default", dtype="float16"):
+        super().__init__(database_path=database_path, name=name)
+        self.dtype = dtype
+        self._vector_store = None
+
+    @property
+    def path(self):
+        return os.path.join(self.database_path, f"{self.name}.mmap")
+
+    def vector_store(self):
+        if self._vector_store is None or not os.path.exists(self.path):
+            self._vector_store = MmapVectorStore(self.path, dtype=self.dtype)
+        return self._vector_store
+
+    def stored_ids(self):
+        return self.vector_store().node_ids()
+
+    def delete_chunks(self, node_ids):
+        self.vector_store().delete_nodes(node_ids=node_ids)
+
+    def write_chunks(self, nodes):
+        self.vector_store().add(nodes)
+
+    def iter_chunks(self, batch_size=1000):
+        vectorstore = self.vector_store()
+        node_ids = vectorstore.node_ids()
+        for i in range(0, len(node_ids), batch_size):
+            for node in vectorstore.get_nodes(node_ids=node_ids[i:i + batch_size]):
+                yield node.node_id, node.get_content(metadata_mode=MetadataMode.NONE), node.metadata
+
+
+class IVFStore(MmapStore):
+    """
+    An IVFVectorStore at data/vector/<name>.ivf: full-precision vectors in a memory map, searched approximately
+    through an inverted file index with int8 or product-quantised codes and re-ranked on the full vectors.
+
+    The keyword arguments are the IVFVectorStore knobs: nlist, nprobe, quantizer, pq_m and refine.
+    """
+    def __init__(self, database_path=DATABASE_PATH, name="default", dtype="float32", **ivf_options):
+        super().__init__(database_path=database_path, name=name, dtype=dtype)
+        self.ivf_options = ivf_options
+
+    @property
+    def path(self):
+        return os.path.join(self.database_path, f"{self.name}.ivf")
+
+    def vector_store(self):
+        if self._vector_store is None or not os.path.exists(self.path):
+            self._vector_store = IVFVectorStore(self.path, dtype=self.dtype, **self.ivf_options)
+        return self._vector_store
+
+    def update_index(self, llama_index_nodes, embed_model, pipeline=None, chunk_store=None):
+        index = super().update_index(llama_index_nodes, embed_model, pipeline=pipeline, chunk_store=chunk_store)
+        self.vector_store().ensure_ivf()
+        return index
+
+
+STORE_BACKENDS = {"chroma": ChromaStore, "mmap": MmapStore, "ivf": IVFStore}
+
+
+def open_store(backend="chroma", database_path=DATABASE_PATH, name="default", **options):
+    """Returns the store of the given backend, options are passed to its constructor."""
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"Unsupported vector store backend: {backend}")
+    return STORE_BACKENDS[backend](database_path=database_path, name=name, **options)
+
+
+def upsert_nodes(collection, nodes):
+    """
+    Writes embedded nodes to a Chroma collection in one bulk call, in the same layout ChromaVectorStore.add uses.
+    Upserting keeps the write idempotent when a resumed build re-embeds chunks written after the last checkpoint.
+    """
+    metadatas = []
+    for node in nodes:
+        metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=True)
+        metadatas.append({key: "" if value is None else value for key, value in metadata.items()})
+    collection.upsert(
+        ids=[node.node_id for node in nodes],
+        embeddings=[node.get_embedding() for node in nodes],
+        metadatas=metadatas,
+        documents=[node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes],
+    )
+
+
+class IndexHandle:
+    """
+    A loaded index together with the store and embedding model behind it.
+
+    Handles are shared process-wide through get_shared_index so every entry point reuses one warm index.
+    """
+    def __init__(self, store, index, embed_model):
+        self.store = store
+        self.index = index
+        self.embed_model = embed_model
+        self._lexical = None
+        self._metadata = None
+        self._lock = threading.Lock()
+
+    @property
+    def lexical(self):
+        """The BM25 index over the same chunks, loaded on first use."""
+        with self._lock:
+            if self._lexical is None:
+                self._lexical = self.store.load_lexical_index()
+            return self._lexical
+
+    @property
+    def metadata(self):
+        """The source and publication date index over the same chunks, loaded on first use."""
+        with self._lock:
+            if self._metadata is None:
+                self._metadata = self.store.load_metadata_index()
+            return self._metadata
+
+    def retriever(self, top_k, mode="dense", fetch_k=20, node_ids=None, reranker=None, rerank_fetch_k=RERANK_FETCH_K):
+        """
+        Returns a retriever over the index, or over just the chunks in node_ids when given.
+
+        mode "dense" is plain vector similarity, "hybrid" fuses the fetch_k best dense and BM25 candidates with
+        reciprocal rank fusion. With a reranker, rerank_fetch_k candidates are retrieved that way and the top_k
+        after cross-encoder reranking are returned.
+        """
+        if reranker is not None:
+            candidates = self.retriever(max(top_k, rerank_fetch_k), mode=mode, fetch_k=max(fetch_k, rerank_fetch_k),
+                                        node_ids=node_ids)
+            return RerankingRetriever(candidates, reranker, top_k)
+        if mode == "dense":
+            return VectorIndexRetriever(index=self.index, similarity_top_k=top_k, embed_model=self.embed_model,
+                                        node_ids=node_ids, verbose=True)
+        if mode == "hybrid":
+            dense = VectorIndexRetriever(index=self.index, similarity_top_k=max(top_k, fetch_k),
+                                         embed_model=self.embed_model, node_ids=node_ids)
+            return HybridRetriever(dense, self.lexical, self.store, top_k, fetch_k=fetch_k, node_ids=node_ids)
+        raise ValueError(f"Unsupported retrieval mode: {mode}")
+
+
+_shared_handles = {}
+_shared_lock = threading.Lock()
 
-        index = VectorStoreIndex(
-            nodes=llama_index_nodes,
-            embed_model=embed_model,
-            storage_context=storage_context,
-            show_progress=True,
-        )
-        logger.info("Vector store index created")
 
-        return index
\ No newline at end of file
+def get_shared_index(embed_host=EMBED_HOST, embed_name=None, database_path=DATABASE_PATH, name="default",
+                     corpus_path=CORPUS_PATH, embed_cache=True, backend="chroma", store_options=None):
+    """
+    Returns the process-wide IndexHandle for the given store, loading it on first use. Query embeddings go
+    through the on-disk embedding cache unless embed_cache is False. backend is a key of STORE_BACKENDS and
+    store_options are passed to its constructor.
+    """
+    store_options = store_options or {}
+    key = (embed_host, embed_name, database_path, name, backend, tuple(sorted(store_options.items())))
+    with _shared_lock:
+        handle = _shared_handles.get(key)
+        if handle is None:
+            embed_model = loadEmbeddingModel(embed_host, embed_name, cache=embed_cache)
+            store = open_store(backend, database_path=database_path, name=name, **store_options)
+            index = store.load_or_create_index(embed_model=embed_model, corpus_path=corpus_path)
+            handle = IndexHandle(store, index, embed_model)
+            _shared_handles[key] = handle
+        return handle